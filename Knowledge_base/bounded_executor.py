@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# async endpoint 呼叫同步的 boto3 API 時, 交給有上限的 thread pool 執行, 不阻塞 event loop
+# - 同時執行的呼叫數上限為 max_concurrency, 其餘請求最多排隊 queue_timeout 秒, 超過即回 503
+# - 每個呼叫最多等 timeout 秒 (回 504); 用戶端中途斷線則不再等待
+# - 執行緒無法強制中止, 已開始的呼叫會跑完 (由 botocore read_timeout 限制), 名額在執行緒結束時才歸還,
+#   因此實際在 AWS 上的並行數永遠不超過上限
+KB_MAX_CONCURRENCY = int(os.getenv('KB_MAX_CONCURRENCY', '16'))
+KB_REQUEST_TIMEOUT_SECONDS = float(os.getenv('KB_REQUEST_TIMEOUT_SECONDS', '60'))
+KB_QUEUE_TIMEOUT_SECONDS = float(os.getenv('KB_QUEUE_TIMEOUT_SECONDS', '10'))
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class Overloaded(Exception):
+    "No execution slot became free within the queue timeout."
+
+
+class ClientDisconnected(Exception):
+    "The HTTP client went away before the call finished."
+
+
+class BoundedExecutor:
+    "Thread pool for blocking calls from async endpoints, with a concurrency limit, timeouts and disconnect handling"
+
+    def __init__(self, max_concurrency=KB_MAX_CONCURRENCY, timeout=KB_REQUEST_TIMEOUT_SECONDS,
+                 queue_timeout=KB_QUEUE_TIMEOUT_SECONDS, name="bounded"):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=name)
+        # 名額在 event loop 上排隊 (先到先得), 呼叫結束 (或在開始前被取消) 時才歸還
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.disconnects = 0
+
+    async def _acquire(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _release(self, loop, future):
+        with self._lock:
+            self.in_flight -= 1
+            if not future.cancelled():
+                self.completed += 1
+        # done callback 在 worker 執行緒中執行, 交回 event loop 歸還名額
+        loop.call_soon_threadsafe(self._slots.release)
+
+    async def _watch_disconnect(self, request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    async def run(self, request, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) in the pool and await its result.
+        Args:
+            request (starlette.requests.Request): The HTTP request, polled for disconnects (None to skip).
+        Returns:
+            fn's return value.
+        Raises:
+            Overloaded: Every slot stayed busy for queue_timeout seconds.
+            asyncio.TimeoutError: fn did not finish within timeout seconds.
+            ClientDisconnected: The client disconnected first.
+        """
+        if not await self._acquire():
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded(f"{self.max_concurrency} calls already in flight")
+        with self._lock:
+            self.in_flight += 1
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._release(loop, f))
+
+        call = asyncio.ensure_future(asyncio.wrap_future(future))
+        waiters = {call}
+        watcher = None
+        if request is not None:
+            watcher = asyncio.ensure_future(self._watch_disconnect(request))
+            waiters.add(watcher)
+        try:
+            done, _ = await asyncio.wait(waiters, timeout=self.timeout, return_when=asyncio.FIRST_COMPLETED)
+            if call in done:
+                return call.result()
+            if watcher is not None and watcher in done:
+                with self._lock:
+                    self.disconnects += 1
+                logger.info("Client disconnected, abandoning the call")
+                raise ClientDisconnected()
+            with self._lock:
+                self.timeouts += 1
+            raise asyncio.TimeoutError(f"Call did not finish within {self.timeout} seconds")
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if not call.done():
+                # 不再等待結果: 尚未開始的呼叫直接取消, 已開始的會在背景跑完後歸還名額
+                call.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "disconnects": self.disconnects,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,14 +1,27 @@
-import boto3
 import os
+import sys
 import json
+import asyncio
 import logging
+import threading
+import time
+from collections import deque
 from botocore.exceptions import ClientError
-from fastapi import FastAPI, status, HTTPException
+from fastapi import FastAPI, status, HTTPException, Request
 from pydantic import BaseModel
 from dotenv import load_dotenv # 添加 dotenv 支持
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import uvicorn # 添加 uvicorn 運行服務
 
+# aws_clients.py 位於專案根目錄
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aws_clients import get_client, warm_up
+from bedrock_limiter import call_bedrock
+from semantic_cache import SemanticCache
+from bounded_executor import BoundedExecutor, ClientDisconnected, Overloaded, KB_REQUEST_TIMEOUT_SECONDS
+from local_retriever import LocalRetriever, render_search_results
+
 # 配置日誌記錄
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s") # 更好的日誌格式
@@ -22,19 +35,45 @@ AWS_SESSION_TOKEN  =os.getenv('AWS_SESSION_TOKEN')
 AWS_DEFAULT_REGION =os.getenv('AWS_DEFAULT_REGION')
 
 # Knowledge Base 相關設定
-KNOWLEDGE_BASE_ID = ""
+KNOWLEDGE_BASE_ID = os.getenv('KNOWLEDGE_BASE_ID', "")
 AWS_REGION = "us-west-2"
 
 GENERATION_MODEL_ID = "anthropic.claude-3-5-sonnet-20241022-v2:0"
 
 
-bedrock_agent_runtime = boto3.client(
-    service_name='bedrock-agent-runtime',
-    region_name=AWS_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    aws_session_token=AWS_SESSION_TOKEN
-)
+# 共用 client (見專案根目錄的 aws_clients.py)
+# 重試由 bedrock_limiter 統一處理, botocore 不再自行重試
+# read_timeout 與請求逾時相同: 逾時後不再等待的呼叫也會在同一時間點結束, 歸還執行緒
+# BEDROCK_AGENT_ENDPOINT_URL 可指向本機的模擬服務 (見 benchmarks/bench_kb_concurrency.py)
+BEDROCK_AGENT_CLIENT = {'service_name': 'bedrock-agent-runtime', 'region_name': AWS_REGION,
+                        'endpoint_url': os.getenv('BEDROCK_AGENT_ENDPOINT_URL'),
+                        'retries': {'max_attempts': 1, 'mode': 'standard'},
+                        'read_timeout': KB_REQUEST_TIMEOUT_SECONDS}
+bedrock_agent_runtime = get_client(**BEDROCK_AGENT_CLIENT)
+# 查詢知識庫 ingestion 狀態用 (control plane)
+BEDROCK_AGENT_CONTROL_CLIENT = {'service_name': 'bedrock-agent', 'region_name': AWS_REGION}
+
+# 檢索來源: "bedrock" 為 Bedrock Knowledge Base (RetrieveAndGenerate), "local" 為本機索引 (見 local_retriever.py)
+# local 模式以本機檢索到的段落填入 PROMPT_TEMPLATE, 直接以 Converse API 生成, 不經過 Knowledge Base
+KB_RETRIEVAL = os.getenv('KB_RETRIEVAL', 'bedrock')
+BEDROCK_RUNTIME_CLIENT = {'service_name': 'bedrock-runtime', 'region_name': AWS_REGION,
+                          'endpoint_url': os.getenv('BEDROCK_RUNTIME_ENDPOINT_URL'),
+                          'retries': {'max_attempts': 1, 'mode': 'standard'},
+                          'read_timeout': KB_REQUEST_TIMEOUT_SECONDS}
+local_retriever = LocalRetriever()
+
+# 語意快取 (見 semantic_cache.py): 換句話問的相同問題直接回傳先前的回答與引用
+# 每 KB_VERSION_CHECK_SECONDS 秒檢查一次最新完成的 ingestion job, 有新的 ingest 即清空快取
+KB_VERSION_CHECK_SECONDS = float(os.getenv('KB_VERSION_CHECK_SECONDS', '60'))
+semantic_cache = SemanticCache()
+
+# 同步的 retrieve_and_generate 在有上限的 thread pool 中執行 (見 bounded_executor.py), 不阻塞 event loop
+# 併發上限 KB_MAX_CONCURRENCY, 排隊上限 KB_QUEUE_TIMEOUT_SECONDS, 逾時 KB_REQUEST_TIMEOUT_SECONDS
+kb_executor = BoundedExecutor(name="knowledge_base")
+
+# 串流模式的 time-to-first-character (秒), 保留最近 1000 筆
+stream_ttfc = deque(maxlen=1000)
+stream_metrics_lock = threading.Lock()
 
 app = FastAPI()
 
@@ -46,48 +85,51 @@ allow_methods=["*"],
 allow_headers=["*"],
 )
 
-# 定義 Knowledge Base 查詢請求體的模型
-class KnowledgeBaseQueryRequest(BaseModel):
-    query: str
-    max_results: int = 3
+@app.on_event("startup")
+def warm_up_clients():
+    if KB_RETRIEVAL == 'local':
+        local_retriever.load()
+        warm_up([BEDROCK_RUNTIME_CLIENT])
+        # 本機語料有變動時重建索引並清空快取
+        semantic_cache.watch(local_retriever.refresh, KB_VERSION_CHECK_SECONDS)
+        return
+    warm_up([BEDROCK_AGENT_CLIENT])
+    if KNOWLEDGE_BASE_ID:
+        semantic_cache.watch(knowledge_base_version, KB_VERSION_CHECK_SECONDS)
 
-# API端點來調用知識庫查詢的請求
-@app.post("/query_knowledge_base", status_code=status.HTTP_200_OK, tags=["knowledge_base"], summary="Query Knowledge Base")
-async def query_knowledge_base_endpoint(query_request: KnowledgeBaseQueryRequest):
+@app.on_event("shutdown")
+def stop_semantic_cache():
+    semantic_cache.stop()
+    kb_executor.shutdown()
+
+def knowledge_base_version():
     """
-    接收查詢請求，呼叫 Bedrock Knowledge Base 進行檢索和生成回答。
+    Identify the current content of the knowledge base.
+    Returns:
+        str: The latest completed ingestion job of each data source, changes after every re-ingest.
     """
-    logger.info(f"收到知識庫查詢請求: {query_request.query}")
-    logger.info(f"將使用 Knowledge Base ID: {KNOWLEDGE_BASE_ID}, Region: {AWS_REGION}, Model ID: {GENERATION_MODEL_ID}")
+    bedrock_agent = get_client(**BEDROCK_AGENT_CONTROL_CLIENT)
+    jobs = []
+    data_sources = bedrock_agent.list_data_sources(knowledgeBaseId=KNOWLEDGE_BASE_ID)['dataSourceSummaries']
+    for data_source in data_sources:
+        summaries = bedrock_agent.list_ingestion_jobs(
+            knowledgeBaseId=KNOWLEDGE_BASE_ID,
+            dataSourceId=data_source['dataSourceId'],
+            filters=[{'attribute': 'STATUS', 'operator': 'EQ', 'values': ['COMPLETE']}],
+            sortBy={'attribute': 'STARTED_AT', 'order': 'DESCENDING'},
+            maxResults=1
+        )['ingestionJobSummaries']
+        if summaries:
+            jobs.append(f"{data_source['dataSourceId']}:{summaries[0]['ingestionJobId']}:{summaries[0]['updatedAt'].isoformat()}")
+    return ",".join(sorted(jobs))
 
-    try:
-        response = bedrock_agent_runtime.retrieve_and_generate(
-            input={
-            'text': query_request.query
-            },
-            retrieveAndGenerateConfiguration={
-            'type': 'KNOWLEDGE_BASE',
-
-                'knowledgeBaseConfiguration': {
-                    'knowledgeBaseId': KNOWLEDGE_BASE_ID,
-                    'modelArn': GENERATION_MODEL_ID,
-
-                    'retrievalConfiguration': {
-                    'vectorSearchConfiguration': {
-                    'numberOfResults': query_request.max_results
-                    }
-                    },
-
-                    'generationConfiguration': {
-                    'inferenceConfig': {
-                    'textInferenceConfig': {
-                    'maxTokens': 1000,
-                    'temperature': 0.2,
-                    'topP': 0.9
-                    }
-                    },
+# 定義 Knowledge Base 查詢請求體的模型
+class KnowledgeBaseQueryRequest(BaseModel):
+    query: str
+    max_results: int = 3
 
-                'promptTemplate': """
+# 知識庫回答的提示詞
+PROMPT_TEMPLATE = """
                 您是一位專業且經驗豐富的建築法規專家。你的任務是根據使用者提供的搜尋結果來回答問題。請嚴格遵守以下要求：
 
                     1. 僅能根據搜尋結果資訊作答，不得使用常識推論或自行假設。
@@ -102,42 +144,129 @@ async def query_knowledge_base_endpoint(query_request: KnowledgeBaseQueryRequest
                     $search_results$
 
                     $output_format_instructions$
+"""
 
-                """,
-                            'safeguardsConfiguration': {
+# 設定 KB_GUARDRAIL_ID 時才套用 Guardrail
+KB_GUARDRAIL_ID = os.getenv('KB_GUARDRAIL_ID', '')
+KB_GUARDRAIL_VERSION = os.getenv('KB_GUARDRAIL_VERSION', '1')
 
-                                'guardrailIdentifier': '',
-                                'guardrailVersion': '1'
-                            }
-                        }
+def retrieve_and_generate_request(query, max_results):
+    """
+    Build the RetrieveAndGenerate request.
+    Args:
+        query (str): The user query.
+        max_results (int): Number of retrieved chunks.
+    Returns:
+        dict: Keyword arguments for retrieve_and_generate / retrieve_and_generate_stream.
+    """
+    generation_configuration = {
+        'inferenceConfig': {
+            'textInferenceConfig': {
+                'maxTokens': 1000,
+                'temperature': 0.2,
+                'topP': 0.9
+            }
+        },
+        'promptTemplate': {
+            'textPromptTemplate': PROMPT_TEMPLATE
+        }
+    }
+    if KB_GUARDRAIL_ID:
+        generation_configuration['guardrailConfiguration'] = {
+            'guardrailId': KB_GUARDRAIL_ID,
+            'guardrailVersion': KB_GUARDRAIL_VERSION
+        }
+    return {
+        'input': {
+            'text': query
+        },
+        'retrieveAndGenerateConfiguration': {
+            'type': 'KNOWLEDGE_BASE',
+            'knowledgeBaseConfiguration': {
+                'knowledgeBaseId': KNOWLEDGE_BASE_ID,
+                'modelArn': GENERATION_MODEL_ID,
+                'retrievalConfiguration': {
+                    'vectorSearchConfiguration': {
+                        'numberOfResults': max_results
                     }
-                }
-            )       
+                },
+                'generationConfiguration': generation_configuration
+            }
+        }
+    }
 
-        logger.info("Bedrock Knowledge Base 檢索並生成請求成功！")
+def converse_request(query, references):
+    """
+    Build the Converse request that answers query from locally retrieved passages.
+    Args:
+        query (str): The user query.
+        references (list): retrievedReferences from local_retriever.
+    Returns:
+        dict: Keyword arguments for converse / converse_stream.
+    """
+    prompt = PROMPT_TEMPLATE.replace('$search_results$', render_search_results(references))
+    request = {
+        'modelId': GENERATION_MODEL_ID,
+        'system': [{'text': prompt.replace('$output_format_instructions$', '')}],
+        'messages': [{'role': 'user', 'content': [{'text': query}]}],
+        'inferenceConfig': {
+            'maxTokens': 1000,
+            'temperature': 0.2,
+            'topP': 0.9
+        }
+    }
+    if KB_GUARDRAIL_ID:
+        request['guardrailConfig'] = {
+            'guardrailIdentifier': KB_GUARDRAIL_ID,
+            'guardrailVersion': KB_GUARDRAIL_VERSION
+        }
+    return request
 
-        # 從回覆中提取生成出的回答和資料引用
-        generated_response = response.get('output', {}).get('text', 'N/A')
-        citations = response.get('citations', [])
+def local_retrieve_and_generate(query, max_results):
+    """
+    RetrieveAndGenerate over the local index (runs in kb_executor).
+    Returns:
+        dict: Same shape as retrieve_and_generate ({"output": {"text"}, "citations": [{"retrievedReferences"}]}).
+    """
+    references = local_retriever.retrieve(query, max_results)
+    bedrock_runtime = get_client(**BEDROCK_RUNTIME_CLIENT)
+    response = call_bedrock(GENERATION_MODEL_ID, AWS_REGION, bedrock_runtime.converse,
+                            **converse_request(query, references))
+    text = "".join(block.get('text', '') for block in response['output']['message']['content'])
+    return {
+        'output': {'text': text},
+        'citations': [{'retrievedReferences': references}] if references else []
+    }
 
-        formatted_citations = []
-        for citation in citations:
-             references = citation.get('retrievedReferences', [])
-             for ref in references:
-                  content = ref.get('content', {}).get('text', 'N/A')
-                  uri = ref.get('location', {}).get('s3Location', {}).get('uri', 'N/A')
-                  formatted_citations.append({
-                      "content_snippet": content,
-                      "source_uri": uri
-                  })
+def retrieve_and_generate(query, max_results):
+    "retrieve_and_generate through the configured KB_RETRIEVAL source (runs in kb_executor)."
+    if KB_RETRIEVAL == 'local':
+        return local_retrieve_and_generate(query, max_results)
+    return call_bedrock(GENERATION_MODEL_ID, AWS_REGION, bedrock_agent_runtime.retrieve_and_generate,
+                        **retrieve_and_generate_request(query, max_results))
 
-        # 返回成功的 JSON 響應
-        return {
-            'answer': generated_response,
-            'citations': formatted_citations
-        }
+def format_references(references):
+    "retrievedReferences -> [{\"content_snippet\", \"source_uri\"}]"
+    formatted = []
+    for ref in references:
+         content = ref.get('content', {}).get('text', 'N/A')
+         uri = ref.get('location', {}).get('s3Location', {}).get('uri', 'N/A')
+         formatted.append({
+             "content_snippet": content,
+             "source_uri": uri
+         })
+    return formatted
 
-    except ClientError as e:
+def http_exception(e, endpoint):
+    """
+    Map an error raised while calling the knowledge base to an HTTPException.
+    Args:
+        e (Exception): ClientError, Overloaded, asyncio.TimeoutError, ClientDisconnected or anything else.
+        endpoint (str): Path used in the log message.
+    Returns:
+        HTTPException: The exception to raise.
+    """
+    if isinstance(e, ClientError):
         # 捕獲 Boto3 的特定錯誤
         error_code = e.response['Error']['Code']
         error_message = e.response['Error'].get('Message', 'Unknown error from AWS API.')
@@ -145,20 +274,275 @@ async def query_knowledge_base_endpoint(query_request: KnowledgeBaseQueryRequest
 
         # 根據錯誤類型返回不同的 HTTP 狀態碼和信息
         if error_code == 'AccessDeniedException':
-             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"AWS Permissions Error: Access denied. {error_message}")
+             return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"AWS Permissions Error: Access denied. {error_message}")
         elif error_code == 'ValidationException':
-             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"AWS Validation Error: Check Bedrock model ID ({GENERATION_MODEL_ID}) or request parameters. {error_message}")
+             return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"AWS Validation Error: Check Bedrock model ID ({GENERATION_MODEL_ID}) or request parameters. {error_message}")
         elif error_code == 'UnrecognizedClientException':
-             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"AWS Credentials Error: Invalid security token. {error_message}")
+             return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"AWS Credentials Error: Invalid security token. {error_message}")
         elif error_code == 'ResourceNotFoundException':
-             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Bedrock Knowledge Base not found: {KNOWLEDGE_BASE_ID}. {error_message}")
+             return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Bedrock Knowledge Base not found: {KNOWLEDGE_BASE_ID}. {error_message}")
         elif error_code.startswith('Bedrock'):
-             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Bedrock API Error: {error_code} - {error_message}")
+             return HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Bedrock API Error: {error_code} - {error_message}")
         else:
-             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"AWS API error: {error_code} - {error_message}")
+             return HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"AWS API error: {error_code} - {error_message}")
+    if isinstance(e, Overloaded):
+        logger.warning(f"Knowledge Base 查詢已達併發上限: {e}")
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Too many concurrent knowledge base queries, retry later. {e}")
+    if isinstance(e, asyncio.TimeoutError):
+        logger.error(f"Knowledge Base 查詢逾時: {e}")
+        return HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=f"Knowledge base query timed out. {e}")
+    if isinstance(e, ClientDisconnected):
+        # 用戶端已離開, 回應不會被讀取
+        return HTTPException(status_code=499, detail="Client closed request")
+    logger.error(f"Endpoint {endpoint} encountered unexpected error: {e}", exc_info=e) # 打印詳細錯誤信息
+    return HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Internal server error processing knowledge base query: {e}")
+
+# API端點來調用知識庫查詢的請求
+@app.post("/query_knowledge_base", status_code=status.HTTP_200_OK, tags=["knowledge_base"], summary="Query Knowledge Base")
+async def query_knowledge_base_endpoint(query_request: KnowledgeBaseQueryRequest, request: Request):
+    """
+    接收查詢請求，呼叫 Bedrock Knowledge Base 進行檢索和生成回答。
+    """
+    logger.info(f"收到知識庫查詢請求: {query_request.query}")
+
+    cached, similarity = semantic_cache.get(query_request.query, scope=query_request.max_results)
+    if cached is not None:
+        logger.info(f"語意快取命中 (similarity {similarity:.3f})")
+        return cached
+    if KB_RETRIEVAL == 'local':
+        logger.info(f"將使用本機檢索 ({len(local_retriever)} 段), Region: {AWS_REGION}, Model ID: {GENERATION_MODEL_ID}")
+    else:
+        logger.info(f"將使用 Knowledge Base ID: {KNOWLEDGE_BASE_ID}, Region: {AWS_REGION}, Model ID: {GENERATION_MODEL_ID}")
+
+    try:
+        response = await kb_executor.run(request, retrieve_and_generate, query_request.query, query_request.max_results)
+
+        logger.info("Bedrock Knowledge Base 檢索並生成請求成功！")
+
+        # 從回覆中提取生成出的回答和資料引用
+        generated_response = response.get('output', {}).get('text', 'N/A')
+        citations = response.get('citations', [])
+
+        formatted_citations = []
+        for citation in citations:
+             formatted_citations += format_references(citation.get('retrievedReferences', []))
+
+        result = {
+            'answer': generated_response,
+            'citations': formatted_citations
+        }
+        # 找不到引用的回答 (例如「無法在搜尋結果中找到...」) 不快取, 下次仍重新檢索
+        if formatted_citations:
+            semantic_cache.put(query_request.query, result, scope=query_request.max_results)
+
+        # 返回成功的 JSON 響應
+        return result
+
     except Exception as e:
-        logger.error(f"Endpoint /query_knowledge_base encountered unexpected error: {e}", exc_info=True) # 打印詳細錯誤信息
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Internal server error processing knowledge base query: {e}")
+        raise http_exception(e, "/query_knowledge_base")
+
+
+def sse_event(data, event=None):
+    "Format one Server-Sent Event."
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def record_ttfc(seconds):
+    with stream_metrics_lock:
+        stream_ttfc.append(seconds)
+
+def consume_stream(query, max_results, emit, stop):
+    """
+    Call retrieve_and_generate_stream and hand every stream event to emit() (runs in kb_executor).
+    Args:
+        emit (callable): Called with each event dict, from this thread.
+        stop (threading.Event): Set when the client is gone; the stream is closed early.
+    """
+    if KB_RETRIEVAL == 'local':
+        consume_local_stream(query, max_results, emit, stop)
+        return
+    response = call_bedrock(
+        GENERATION_MODEL_ID, AWS_REGION, bedrock_agent_runtime.retrieve_and_generate_stream,
+        **retrieve_and_generate_request(query, max_results))
+    stream = response['stream']
+    try:
+        for event in stream:
+            if stop.is_set():
+                break
+            emit(event)
+    finally:
+        stream.close()
+
+def consume_local_stream(query, max_results, emit, stop):
+    """
+    Local-retrieval variant of consume_stream: emits the citation first, then converse_stream
+    text deltas in the retrieve_and_generate_stream event shape.
+    """
+    references = local_retriever.retrieve(query, max_results)
+    bedrock_runtime = get_client(**BEDROCK_RUNTIME_CLIENT)
+    response = call_bedrock(GENERATION_MODEL_ID, AWS_REGION, bedrock_runtime.converse_stream,
+                            **converse_request(query, references))
+    stream = response['stream']
+    try:
+        if references:
+            emit({'citation': {'retrievedReferences': references}})
+        for event in stream:
+            if stop.is_set():
+                break
+            text = event.get('contentBlockDelta', {}).get('delta', {}).get('text')
+            if text:
+                emit({'output': {'text': text}})
+            elif event.get('messageStop', {}).get('stopReason') == 'guardrail_intervened':
+                emit({'guardrail': {'action': 'INTERVENED'}})
+    finally:
+        stream.close()
+
+def stream_response(events):
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# 串流版本: 回答以 SSE 逐段回傳, 引用在生成過程中以 citation 事件送出, 最後的 done 事件含完整回答與引用
+@app.post("/query_knowledge_base/stream", status_code=status.HTTP_200_OK, tags=["knowledge_base"],
+          summary="Query Knowledge Base (streaming)", response_description="text/event-stream of answer deltas and citations")
+async def query_knowledge_base_stream(query_request: KnowledgeBaseQueryRequest, request: Request):
+    """
+    Streaming variant of /query_knowledge_base built on retrieve_and_generate_stream.
+    Events: data {"text"} deltas, event "citation" {"citations"}, and event "done"
+    {"answer", "citations", "ttfc_ms", "total_ms"} with the same citations shape as /query_knowledge_base.
+    """
+    started = time.perf_counter()
+    logger.info(f"收到知識庫串流查詢請求: {query_request.query}")
+
+    cached, similarity = semantic_cache.get(query_request.query, scope=query_request.max_results)
+    if cached is not None:
+        logger.info(f"語意快取命中 (similarity {similarity:.3f})")
+        ttfc = time.perf_counter() - started
+        record_ttfc(ttfc)
+
+        def cached_events():
+            yield sse_event({"text": cached['answer']})
+            yield sse_event({"citations": cached['citations']}, event="citation")
+            yield sse_event(dict(cached, ttfc_ms=round(ttfc * 1000), total_ms=round((time.perf_counter() - started) * 1000),
+                                 cached=True), event="done")
+        return stream_response(cached_events())
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    call = asyncio.ensure_future(kb_executor.run(
+        request, consume_stream, query_request.query, query_request.max_results,
+        lambda event: loop.call_soon_threadsafe(queue.put_nowait, event), stop))
+    # 串流結束 (或失敗) 時放入 None 作為結束記號
+    call.add_done_callback(lambda _: queue.put_nowait(None))
+
+    # 等第一個事件再回應: 呼叫本身失敗 (權限、參數、併發上限...) 時仍回傳對應的 HTTP 狀態碼
+    first = await queue.get()
+    if first is None:
+        try:
+            call.result()
+        except Exception as e:
+            raise http_exception(e, "/query_knowledge_base/stream")
+
+    async def events():
+        ttfc = None
+        parts = []
+        formatted_citations = []
+        event = first
+        try:
+            while event is not None:
+                text = event.get('output', {}).get('text')
+                if text:
+                    if ttfc is None:
+                        ttfc = time.perf_counter() - started
+                        record_ttfc(ttfc)
+                        logger.info("Knowledge Base time to first character: %.0f ms", ttfc * 1000)
+                    parts.append(text)
+                    yield sse_event({"text": text})
+                elif 'citation' in event:
+                    citation = event['citation']
+                    references = citation.get('retrievedReferences') or citation.get('citation', {}).get('retrievedReferences', [])
+                    formatted = format_references(references)
+                    formatted_citations += formatted
+                    yield sse_event({"citations": formatted}, event="citation")
+                elif 'guardrail' in event:
+                    yield sse_event({"action": event['guardrail'].get('action')}, event="guardrail")
+                event = await queue.get()
+
+            try:
+                call.result()
+            except Exception as e:
+                error = http_exception(e, "/query_knowledge_base/stream")
+                yield sse_event({"error": error.detail, "status_code": error.status_code}, event="error")
+                return
+
+            result = {
+                'answer': "".join(parts),
+                'citations': formatted_citations
+            }
+            if formatted_citations:
+                semantic_cache.put(query_request.query, result, scope=query_request.max_results)
+            yield sse_event(dict(result, ttfc_ms=round(ttfc * 1000) if ttfc is not None else None,
+                                 total_ms=round((time.perf_counter() - started) * 1000)), event="done")
+        finally:
+            # 用戶端中途離開時停止讀取 Bedrock 串流, 釋放併發名額
+            stop.set()
+
+    return stream_response(events())
+
+@app.get("/query_knowledge_base/stream_stats", tags=["knowledge_base"], summary="Streaming latency statistics")
+def kb_stream_stats():
+    """
+    Time to first character of recent /query_knowledge_base/stream requests.
+    """
+    with stream_metrics_lock:
+        samples = sorted(stream_ttfc)
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "ttfc_avg_ms": round(sum(samples) / len(samples) * 1000),
+        "ttfc_p50_ms": round(samples[len(samples) // 2] * 1000),
+        "ttfc_p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000),
+    }
+
+
+class LocalRetrievalRequest(BaseModel):
+    query: str
+    max_results: int = 3
+    mode: str = "hybrid"
+
+@app.post("/query_knowledge_base/retrieve", tags=["knowledge_base"], summary="Search the local knowledge index")
+def local_retrieve(retrieval_request: LocalRetrievalRequest):
+    """
+    只做本機檢索 (不生成), 回傳與 /query_knowledge_base 相同格式的引用與檢索耗時。
+    """
+    if local_retriever.version is None:
+        local_retriever.load()
+    started = time.perf_counter()
+    try:
+        references = local_retriever.retrieve(retrieval_request.query, retrieval_request.max_results, retrieval_request.mode)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {
+        'citations': format_references(references),
+        'retrieval_ms': round((time.perf_counter() - started) * 1000, 3)
+    }
+
+@app.get("/query_knowledge_base/concurrency_stats", tags=["knowledge_base"], summary="Knowledge Base executor statistics")
+def kb_concurrency_stats():
+    return kb_executor.stats()
+
+@app.get("/query_knowledge_base/cache_stats", tags=["knowledge_base"], summary="Semantic cache statistics")
+def semantic_cache_stats():
+    return semantic_cache.stats()
+
+@app.post("/query_knowledge_base/cache/invalidate", tags=["knowledge_base"], summary="Clear the semantic cache")
+def invalidate_semantic_cache():
+    """
+    清空語意快取 (例如手動啟動 ingestion job 之後, 不必等下一次版本檢查)。
+    """
+    semantic_cache.invalidate(semantic_cache.version)
+    return semantic_cache.stats()
 
 
 if __name__ == "__main__":
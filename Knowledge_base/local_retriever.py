@@ -0,0 +1,368 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from semantic_cache import embed as hashed_embed
+
+logger = logging.getLogger(__name__)
+
+# 本機檢索: Knowledge_base/knowlege 只有幾份法規文字檔, 不必每次都經過 Bedrock Knowledge Base 檢索
+# - 依「第X條」切段, 過長的條文再依句子切成多段 (每段都帶條號與標題)
+# - BM25: 中文以字元 bigram、英數以整個詞為 term; 每個 posting 的 BM25 權重在建索引時先算好,
+#   查詢只需把各 term 的 postings 加總, 與語料大小無關的常數部分都不在查詢時計算
+# - 條號另外以 art:N 記錄, 「第33條」與「第三十三條」互相命中
+# - 選用的向量索引存成 .npy, 以 memory map 讀取 (多個 worker 共用 page cache); 與 BM25 以 RRF 合併
+KNOWLEDGE_DIR = os.getenv('LOCAL_KB_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowlege'))
+INDEX_DIR = os.getenv('LOCAL_KB_INDEX_DIR')
+# 引用中的 source_uri 前綴, 設為 Knowledge Base 資料來源的 S3 位置即與 Bedrock 的引用一致
+SOURCE_PREFIX = os.getenv('LOCAL_KB_SOURCE_PREFIX', 'knowlege/')
+# 向量索引: "" 不建立, "hash" 為本機字元 n-gram 雜湊向量 (離線可用), "titan" 為 Bedrock Titan Text Embeddings
+DENSE_EMBEDDER = os.getenv('LOCAL_KB_DENSE', '')
+TITAN_EMBED_MODEL_ID = "amazon.titan-embed-text-v2:0"
+TITAN_EMBED_REGION = "us-west-2"
+MAX_PASSAGE_CHARS = int(os.getenv('LOCAL_KB_MAX_PASSAGE_CHARS', '300'))
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '兩': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_UNITS = {'十': 10, '百': 100, '千': 1000}
+_ARTICLE = re.compile(r'^\s*第\s*([0-9零〇一二兩三四五六七八九十百千]+)\s*條(?:之([0-9一二三四五六七八九十]+))?[\s：:、.]*(.*)$')
+_ARTICLE_REF = re.compile(r'第\s*([0-9零〇一二兩三四五六七八九十百千]+)\s*條')
+_CJK_RUN = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+_WORD = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+_TITLE = re.compile(r'《[^》]*》')
+_SENTENCE_END = re.compile(r'(?<=[。！？；\n])')
+
+
+def chinese_number(text):
+    "三十三 / 33 / 一百零五 -> int"
+    if text.isdigit():
+        return int(text)
+    total, current = 0, 0
+    for char in text:
+        if char in _DIGITS:
+            current = _DIGITS[char]
+        elif char in _UNITS:
+            total += (current or 1) * _UNITS[char]
+            current = 0
+    return total + current
+
+
+def tokenize(text):
+    """
+    BM25 terms of a text: CJK character bigrams (a lone character is kept as is),
+    lower-case ASCII words / numbers, and art:N for every 第N條 reference.
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = [f"art:{chinese_number(number)}" for number in _ARTICLE_REF.findall(text)]
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens += [run[i:i + 2] for i in range(len(run) - 1)]
+    tokens += _WORD.findall(text)
+    return tokens
+
+
+class Passage:
+    "One retrievable chunk: an article (or part of a long one) of a regulation text"
+
+    __slots__ = ("doc", "article", "title", "text", "source_uri")
+
+    def __init__(self, doc, article, title, text, source_uri):
+        self.doc = doc
+        self.article = article  # 條號 (int), 前言為 None
+        self.title = title
+        self.text = text
+        self.source_uri = source_uri
+
+    def heading(self):
+        if self.article is None:
+            return self.doc
+        return f"{self.doc} 第{self.article}條 {self.title}".rstrip()
+
+    def reference(self, score=None):
+        "The passage in the retrievedReferences shape returned by Bedrock."
+        metadata = {"doc": self.doc, "article": self.article}
+        if score is not None:
+            metadata["score"] = round(float(score), 4)
+        return {
+            "content": {"text": f"{self.heading()}\n{self.text}"},
+            "location": {"type": "S3", "s3Location": {"uri": self.source_uri}},
+            "metadata": metadata,
+        }
+
+
+def _windows(text, max_chars):
+    "Split text on sentence ends into pieces of at most max_chars (a longer sentence stays whole)."
+    pieces, current = [], ""
+    for sentence in filter(None, _SENTENCE_END.split(text)):
+        if current and len(current) + len(sentence) > max_chars:
+            pieces.append(current.strip())
+            current = ""
+        current += sentence
+    if current.strip():
+        pieces.append(current.strip())
+    return pieces
+
+
+def split_articles(text, doc, source_uri, max_chars=MAX_PASSAGE_CHARS):
+    """
+    Article-aware chunking of a regulation text.
+    Args:
+        text (str): The whole file.
+        doc (str): Document name (the regulation title).
+        source_uri (str): Location reported in citations.
+    Returns:
+        list[Passage]: One passage per 第X條 (long articles split on sentence ends);
+            text before the first article becomes an article=None passage when it has content.
+    """
+    passages = []
+    article, title, lines = None, "", []
+
+    def flush():
+        body = "\n".join(line for line in lines if line.strip()).strip()
+        if article is None and _TITLE.fullmatch(body):
+            body = ""  # 只有標題的前言
+        if body or article is not None:
+            for piece in _windows(body, max_chars) or [""]:
+                passages.append(Passage(doc, article, title, piece, source_uri))
+
+    for line in text.splitlines():
+        match = _ARTICLE.match(unicodedata.normalize('NFKC', line))
+        if match:
+            flush()
+            article = chinese_number(match.group(1))
+            title, lines = match.group(3).strip(), []
+        else:
+            lines.append(line)
+    flush()
+    return passages
+
+
+def load_passages(directory=KNOWLEDGE_DIR, max_chars=MAX_PASSAGE_CHARS):
+    "Chunk every .txt / .md file of directory."
+    passages = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(('.txt', '.md')):
+            continue
+        with open(os.path.join(directory, name), encoding='utf-8') as f:
+            text = f.read()
+        doc = os.path.splitext(name)[0]
+        passages += split_articles(text, doc, SOURCE_PREFIX + name, max_chars)
+    return passages
+
+
+def titan_embed(text):
+    "Bedrock Titan Text Embeddings v2 (needs network access and credentials; aws_clients.py on sys.path)."
+    from aws_clients import get_client
+    from bedrock_limiter import call_bedrock
+    bedrock = get_client(service_name='bedrock-runtime', region_name=TITAN_EMBED_REGION)
+    response = call_bedrock(TITAN_EMBED_MODEL_ID, TITAN_EMBED_REGION, bedrock.invoke_model,
+                            modelId=TITAN_EMBED_MODEL_ID, contentType="application/json", accept="application/json",
+                            body=json.dumps({"inputText": text, "dimensions": 512, "normalize": True}))
+    return np.asarray(json.loads(response['body'].read())['embedding'], dtype=np.float32)
+
+
+EMBEDDERS = {"hash": hashed_embed, "titan": titan_embed}
+
+
+class BM25Index:
+    "Inverted index with precomputed BM25 posting weights (CSR arrays)"
+
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        """
+        Args:
+            documents (list[list[str]]): Tokens of each document.
+        """
+        self.size = len(documents)
+        lengths = np.array([len(tokens) for tokens in documents], dtype=np.float32)
+        average = float(lengths.mean()) if self.size else 0.0
+        postings = {}
+        for doc_id, tokens in enumerate(documents):
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        self.vocabulary = {}
+        offsets = [0]
+        doc_ids, weights = [], []
+        for term, entries in postings.items():
+            self.vocabulary[term] = len(self.vocabulary)
+            df = len(entries)
+            idf = np.log(1 + (self.size - df + 0.5) / (df + 0.5))
+            for doc_id, tf in entries:
+                norm = k1 * (1 - b + b * lengths[doc_id] / average) if average else k1
+                doc_ids.append(doc_id)
+                weights.append(idf * tf * (k1 + 1) / (tf + norm))
+            offsets.append(len(doc_ids))
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.doc_ids = np.array(doc_ids, dtype=np.int32)
+        self.weights = np.array(weights, dtype=np.float32)
+
+    def scores(self, tokens):
+        "BM25 score of every document for the query tokens."
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term, count in Counter(tokens).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # 同一篇文件在一個 term 的 postings 中只出現一次, 可以直接加
+            scores[self.doc_ids[start:end]] += count * self.weights[start:end]
+        return scores
+
+
+class DenseIndex:
+    "Unit vectors of the passages in a (memory-mapped) float32 matrix"
+
+    def __init__(self, vectors, embed_fn):
+        self.vectors = vectors
+        self.embed_fn = embed_fn
+
+    @classmethod
+    def build(cls, texts, embed_fn, path=None):
+        """
+        Embed texts; with path, write them to a .npy file and reopen it memory-mapped.
+        """
+        matrix = np.stack([embed_fn(text) for text in texts]) if texts else np.zeros((0, 1), dtype=np.float32)
+        if path is None:
+            return cls(matrix.astype(np.float32), embed_fn)
+        tmp_path = path + ".tmp.npy"
+        output = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=matrix.shape)
+        output[:] = matrix
+        output.flush()
+        del output
+        os.replace(tmp_path, path)
+        return cls.open(path, embed_fn)
+
+    @classmethod
+    def open(cls, path, embed_fn):
+        return cls(np.load(path, mmap_mode="r"), embed_fn)
+
+    def scores(self, query):
+        return self.vectors @ self.embed_fn(query)
+
+
+def _rrf(rankings, size):
+    "Reciprocal rank fusion of several rankings (arrays of document ids, best first)."
+    fused = np.zeros(size, dtype=np.float32)
+    for ranking in rankings:
+        fused[ranking] += 1.0 / (RRF_K + np.arange(1, len(ranking) + 1))
+    return fused
+
+
+def _top(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class LocalRetriever:
+    "BM25 (+ optional dense) retrieval over the local regulation texts"
+
+    def __init__(self, directory=KNOWLEDGE_DIR, dense=DENSE_EMBEDDER, index_dir=INDEX_DIR,
+                 max_chars=MAX_PASSAGE_CHARS):
+        self.directory = directory
+        self.dense_name = dense
+        self.index_dir = index_dir
+        self.max_chars = max_chars
+        self.passages = []
+        self.bm25 = None
+        self.dense = None
+        self.version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.passages)
+
+    def fingerprint(self):
+        "Changes whenever a corpus file, the chunk size or the embedder changes."
+        digest = hashlib.sha256(f"{self.max_chars}:{self.dense_name}".encode())
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(('.txt', '.md')):
+                continue
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                digest.update(name.encode('utf-8'))
+                digest.update(f.read())
+        return digest.hexdigest()[:16]
+
+    def load(self):
+        "(Re)build the index from the corpus directory; the dense vectors are reused when the corpus did not change."
+        version = self.fingerprint()
+        passages = load_passages(self.directory, self.max_chars)
+        bm25 = BM25Index([tokenize(f"{p.heading()} {p.text}") for p in passages])
+        dense = None
+        if self.dense_name:
+            embed_fn = EMBEDDERS[self.dense_name]
+            texts = [f"{p.heading()}\n{p.text}" for p in passages]
+            path = None
+            if self.index_dir:
+                os.makedirs(self.index_dir, exist_ok=True)
+                path = os.path.join(self.index_dir, f"dense-{version}.npy")
+            if path and os.path.exists(path):
+                dense = DenseIndex.open(path, embed_fn)
+            else:
+                dense = DenseIndex.build(texts, embed_fn, path)
+        with self._lock:
+            self.passages, self.bm25, self.dense, self.version = passages, bm25, dense, version
+        logger.info("Local retriever indexed %d passages from %s (dense: %s)",
+                    len(passages), self.directory, self.dense_name or "off")
+        return len(passages)
+
+    def refresh(self):
+        "Reload when a corpus file changed since load(); returns the current version."
+        version = self.fingerprint()
+        if version != self.version:
+            self.load()
+        return self.version
+
+    def search(self, query, k=3, mode="hybrid"):
+        """
+        Top passages for a query.
+        Args:
+            query (str): The user query.
+            k (int): Number of passages.
+            mode (str): "bm25", "dense" or "hybrid" (RRF of both; bm25 only when there is no dense index).
+        Returns:
+            list[(Passage, float)]: Best first, with the BM25, cosine or RRF score.
+        Raises:
+            ValueError: Unknown mode, or "dense" without a dense index.
+        """
+        with self._lock:
+            passages, bm25, dense = self.passages, self.bm25, self.dense
+        if bm25 is None:
+            raise RuntimeError("LocalRetriever.load() has not been called")
+        if mode not in ("bm25", "dense", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        if mode == "dense" and dense is None:
+            raise ValueError("No dense index (set LOCAL_KB_DENSE)")
+        if mode == "dense":
+            scores = dense.scores(query)
+        else:
+            scores = bm25.scores(tokenize(query))
+            if mode == "hybrid" and dense is not None:
+                depth = min(len(passages), max(k * 4, 20))
+                lexical = _top(scores, depth)
+                # BM25 完全沒命中的段落不列入 BM25 排名
+                scores = _rrf([lexical[scores[lexical] > 0], _top(dense.scores(query), depth)], len(passages))
+        top = _top(scores, k)
+        return [(passages[i], float(scores[i])) for i in top if scores[i] > 0]
+
+    def retrieve(self, query, k=3, mode="hybrid"):
+        "search() results in the Bedrock retrievedReferences shape."
+        return [passage.reference(score) for passage, score in self.search(query, k, mode)]
+
+
+def render_search_results(references):
+    "Numbered passages for the $search_results$ placeholder of a prompt template."
+    return "\n\n".join(f"[{index}] {reference['content']['text']}" for index, reference in enumerate(references, 1))
@@ -0,0 +1,227 @@
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 知識庫問答的語意快取: 使用者常以不同措辭問同一個問題
+# 查詢以字元 n-gram (1~3) 雜湊成固定維度的向量 (本機計算, 不呼叫 embedding 模型), L2 正規化後
+# 與過去查詢的向量矩陣一次做內積 (cosine similarity), 最高分超過門檻即回傳當時的回答與引用
+# 以 TTL 與筆數上限淘汰; 知識庫重新 ingest 後整個快取失效
+CACHE_DIM = int(os.getenv('SEMANTIC_CACHE_DIM', '1024'))
+CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.85'))
+CACHE_TTL_SECONDS = float(os.getenv('SEMANTIC_CACHE_TTL_SECONDS', '86400'))
+CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '2000'))
+NGRAM_SIZES = (1, 2, 3)
+
+# 標點、空白、語助詞與疑問詞不影響問的是哪一件事, 先移除 (「有哪些規定」與「的規定有哪些」應視為相同)
+_NOISE = re.compile(r"[\s\W_]+|請問|想問|一下|是否|有哪些|哪些|什麼|如何|怎麼|需要|要|嗎|呢|吧|啊|是|的", re.UNICODE)
+# 否定詞會讓字面幾乎相同的問題意思相反 (供公眾使用 / 非供公眾使用), 否定詞不同的查詢不互相命中
+_NEGATIONS = ("不", "非", "無", "未", "免", "禁止", "除外")
+
+
+def normalize(text):
+    "NFKC (full-width -> half-width), lower case, punctuation and filler words removed."
+    return _NOISE.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def negations(text):
+    return frozenset(word for word in _NEGATIONS if word in text)
+
+
+def embed(text, dim=CACHE_DIM):
+    """
+    Hashed character n-gram embedding of a query.
+    Args:
+        text (str): The query.
+        dim (int): Vector size.
+    Returns:
+        np.ndarray: float32 unit vector (all zeros for an empty query).
+    """
+    text = normalize(text)
+    vector = np.zeros(dim, dtype=np.float32)
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            h = zlib.crc32(text[i:i + n].encode("utf-8"))
+            # 以雜湊的一個位元決定正負號, 碰撞時的誤差期望值為 0; 長的 n-gram 權重較高
+            vector[h % dim] += n if h & 0x80000000 else -n
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+class SemanticCache:
+    "Cosine-similarity cache of past queries -> responses, bounded by TTL and size"
+
+    def __init__(self, dim=CACHE_DIM, threshold=CACHE_THRESHOLD, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.dim = dim
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # 每列一筆查詢向量, 與 _entries / _expires / _used / _scopes 同一索引; 刪除時以最後一列補位
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._used = np.zeros(max_entries, dtype=np.float64)
+        # (scope, negations(query)) 編號, 比對時必須相同
+        self._scopes = np.zeros(max_entries, dtype=np.int64)
+        self._scope_ids = {}
+        self._entries = []  # (scope, query, response)
+        self._lock = threading.Lock()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._watcher = None
+        self._stopped = threading.Event()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, row):
+        last = len(self._entries) - 1
+        if row != last:
+            self._vectors[row] = self._vectors[last]
+            self._expires[row] = self._expires[last]
+            self._used[row] = self._used[last]
+            self._entries[row] = self._entries[last]
+            self._scopes[row] = self._scopes[last]
+        self._entries.pop()
+
+    def _scope_id(self, scope, query):
+        "Id of (scope, negations); new ids are only handed out by put(), so lookups never grow the map."
+        key = (scope, negations(query))
+        if key not in self._scope_ids:
+            if len(self._scope_ids) >= self.max_entries:
+                self._compact_scopes()
+            self._scope_ids[key] = max(self._scope_ids.values(), default=-1) + 1
+        return self._scope_ids[key]
+
+    def _compact_scopes(self):
+        "Forget scope ids no stored entry uses any more."
+        count = len(self._entries)
+        live = set(self._scopes[:count].tolist())
+        self._scope_ids = {key: scope_id for key, scope_id in self._scope_ids.items() if scope_id in live}
+
+    def _purge(self, now):
+        count = len(self._entries)
+        for row in sorted(np.flatnonzero(self._expires[:count] <= now).tolist(), reverse=True):
+            self._remove(row)
+            self.evictions += 1
+
+    def get(self, query, scope=None):
+        """
+        Look up a stored response for a query similar to this one.
+        Args:
+            query (str): The user query.
+            scope: Request options the response depends on (e.g. max_results); only entries with the same scope match.
+        Returns:
+            (dict, float) or (None, None): The stored response and its similarity.
+        """
+        vector = embed(query, self.dim)
+        now = time.time()
+        with self._lock:
+            scope_id = self._scope_ids.get((scope, negations(query)))
+            count = len(self._entries)
+            if count and scope_id is not None and vector.any():
+                scores = self._vectors[:count] @ vector
+                # 過期或 scope / 否定詞不同的不列入比較
+                scores[self._expires[:count] <= now] = -1.0
+                scores[self._scopes[:count] != scope_id] = -1.0
+                row = int(np.argmax(scores))
+                if scores[row] >= self.threshold:
+                    self._used[row] = now
+                    self.hits += 1
+                    return self._entries[row][2], float(scores[row])
+            self.misses += 1
+            return None, None
+
+    def put(self, query, response, scope=None):
+        vector = embed(query, self.dim)
+        if not vector.any():
+            return
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            scope_id = self._scope_id(scope, query)
+            count = len(self._entries)
+            if count:
+                # 幾乎相同的查詢只保留最新的一筆
+                scores = self._vectors[:count] @ vector
+                same = np.flatnonzero((scores >= 0.999) & (self._scopes[:count] == scope_id)).tolist()
+                for row in sorted(same, reverse=True):
+                    self._remove(row)
+            if len(self._entries) >= self.max_entries:
+                # 滿了: 淘汰最久沒有命中的一筆
+                self._remove(int(np.argmin(self._used[:len(self._entries)])))
+                self.evictions += 1
+            row = len(self._entries)
+            self._vectors[row] = vector
+            self._expires[row] = now + self.ttl
+            self._used[row] = now
+            self._scopes[row] = scope_id
+            self._entries.append((scope, query, response))
+
+    def invalidate(self, version=None):
+        "Drop every entry (the knowledge base was re-ingested)."
+        with self._lock:
+            self._entries.clear()
+            self._scope_ids.clear()
+            self.version = version
+            self.invalidations += 1
+        logger.info("Semantic cache invalidated (knowledge base version %s)", version)
+
+    def check_version(self, version):
+        "Invalidate when version differs from the one the entries were answered from."
+        with self._lock:
+            if self.version is None:
+                self.version = version
+                return False
+            changed = version is not None and version != self.version
+        if changed:
+            self.invalidate(version)
+        return changed
+
+    def _watch(self, version_fn, interval):
+        while not self._stopped.is_set():
+            try:
+                self.check_version(version_fn())
+            except Exception as e:
+                logger.error("Knowledge base version check failed: %s", e)
+            self._stopped.wait(interval)
+
+    def watch(self, version_fn, interval=60.0):
+        """
+        Poll version_fn in a background thread and invalidate when its value changes.
+        Args:
+            version_fn (callable): Returns the current knowledge base version (e.g. the last ingestion job).
+            interval (float): Seconds between checks.
+        """
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, args=(version_fn, interval),
+                                             name="semantic_cache_watch", daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "version": self.version,
+            }
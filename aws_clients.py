@@ -0,0 +1,85 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+
+# 共用的 boto3 client 註冊表
+# boto3 client 本身是 thread-safe 的, 但 Session 不是, 所以建立 client 時要上鎖;
+# 建好之後由所有請求共用, 保留 keep-alive 連線, 不必每次重新解析 endpoint / 載入憑證 / TLS 握手
+MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '50'))
+
+_session = None
+_clients = {}
+_lock = threading.Lock()
+_created = 0
+_reused = 0
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        # 各服務先 load_dotenv 再取 client, 這裡才讀得到 param.env 的憑證
+        _session = boto3.Session(
+            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
+            region_name=os.getenv('AWS_DEFAULT_REGION')
+        )
+    return _session
+
+
+def get_client(service_name, region_name=None, endpoint_url=None, **config_kwargs):
+    """
+    Return the shared client for a service/region, creating it on first use.
+    Args:
+        service_name (str): boto3 service name, e.g. 'bedrock-runtime'.
+        region_name (str): Region, defaults to AWS_DEFAULT_REGION.
+        endpoint_url (str): Optional endpoint override.
+        config_kwargs: Extra botocore Config options (read_timeout, retries, ...).
+    Returns:
+        The boto3 client.
+    """
+    global _created, _reused
+    key = (service_name, region_name, endpoint_url, repr(sorted(config_kwargs.items())))
+    client = _clients.get(key)
+    if client is not None:
+        _reused += 1
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            config_kwargs.setdefault('max_pool_connections', MAX_POOL_CONNECTIONS)
+            client = _get_session().client(
+                service_name,
+                region_name=region_name,
+                endpoint_url=endpoint_url,
+                config=Config(**config_kwargs)
+            )
+            _clients[key] = client
+            _created += 1
+        else:
+            _reused += 1
+    return client
+
+
+def warm_up(specs):
+    """
+    Create clients ahead of the first request (call from the app startup event).
+    Args:
+        specs (list[dict]): get_client() keyword arguments, one dict per client.
+    """
+    for spec in specs:
+        get_client(**dict(spec))
+
+
+def stats():
+    with _lock:
+        return {
+            "clients": len(_clients),
+            "created": _created,
+            "reused": _reused,
+            "max_pool_connections": MAX_POOL_CONNECTIONS,
+        }
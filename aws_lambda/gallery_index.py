@@ -0,0 +1,304 @@
+import base64
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus
+
+from botocore.exceptions import ClientError
+
+from renditions import is_derived, parse_thumbnail_key
+
+# 圖片清單索引: bucket 中的圖片 key 存在一個 SQLite 檔, 檔案本身也放在 S3 (MANIFEST_KEY)
+# - S3 ObjectCreated / ObjectRemoved 事件觸發時逐筆更新, 以 If-Match 條件寫回避免同時更新互相覆蓋
+# - 列表依 key 做 keyset 分頁 (cursor 為上一頁最後一個 key), 每頁成本與 bucket 大小無關
+# - 索引不存在或要求重建時, 以 list_objects_v2 paginator 全量掃描
+# - derived/ 下的縮圖 (makeDerivatives.py 產生) 記在 renditions 表, 列表時附在對應的圖片上
+MANIFEST_KEY = os.getenv('MANIFEST_KEY', '_manifest/images.sqlite')
+# warm container 每隔多久檢查一次 S3 上的索引是否被其他執行個體更新
+REFRESH_SECONDS = float(os.getenv('MANIFEST_REFRESH_SECONDS', '30'))
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif")
+MAX_PAGE_SIZE = 1000
+SAVE_ATTEMPTS = 5
+
+
+def is_image(key):
+    return key.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_indexed(key):
+    "Keys the manifest tracks: images and their derived/ renditions (never the manifest itself)."
+    if key == MANIFEST_KEY:
+        return False
+    return parse_thumbnail_key(key) is not None if is_derived(key) else is_image(key)
+
+
+def s3_event_records(event):
+    "S3 event records of a direct S3 notification or of one fanned out through SNS (several Lambdas on one bucket)."
+    records = []
+    for record in event.get('Records') or []:
+        if 's3' in record:
+            records.append(record)
+        elif 'Sns' in record:
+            records += json.loads(record['Sns']['Message']).get('Records', [])
+    return records
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        key = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    except (ValueError, UnicodeError):
+        key = None
+    if not key or encode_cursor(key) != cursor:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return key
+
+
+def parse_time(value):
+    "ISO 8601 date or datetime (UTC when no offset) -> normalised ISO string used in the index."
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class ManifestIndex:
+    "SQLite listing of the image keys in one bucket, persisted as an S3 object"
+
+    def __init__(self, s3, bucket, manifest_key=MANIFEST_KEY, local_path=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.manifest_key = manifest_key
+        self.local_path = local_path or os.path.join(tempfile.gettempdir(), f"{bucket}-images.sqlite")
+        # 本機檔案對應的 ETag 另存一份, 重新啟動的執行個體 (/tmp 仍在) 不必重新下載未變動的索引
+        self.etag_path = self.local_path + ".etag"
+        self.etag = None  # 目前本機檔案對應的 S3 ETag, None 代表 S3 上還沒有索引
+        self._db = None
+        self._checked = 0.0
+
+    def _open(self):
+        if self._db is not None:
+            self._db.close()
+        self._db = sqlite3.connect(self.local_path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_last_modified ON images (last_modified)")
+        if 'stem' in {row[1] for row in self._db.execute("PRAGMA table_info(renditions)")}:
+            # 舊版縮圖以去副檔名的 key 對應原圖, 與現在的 derived/ 規則不符, 需以 rebuild 重新填入
+            self._db.execute("DROP TABLE renditions")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS renditions (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                format TEXT NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS renditions_source ON renditions (source)")
+        self._db.commit()
+
+    def _remember_etag(self, etag):
+        "The local copy now matches the manifest with this ETag."
+        self.etag = etag
+        with open(self.etag_path, 'w') as f:
+            f.write(etag)
+
+    def _discard_cached_etag(self):
+        "The local copy is about to diverge from S3 (download, local edits); keep self.etag for If-Match."
+        if os.path.exists(self.etag_path):
+            os.remove(self.etag_path)
+
+    def _cached_etag(self):
+        "ETag of the manifest copy already in local_path, None when unknown."
+        if not os.path.exists(self.local_path) or not os.path.exists(self.etag_path):
+            return None
+        with open(self.etag_path) as f:
+            return f.read().strip() or None
+
+    def load(self, force=False):
+        "Download the manifest when S3 has a newer one; rebuild it when it does not exist."
+        if not force and self._db is not None and time.time() - self._checked < REFRESH_SECONDS:
+            return
+        try:
+            etag = self.s3.head_object(Bucket=self.bucket, Key=self.manifest_key)['ETag']
+        except ClientError as err:
+            if err.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            print(f"Manifest s3://{self.bucket}/{self.manifest_key} not found, rebuilding")
+            self.etag = None
+            try:
+                self.rebuild()
+            except ClientError as err:
+                # 另一個執行個體同時建好了索引, 改用它的
+                if err.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                    raise
+                self.load(force=True)
+            return
+        if self._db is None and etag == self._cached_etag():
+            # 本機已有同一版本的索引, 直接開啟
+            self.etag = etag
+            self._open()
+        elif etag != self.etag or self._db is None:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+            self._discard_cached_etag()
+            self.s3.download_file(self.bucket, self.manifest_key, self.local_path)
+            self._remember_etag(etag)
+            self._open()
+        self._checked = time.time()
+
+    def rebuild(self):
+        "Full rescan of the bucket with the list_objects_v2 paginator."
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if os.path.exists(self.local_path):
+            os.remove(self.local_path)
+        self._discard_cached_etag()
+        self._open()
+        count = 0
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket):
+            contents = page.get('Contents', [])
+            rows = [(obj['Key'], obj['Size'], obj.get('ETag', '').strip('"'),
+                     obj['LastModified'].astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'))
+                    for obj in contents if is_image(obj['Key'])]
+            self._db.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)", rows)
+            derived = [(obj['Key'], *parse_thumbnail_key(obj['Key']))
+                       for obj in contents if parse_thumbnail_key(obj['Key'])]
+            self._db.executemany("INSERT OR REPLACE INTO renditions VALUES (?, ?, ?, ?)", derived)
+            count += len(rows)
+        self._db.commit()
+        self._save()
+        print(f"Rebuilt manifest with {count} images")
+        return count
+
+    def _save(self):
+        "Upload the SQLite file; only succeeds if nobody replaced the manifest since it was loaded."
+        self._db.commit()
+        with open(self.local_path, 'rb') as f:
+            condition = {'IfMatch': self.etag} if self.etag else {'IfNoneMatch': '*'}
+            response = self.s3.put_object(Bucket=self.bucket, Key=self.manifest_key, Body=f,
+                                          ContentType='application/vnd.sqlite3', **condition)
+        self._remember_etag(response['ETag'])
+        self._checked = time.time()
+
+    def _apply(self, records):
+        changed = 0
+        for record in records:
+            if 's3' not in record:
+                continue
+            key = unquote_plus(record['s3']['object']['key'])
+            thumbnail = parse_thumbnail_key(key)
+            if thumbnail:
+                if record['eventName'].startswith('ObjectRemoved'):
+                    self._db.execute("DELETE FROM renditions WHERE key = ?", (key,))
+                else:
+                    self._db.execute("INSERT OR REPLACE INTO renditions VALUES (?, ?, ?, ?)", (key, *thumbnail))
+                changed += 1
+                continue
+            if not is_image(key):
+                continue
+            if record['eventName'].startswith('ObjectRemoved'):
+                self._db.execute("DELETE FROM images WHERE key = ?", (key,))
+            else:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+                    (key, record['s3']['object'].get('size', 0), record['s3']['object'].get('eTag'),
+                     parse_time(record.get('eventTime', datetime.now(timezone.utc).isoformat()))))
+            changed += 1
+        return changed
+
+    def apply_events(self, records):
+        """
+        Apply S3 ObjectCreated / ObjectRemoved event records and write the manifest back.
+        Returns:
+            int: Number of image and rendition keys changed.
+        """
+        # 先過濾: 索引本身寫回時也會觸發事件, 與索引無關的 key 不必下載 / 檢查索引
+        records = [record for record in records
+                   if 's3' in record and is_indexed(unquote_plus(record['s3']['object']['key']))]
+        if not records:
+            return 0
+        for attempt in range(SAVE_ATTEMPTS):
+            self.load(force=True)
+            self._discard_cached_etag()
+            changed = self._apply(records)
+            if not changed:
+                self._remember_etag(self.etag)
+                return 0
+            try:
+                self._save()
+                return changed
+            except ClientError as err:
+                # 其他執行個體先寫回了索引 (412) 或正在寫入 (409): 重新下載後再套用一次
+                if err.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                    raise
+                print(f"Manifest changed concurrently, retrying ({attempt + 1}/{SAVE_ATTEMPTS})")
+                time.sleep(0.1 * (attempt + 1))
+        raise RuntimeError("Could not update the manifest after concurrent writes")
+
+    def list(self, prefix='', since=None, until=None, cursor=None, limit=50):
+        """
+        One page of image keys in key order.
+        Args:
+            prefix (str): Only keys starting with prefix.
+            since / until (str): ISO dates, filter on LastModified (until is exclusive).
+            cursor (str): next_cursor of the previous page.
+        Returns:
+            (list[dict], str): {"key", "size", "last_modified", "renditions"} rows and the next cursor (None on the last page);
+                renditions are {"key", "width", "format"} dicts sorted by width.
+        Raises:
+            ValueError: Invalid cursor, date or limit.
+        """
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        self.load()
+        where, params = [], []
+        if prefix:
+            # 以範圍條件取代 LIKE, 才能使用主鍵索引
+            where.append("key >= ? AND key < ?")
+            params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        if cursor:
+            where.append("key > ?")
+            params.append(decode_cursor(cursor))
+        if since:
+            where.append("last_modified >= ?")
+            params.append(parse_time(since))
+        if until:
+            where.append("last_modified < ?")
+            params.append(parse_time(until))
+        sql = "SELECT key, size, last_modified FROM images"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self._db.execute(sql + " ORDER BY key LIMIT ?", (*params, limit + 1)).fetchall()
+        items = [{"key": key, "size": size, "last_modified": last_modified, "renditions": []}
+                 for key, size, last_modified in rows[:limit]]
+        self._attach_renditions(items)
+        next_cursor = encode_cursor(items[-1]["key"]) if len(rows) > limit else None
+        return items, next_cursor
+
+    def _attach_renditions(self, items):
+        by_key = {item["key"]: item for item in items}
+        keys = list(by_key)
+        # 分批查詢, 避免超過 SQLite 參數個數上限
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT source, key, width, format FROM renditions WHERE source IN ({','.join('?' * len(batch))}) "
+                "ORDER BY width", batch).fetchall()
+            for source, key, width, image_format in rows:
+                by_key[source]["renditions"].append({"key": key, "width": width, "format": image_format})
@@ -1,24 +1,56 @@
 import boto3
+import json
 import os
 
+from presign_cache import PresignCache
+
 s3_client = boto3.client('s3')
+# presigned URL 快取 (見 presign_cache.py), warm invocation 之間沿用
+presign_cache = PresignCache(s3_client)
+
+HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*"
+}
+
+
+def requested_keys(event):
+    "keys=a,b,c in the query string, or {\"keys\": [...]} in a POST body"
+    params = event.get('queryStringParameters') or {}
+    if params.get('keys'):
+        return [key for key in params['keys'].split(',') if key]
+    if event.get('body'):
+        body = json.loads(event['body'])
+        keys = body.get('keys') if isinstance(body, dict) else None
+        if isinstance(keys, list) and all(isinstance(key, str) for key in keys):
+            return keys
+        raise ValueError('body must be {"keys": ["..."]}')
+    return None
+
 
 # 前端連接影片的URL
 def lambda_handler(event, context):
     bucket_name = 'testviedo-gen'
+    presign_cache.purge_expired()
+
+    # 批次: 一次取得多個影片的 URL, 回傳 {key: url}
+    try:
+        keys = requested_keys(event)
+        if keys is not None:
+            return {
+                'statusCode': 200,
+                'headers': HEADERS,
+                'body': json.dumps(presign_cache.get_many(bucket_name, keys))
+            }
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': HEADERS, 'body': json.dumps({'error': str(e)})}
+
     key = event['queryStringParameters']['key']
 
-    presigned_url = s3_client.generate_presigned_url(
-        'get_object',
-        Params={'Bucket': bucket_name, 'Key': key},
-        ExpiresIn=3600  # URL 有效時間，秒
-    )
+    presigned_url = presign_cache.get(bucket_name, key)
 
     return {
         'statusCode': 200,
-        'headers': {
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Headers": "*"
-        },
+        'headers': HEADERS,
         'body': presigned_url
     }
@@ -2,32 +2,77 @@ import boto3
 import json
 import os
 
+from gallery_index import ManifestIndex, s3_event_records
+from presign_cache import PresignCache
+from renditions import srcset
+
 s3 = boto3.client('s3')
 bucket_name = "testviedo"
 
+# 圖片清單索引 (見 gallery_index.py), warm container 之間沿用
+index = ManifestIndex(s3, bucket_name)
+# presigned URL 快取 (見 presign_cache.py), 重新整理頁面時沿用同一個 URL
+presign_cache = PresignCache(s3)
+
+HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*"
+}
+
+
+def presign(key):
+    return presign_cache.get(bucket_name, key)
+
+
+def listing_item(image, *fields):
+    "key, presigned url and srcset (makeDerivatives.py renditions) of one image, plus the requested index fields."
+    return dict({field: image[field] for field in fields}, key=image["key"], url=presign(image["key"]),
+                srcset=srcset(image["renditions"], presign))
+
+
+def handle_s3_event(records):
+    "S3 ObjectCreated / ObjectRemoved 通知: 增量更新索引"
+    changed = index.apply_events(records)
+    print(f"Applied {changed} image changes to the manifest")
+    return {'statusCode': 200, 'body': json.dumps({'changed': changed})}
+
+
 # 列出S3裡的圖片，產生presigned URL
 def lambda_handler(event, context):
-    response = s3.list_objects_v2(Bucket=bucket_name)
-
-    images = []
-    
-    for obj in response.get('Contents', []):
-        key = obj['Key']
-        if key.endswith((".png", ".jpg", ".jpeg", ".gif")):
-            # 產生presigned URL
-            presigned_url = s3.generate_presigned_url('get_object',
-                                                      Params={'Bucket': bucket_name, 'Key': key},
-                                                      ExpiresIn=3600)
-            images.append({
-                "key": key,
-                "url": presigned_url
-            })
+    event = event or {}
+    records = s3_event_records(event)
+    if records:
+        return handle_s3_event(records)
+    if event.get('rebuild'):
+        # 排程或手動觸發的全量重建
+        index.load()
+        return {'statusCode': 200, 'body': json.dumps({'images': index.rebuild()})}
+
+    presign_cache.purge_expired()
+    params = event.get('queryStringParameters') or {}
+    try:
+        if not params:
+            # 舊版前端: 不帶參數時回傳所有圖片的陣列
+            images, cursor = index.list(limit=1000)
+            while cursor:
+                page, cursor = index.list(cursor=cursor, limit=1000)
+                images += page
+            body = [listing_item(image) for image in images]
+        else:
+            images, next_cursor = index.list(prefix=params.get('prefix', ''),
+                                             since=params.get('since'),
+                                             until=params.get('until'),
+                                             cursor=params.get('cursor'),
+                                             limit=int(params.get('limit', 50)))
+            body = {
+                "items": [listing_item(image, "size", "last_modified") for image in images],
+                "next_cursor": next_cursor,
+            }
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': HEADERS, 'body': json.dumps({'error': str(e)})}
 
     return {
         'statusCode': 200,
-        'headers': {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "*"
-        },
-        'body': json.dumps(images)
-    }
\ No newline at end of file
+        'headers': HEADERS,
+        'body': json.dumps(body)
+    }
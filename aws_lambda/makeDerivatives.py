@@ -0,0 +1,135 @@
+import io
+import json
+import os
+import time
+from urllib.parse import unquote_plus
+
+import boto3
+from botocore.exceptions import ClientError
+from PIL import Image, ImageOps
+
+from gallery_index import MANIFEST_KEY, is_image, s3_event_records
+from renditions import (DERIVED_FORMATS, derivative_widths, is_derived, is_keyframe, parse_thumbnail_key,
+                        thumbnail_key, thumbnail_prefix, upload_args)
+
+# 圖片上傳時 (S3 ObjectCreated) 產生多解析度 WebP / AVIF 縮圖, 放在同一個 bucket 的 derived/ 下
+# 適用 testviedo 的原圖 / 畫格與 Nova Canvas 輸出的 _designed.jpg; 刪除原圖時一併刪除縮圖
+# 縮圖的 Metadata 記下來源 ETag, 重複送達的事件不會重新產生
+s3 = boto3.client('s3')
+
+WEBP_QUALITY = int(os.getenv('DERIVED_WEBP_QUALITY', '80'))
+AVIF_QUALITY = int(os.getenv('DERIVED_AVIF_QUALITY', '60'))
+# libavif 編碼速度 (0 最慢最小 ~ 10 最快), Lambda 上取偏快的設定
+AVIF_SPEED = int(os.getenv('DERIVED_AVIF_SPEED', '8'))
+
+
+def encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'avif':
+        image.save(buffer, format='AVIF', quality=AVIF_QUALITY, speed=AVIF_SPEED)
+    else:
+        image.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def make_derivatives(data, formats=DERIVED_FORMATS):
+    """
+    Resize one encoded image into the renditions.py width buckets.
+    Args:
+        data (bytes): The encoded source image.
+        formats (tuple): Output formats ("webp" / "avif").
+    Returns:
+        list[(int, str, bytes)]: (width, format, encoded bytes), largest width first.
+    """
+    image = Image.open(io.BytesIO(data))
+    widths = sorted(derivative_widths(image.width), reverse=True)
+    if image.format == 'JPEG':
+        # 解碼時就以 DCT 縮小到最大的輸出尺寸附近
+        image.draft('RGB', (widths[0], max(1, image.height * widths[0] // image.width)))
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    outputs = []
+    # 由大到小, 每一級從上一級縮小, 比每次都從原圖縮小省時
+    for width in widths:
+        if image.width != width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))),
+                                 Image.Resampling.LANCZOS)
+        for image_format in formats:
+            outputs.append((width, image_format, encode(image, image_format)))
+    return outputs
+
+
+def derivative_keys(bucket, key):
+    "Keys of the thumbnails of key; objects of another image nested under the same prefix are left out."
+    keys = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=thumbnail_prefix(key)):
+        for obj in page.get('Contents', []):
+            parsed = parse_thumbnail_key(obj['Key'])
+            if parsed and parsed[0] == key:
+                keys.append(obj['Key'])
+    return keys
+
+
+def is_current(bucket, key, etag):
+    "True when the derivatives of key were already generated from this version of it."
+    derived = derivative_keys(bucket, key)
+    if not derived:
+        return False
+    try:
+        head = s3.head_object(Bucket=bucket, Key=derived[0])
+    except ClientError:
+        return False
+    return head.get('Metadata', {}).get('source-etag') == etag
+
+
+def generate(bucket, key, etag=None):
+    "Download key, write its derivatives and return a size report."
+    if etag and is_current(bucket, key, etag):
+        print(f"Derivatives of s3://{bucket}/{key} are up to date")
+        return None
+    started = time.perf_counter()
+    data = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    outputs = make_derivatives(data)
+    encoded = time.perf_counter()
+    for width, image_format, body in outputs:
+        derived_key = thumbnail_key(key, width, image_format)
+        extra = upload_args(derived_key)
+        s3.put_object(Bucket=bucket, Key=derived_key, Body=body, ContentType=extra['ContentType'],
+                      CacheControl=extra['CacheControl'], Metadata={'source-etag': etag or ''})
+    report = {
+        'key': key,
+        'original_bytes': len(data),
+        'derivatives': {f"w{width}.{image_format}": len(body) for width, image_format, body in outputs},
+        'encode_ms': round((encoded - started) * 1000, 1),
+        'total_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+    print(json.dumps(report))
+    return report
+
+
+def remove(bucket, key):
+    "Delete the derivatives of a removed image."
+    derived = derivative_keys(bucket, key)
+    # delete_objects 每次最多 1000 個
+    for start in range(0, len(derived), 1000):
+        s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': k} for k in derived[start:start + 1000]]})
+    print(f"Removed {len(derived)} derivatives of s3://{bucket}/{key}")
+
+
+# S3 事件通知: 為新上傳的圖片產生縮圖
+def lambda_handler(event, context):
+    generated = 0
+    for record in s3_event_records(event):
+        bucket = record['s3']['bucket']['name']
+        key = unquote_plus(record['s3']['object']['key'])
+        # 縮圖本身與清單索引不處理, 避免事件循環
+        # 影片 ingest 的畫格在 ingest 時已一併輸出縮圖 (沒有 source-etag, is_current 無法判斷), 不再重新解碼
+        if is_derived(key) or is_keyframe(key) or key == MANIFEST_KEY or not is_image(key):
+            continue
+        if record['eventName'].startswith('ObjectRemoved'):
+            remove(bucket, key)
+        elif generate(bucket, key, record['s3']['object'].get('eTag')):
+            generated += 1
+    return {'statusCode': 200, 'body': json.dumps({'generated': generated})}
@@ -0,0 +1,232 @@
+# 最小的 Matroska (EBML) 解析, 用於 Kinesis Video Streams GetMedia 的 payload
+# 只讀取需要的 element, 其餘依 size 直接跳過
+
+# EBML element IDs (含長度標記位元)
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+CLUSTER = 0x1F43B675
+TAGS = 0x1254C367
+TAG = 0x7373
+SIMPLE_TAG = 0x67C8
+TAG_NAME = 0x45A3
+TAG_STRING = 0x4487
+
+# GetMedia 在每個 fragment 的 Tags 中加入的標籤
+FRAGMENT_NUMBER_TAG = "AWS_KINESISVIDEO_FRAGMENT_NUMBER"
+PRODUCER_TIMESTAMP_TAG = "AWS_KINESISVIDEO_PRODUCER_TIMESTAMP"
+SERVER_TIMESTAMP_TAG = "AWS_KINESISVIDEO_SERVER_TIMESTAMP"
+CONTINUATION_TOKEN_TAG = "AWS_KINESISVIDEO_CONTINUATION_TOKEN"
+# 單一 fragment 的上限, 超過即視為資料錯誤 (KVS fragment 通常只有數 MB)
+MAX_FRAGMENT_BYTES = 64 * 1024 * 1024
+
+TRACK_TYPES = {1: "video", 2: "audio"}
+# Matroska CodecID -> ffmpeg codec name
+CODEC_NAMES = {
+    "V_MPEG4/ISO/AVC": "h264",
+    "V_MPEGH/ISO/HEVC": "hevc",
+    "V_MJPEG": "mjpeg",
+    "V_VP8": "vp8",
+    "V_VP9": "vp9",
+    "A_AAC": "aac",
+    "A_MPEG/L3": "mp3",
+    "A_OPUS": "opus",
+    "A_PCM/INT/LIT": "pcm_s16le",
+    "A_MS/ACM": "pcm",
+}
+
+
+class NeedMoreData(Exception):
+    "The buffer ends in the middle of an element."
+
+
+def read_vint(data, offset, keep_marker=False):
+    """
+    Read an EBML variable-length integer.
+    Returns:
+        (int, int): The value and its length in bytes; the value is None for an unknown size.
+    """
+    if offset >= len(data):
+        raise NeedMoreData()
+    first = data[offset]
+    if first == 0:
+        raise ValueError(f"Invalid EBML vint at offset {offset}")
+    length = 9 - first.bit_length()
+    if offset + length > len(data):
+        raise NeedMoreData()
+    value = int.from_bytes(data[offset:offset + length], "big")
+    if keep_marker:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    if value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def read_element_header(data, offset):
+    "Returns (element_id, size, data_offset); size is None for unknown-size masters."
+    element_id, id_length = read_vint(data, offset, keep_marker=True)
+    size, size_length = read_vint(data, offset + id_length)
+    return element_id, size, offset + id_length + size_length
+
+
+def _codec_name(codec_id):
+    if codec_id.startswith("A_AAC"):
+        return "aac"
+    return CODEC_NAMES.get(codec_id, codec_id)
+
+
+def track_codecs(header):
+    """
+    Parse the Tracks element at the start of a Matroska stream.
+    Args:
+        header (bytes): The first bytes of the stream.
+    Returns:
+        list[dict]: {"number", "type", "codec_id", "codec"} per track.
+    Raises:
+        NeedMoreData: Tracks is not complete in header yet.
+    """
+    offset = 0
+    while True:
+        element_id, size, data_offset = read_element_header(header, offset)
+        if element_id == SEGMENT:
+            offset = data_offset  # 進入 Segment
+            continue
+        if element_id == CLUSTER:
+            return []  # Tracks 一定在第一個 Cluster 之前
+        if size is None:
+            raise ValueError(f"Unknown-size element 0x{element_id:X} before Tracks")
+        if element_id == TRACKS:
+            if data_offset + size > len(header):
+                raise NeedMoreData()
+            return _parse_tracks(header, data_offset, data_offset + size)
+        offset = data_offset + size
+
+
+def _parse_tracks(data, offset, end):
+    tracks = []
+    while offset < end:
+        element_id, size, data_offset = read_element_header(data, offset)
+        if element_id == TRACK_ENTRY:
+            track = {}
+            child = data_offset
+            while child < data_offset + size:
+                child_id, child_size, child_data = read_element_header(data, child)
+                value = bytes(data[child_data:child_data + child_size])
+                if child_id == TRACK_NUMBER:
+                    track["number"] = int.from_bytes(value, "big")
+                elif child_id == TRACK_TYPE:
+                    track["type"] = TRACK_TYPES.get(int.from_bytes(value, "big"), "other")
+                elif child_id == CODEC_ID:
+                    track["codec_id"] = value.rstrip(b"\0").decode("ascii", "replace")
+                    track["codec"] = _codec_name(track["codec_id"])
+                child = child_data + child_size
+            tracks.append(track)
+        offset = data_offset + size
+    return tracks
+
+
+def _parse_tags(data, offset, end, tags):
+    while offset < end:
+        element_id, size, data_offset = read_element_header(data, offset)
+        if element_id == TAG:
+            _parse_tags(data, data_offset, data_offset + size, tags)
+        elif element_id == SIMPLE_TAG:
+            name = value = None
+            child = data_offset
+            while child < data_offset + size:
+                child_id, child_size, child_data = read_element_header(data, child)
+                if child_id == TAG_NAME:
+                    name = bytes(data[child_data:child_data + child_size]).decode("utf-8", "replace")
+                elif child_id == TAG_STRING:
+                    value = bytes(data[child_data:child_data + child_size]).rstrip(b"\0").decode("utf-8", "replace")
+                child = child_data + child_size
+            if name is not None:
+                tags[name] = value
+        offset = data_offset + size
+
+
+class Fragment:
+    "One KVS fragment: its raw Matroska bytes and the GetMedia tags found in it"
+
+    __slots__ = ("data", "tags")
+
+    def __init__(self, data, tags):
+        self.data = data
+        self.tags = tags
+
+    @property
+    def number(self):
+        return self.tags.get(FRAGMENT_NUMBER_TAG)
+
+    @property
+    def producer_timestamp(self):
+        "Seconds since the epoch, or None."
+        value = self.tags.get(PRODUCER_TIMESTAMP_TAG)
+        return float(value) if value else None
+
+    @property
+    def continuation_token(self):
+        return self.tags.get(CONTINUATION_TOKEN_TAG)
+
+
+class FragmentReader:
+    """
+    Incremental splitter for a GetMedia payload.
+
+    GetMedia returns one complete Matroska document (EBML header + Segment) per fragment;
+    feed() payload chunks in order and it returns each fragment once the next one starts.
+    Only element headers and Tags are parsed, everything else is skipped by size.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0  # 下一個要解析的 element 在 _buffer 中的位置
+        self._tags = {}
+        self._started = False
+
+    def feed(self, data):
+        "Returns the list of fragments completed by data."
+        self._buffer += data
+        fragments = []
+        while self._offset < len(self._buffer):
+            try:
+                element_id, size, data_offset = read_element_header(self._buffer, self._offset)
+            except NeedMoreData:
+                break
+            if element_id == EBML:
+                if self._started and self._offset > 0:
+                    cut = self._offset
+                    fragments.append(self._cut(cut))
+                    data_offset -= cut
+                self._started = True
+            if element_id == SEGMENT or size is None:
+                # 進入 master element (KVS 的 Segment 為未知長度), 繼續解析其子 element
+                self._offset = data_offset
+                continue
+            if element_id == TAGS:
+                if data_offset + size > len(self._buffer):
+                    break
+                _parse_tags(self._buffer, data_offset, data_offset + size, self._tags)
+            # 其餘 element 依長度跳過 (可能超過目前緩衝區, 等待後續資料)
+            self._offset = data_offset + size
+        if len(self._buffer) > MAX_FRAGMENT_BYTES:
+            raise ValueError(f"Fragment larger than {MAX_FRAGMENT_BYTES} bytes")
+        return fragments
+
+    def _cut(self, end):
+        fragment = Fragment(bytes(self._buffer[:end]), self._tags)
+        del self._buffer[:end]
+        self._offset -= end
+        self._tags = {}
+        return fragment
+
+    def finish(self):
+        "The last fragment, if the payload ended on an element boundary."
+        if self._started and self._buffer and self._offset == len(self._buffer):
+            return self._cut(len(self._buffer))
+        return None
@@ -2,7 +2,16 @@ import boto3
 import json
 import time
 import io
+import os
+import queue
+import re
+import shutil
 import subprocess
+import tempfile
+import threading
+
+from mkv import FragmentReader, track_codecs
+from renditions import IMAGE_BUCKET, KEYFRAME_SIZE, THUMBNAIL_WIDTHS, keyframe_key, thumbnail_key, upload_args
 
 kvs_client = boto3.client('kinesisvideo')
 s3_client = boto3.client('s3')
@@ -10,17 +19,475 @@ s3_client = boto3.client('s3')
 STREAM_NAME = 'designvideo'
 BUCKET_NAME = 'kvsstream'
 
+# stream: payload 直接餵進 ffmpeg stdin, fragmented MP4 從 stdout 邊產生邊以 multipart 上傳 S3
+# buffer: 舊流程 (整段讀進記憶體 -> /tmp -> ffmpeg -> 上傳)
+INGEST_MODE = os.getenv('INGEST_MODE', 'stream')
+# buffer 模式擷取的秒數
+CAPTURE_SECONDS = int(os.getenv('CAPTURE_SECONDS', '40'))
+# multipart 每個 part 的大小 (S3 最小 5 MB); 記憶體峰值約 2 個 part 加上 pipe 緩衝
+PART_SIZE = int(os.getenv('UPLOAD_PART_SIZE', str(5 * 1024 * 1024)))
+READ_SIZE = 64 * 1024
+
+# GetMedia 讀取大小依實際吞吐量調整: 追趕積壓時用大塊減少 Python 迴圈次數, 直播時用小塊避免 read() 久候
+MIN_READ_SIZE = 16 * 1024
+MAX_READ_SIZE = 1024 * 1024
+READ_TARGET_SECONDS = 0.25
+# 依 Lambda 剩餘時間排程: 擷取在 deadline 前預留收尾時間 (ffmpeg 排空、最後一個 part、checkpoint)
+FINALIZE_RESERVE_SECONDS = float(os.getenv('FINALIZE_RESERVE_SECONDS', '8'))
+# 需要轉碼時 ffmpeg 落後輸入較多, 額外預留
+TRANSCODE_RESERVE_SECONDS = float(os.getenv('TRANSCODE_RESERVE_SECONDS', '20'))
+METRICS_NAMESPACE = os.getenv('METRICS_NAMESPACE', 'AIwave/Ingest')
+
+# 同一個 ffmpeg 行程在輸出 MP4 的同時, 每 KEYFRAME_INTERVAL_SECONDS 取一張畫格,
+# 輸出 1280x720 JPEG 與各寬度 WebP 縮圖到 IMAGE_BUCKET (key 規則見 renditions.py), 之後不必再解碼影片
+RENDITIONS = os.getenv('RENDITIONS', '1') == '1'
+KEYFRAME_INTERVAL_SECONDS = int(os.getenv('KEYFRAME_INTERVAL_SECONDS', '5'))
+WEBP_QUALITY = os.getenv('WEBP_QUALITY', '75')
+
+# ICAM-540 送進 KVS 的已是 H.264: 容器相容的編碼直接 stream copy, 其餘才轉碼
+MP4_COPY_VIDEO = {'h264', 'hevc'}
+MP4_COPY_AUDIO = {'aac', 'mp3'}
+TRANSCODE_PRESET = os.getenv('TRANSCODE_PRESET', 'veryfast')
+TRANSCODE_CRF = os.getenv('TRANSCODE_CRF', '23')
+
+# 串流模式依 fragment 切段: 每段為 producer timestamp 落在 SEGMENT_SECONDS 內的完整 fragments,
+# 最後封存的 fragment 記在 checkpoint, 下一次呼叫從它之後接續 GetMedia, 段與段之間不漏畫面
+SEGMENT_SECONDS = float(os.getenv('SEGMENT_SECONDS', '40'))
+# 直播時讀取一段的實際時間上限 (串流中斷或沒有 producer timestamp 時)
+CAPTURE_TIMEOUT_SECONDS = float(os.getenv('CAPTURE_TIMEOUT_SECONDS', '60'))
+CHECKPOINT_KEY = f"{STREAM_NAME}/_checkpoint.json"
+# 設定時改存本機檔案 (例如 EFS), 否則存在 BUCKET_NAME/CHECKPOINT_KEY
+CHECKPOINT_PATH = os.getenv('CHECKPOINT_PATH')
+
+def codec_args(streams):
+    """
+    ffmpeg codec options for MP4 output: stream copy when the input codec fits MP4, tuned transcode otherwise.
+    Args:
+        streams (list[dict]): {"type": "video" / "audio", "codec": ffmpeg codec name}, None if unknown.
+    """
+    if streams is None:
+        video, audio = None, 'unknown'
+    else:
+        video = next((s['codec'] for s in streams if s.get('type') == 'video'), None)
+        audio = next((s['codec'] for s in streams if s.get('type') == 'audio'), None)
+
+    if video in MP4_COPY_VIDEO:
+        args = ['-c:v', 'copy']
+        if video == 'hevc':
+            args += ['-tag:v', 'hvc1']
+    else:
+        args = ['-c:v', 'libx264', '-preset', TRANSCODE_PRESET, '-crf', TRANSCODE_CRF, '-pix_fmt', 'yuv420p']
+
+    if audio is None:
+        args += ['-an']
+    elif audio in MP4_COPY_AUDIO:
+        args += ['-c:a', 'copy']
+    else:
+        args += ['-c:a', 'aac', '-b:a', '128k']
+    return args
+
+
+def probe_file(input_file):
+    "Codec of each stream via ffprobe; None when probing fails."
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'stream=codec_type,codec_name',
+                                 '-of', 'json', input_file], capture_output=True, check=True)
+        return [{'type': s.get('codec_type'), 'codec': s.get('codec_name')}
+                for s in json.loads(result.stdout).get('streams', [])]
+    except Exception as e:
+        print(f"ffprobe failed, transcoding: {e}")
+        return None
+
+
+def load_checkpoint():
+    "Last fragment archived by the previous invocation, or None."
+    try:
+        if CHECKPOINT_PATH:
+            with open(CHECKPOINT_PATH) as f:
+                return json.load(f)
+        body = s3_client.get_object(Bucket=BUCKET_NAME, Key=CHECKPOINT_KEY)['Body'].read()
+        return json.loads(body)
+    except FileNotFoundError:
+        return None
+    except s3_client.exceptions.NoSuchKey:
+        return None
+
+
+def save_checkpoint(checkpoint):
+    body = json.dumps(checkpoint)
+    if CHECKPOINT_PATH:
+        with open(CHECKPOINT_PATH, 'w') as f:
+            f.write(body)
+    else:
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=CHECKPOINT_KEY, Body=body.encode('utf-8'))
+
+
+def start_selector(checkpoint):
+    "Resume right after the checkpointed fragment; start at NOW when there is none."
+    if not checkpoint:
+        return {'StartSelectorType': 'NOW'}
+    if checkpoint.get('continuation_token'):
+        return {'StartSelectorType': 'CONTINUATION_TOKEN', 'ContinuationToken': checkpoint['continuation_token']}
+    return {'StartSelectorType': 'FRAGMENT_NUMBER', 'AfterFragmentNumber': checkpoint['fragment_number']}
+
+
+class IngestBudget:
+    "Time budget derived from the Lambda deadline (context.get_remaining_time_in_millis)."
+
+    def __init__(self, context=None):
+        self.started = time.time()
+        remaining_ms = context.get_remaining_time_in_millis() if context is not None else None
+        self.deadline = self.started + remaining_ms / 1000 if remaining_ms is not None else None
+        self.phases = {}
+
+    def remaining(self):
+        return float('inf') if self.deadline is None else self.deadline - time.time()
+
+    def capture_seconds(self, reserve_seconds, limit):
+        "How long capture may still run, leaving reserve_seconds for conversion and upload."
+        return max(0.0, min(limit, self.remaining() - reserve_seconds))
+
+    def mark(self, phase, started):
+        self.phases[phase] = round((time.time() - started) * 1000, 1)
+
+
+class AdaptiveReader:
+    "Sizes each read to about READ_TARGET_SECONDS of the observed payload throughput."
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.read_size = READ_SIZE
+        self.reads = 0
+        self._rate = None  # bytes/sec, EWMA
+
+    def read(self):
+        started = time.time()
+        chunk = self.stream.read(self.read_size)
+        elapsed = max(time.time() - started, 1e-3)
+        self.reads += 1
+        if chunk:
+            rate = len(chunk) / elapsed
+            self._rate = rate if self._rate is None else 0.7 * self._rate + 0.3 * rate
+            self.read_size = int(min(MAX_READ_SIZE, max(MIN_READ_SIZE, self._rate * READ_TARGET_SECONDS)))
+        return chunk
+
+
+def rendition_args(out_dir):
+    "Extra ffmpeg outputs writing sampled keyframes and WebP thumbnails into out_dir."
+    labels = ['kf'] + [f'w{width}' for width in THUMBNAIL_WIDTHS]
+    graph = [f"[0:v]fps=1/{KEYFRAME_INTERVAL_SECONDS},split={len(labels)}" + ''.join(f'[{l}_in]' for l in labels),
+             f"[kf_in]scale={KEYFRAME_SIZE[0]}:{KEYFRAME_SIZE[1]}[kf]"]
+    graph += [f"[w{width}_in]scale={width}:-2[w{width}]" for width in THUMBNAIL_WIDTHS]
+    args = ['-filter_complex', ';'.join(graph)]
+    outputs = ['-map', '[kf]', '-q:v', '3', os.path.join(out_dir, 'kf_%05d.jpg')]
+    for width in THUMBNAIL_WIDTHS:
+        outputs += ['-map', f'[w{width}]', '-c:v', 'libwebp', '-quality', WEBP_QUALITY,
+                    os.path.join(out_dir, f'w{width}_%05d.webp')]
+    return args, outputs
+
+
+def upload_renditions(out_dir, video_key):
+    "Upload the images written by rendition_args() under the renditions.py layout."
+    uploaded = 0
+    for name in sorted(os.listdir(out_dir)):
+        match = re.fullmatch(r'(kf|w(\d+))_(\d+)\.(jpg|webp)', name)
+        if not match:
+            continue
+        # image2 從 1 開始編號, 第 n 張對應片段開頭後 (n - 1) * KEYFRAME_INTERVAL_SECONDS 秒
+        seconds = (int(match.group(3)) - 1) * KEYFRAME_INTERVAL_SECONDS
+        key = keyframe_key(video_key, seconds)
+        if match.group(2):
+            key = thumbnail_key(key, int(match.group(2)))
+        s3_client.upload_file(os.path.join(out_dir, name), IMAGE_BUCKET, key, ExtraArgs=upload_args(key))
+        uploaded += 1
+    return uploaded
+
+
+def emit_metrics(metrics, **dimensions):
+    "Print one CloudWatch Embedded Metric Format record; *_ms values are Milliseconds, the rest Count/Bytes."
+    units = {name: 'Milliseconds' if name.endswith('_ms') else 'Bytes' if name.endswith('_bytes') else 'Count'
+             for name in metrics}
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()],
+            }],
+        },
+        **dimensions,
+        **metrics,
+    }))
+
+
+def iter_fragments(payload_stream, skip_fragment_number=None):
+    "Complete KVS fragments from the GetMedia payload, in order."
+    reader = FragmentReader()
+    while True:
+        chunk = payload_stream.read()
+        fragments = reader.feed(chunk) if chunk else [reader.finish()]
+        for fragment in fragments:
+            # FRAGMENT_NUMBER 從指定的 fragment 開始 (含), 已封存過的略過
+            if fragment is not None and (fragment.number is None or fragment.number != skip_fragment_number):
+                yield fragment
+        if not chunk:
+            return
+
+
 """將TS格式的影片轉換為MP4格式(ffmepg)"""
 def convert_to_mp4(input_file, output_file):
     try:
-        subprocess.run(['ffmpeg', '-i', input_file, '-c:v', 'libx264', '-c:a', 'aac', '-strict', 'experimental', output_file])
-        print(f"Video successfully converted to {output_file}")
+        args = codec_args(probe_file(input_file))
+        subprocess.run(['ffmpeg', '-i', input_file, *args, output_file])
+        print(f"Video successfully converted to {output_file} ({' '.join(args)})")
     except Exception as e:
         print(f"Error during conversion: {e}")
 
+class S3MultipartWriter:
+    """
+    File-like writer that uploads to S3 as a multipart upload, one part per PART_SIZE bytes.
+    Parts are sent by a single background thread while the next part fills.
+    """
+
+    def __init__(self, bucket, key, part_size=PART_SIZE, content_type='video/mp4'):
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.upload_id = s3_client.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType=content_type)['UploadId']
+        self.parts = []
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._part_number = 0
+        self._pending = queue.Queue(maxsize=1)  # 最多一個 part 等待上傳
+        self._error = None
+        self._uploader = threading.Thread(target=self._upload_parts, daemon=True)
+        self._uploader.start()
+
+    def _upload_parts(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            part_number, body = item
+            if self._error is not None:
+                continue
+            try:
+                response = s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                 PartNumber=part_number, Body=body)
+                self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+            except Exception as e:
+                self._error = e
+
+    def _flush(self):
+        if self._error is not None:
+            raise self._error
+        self._part_number += 1
+        self._pending.put((self._part_number, bytes(self._buffer)))
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._flush()
+
+    def _finish_uploads(self):
+        if self._uploader.is_alive():
+            self._pending.put(None)
+            self._uploader.join()
+
+    def close(self):
+        "Upload the last part and complete the upload; returns False if nothing was written."
+        if self._buffer and self._error is None:
+            self._flush()
+        self._finish_uploads()
+        if self._error is not None:
+            self.abort()
+            raise self._error
+        if not self.bytes_written:
+            self.abort()
+            return False
+        s3_client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': sorted(self.parts, key=lambda part: part['PartNumber'])})
+        return True
+
+    def abort(self):
+        self._finish_uploads()
+        s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def _feed_fragments(first, fragments, stdin, stats, budget, reserve_seconds):
+    """
+    Write whole fragments into ffmpeg stdin until the segment is SEGMENT_SECONDS long
+    or the Lambda deadline minus reserve_seconds is reached (the partial segment is still committed).
+    """
+    start_time = time.time()
+    start_timestamp = first.producer_timestamp
+    # 擷取上限只在開始時算一次: capture_seconds 已扣掉經過的時間, 每個 fragment 重算會重複扣除
+    limit = budget.capture_seconds(reserve_seconds, CAPTURE_TIMEOUT_SECONDS)
+    try:
+        fragment = first
+        while True:
+            stdin.write(fragment.data)
+            stats['input_bytes'] += len(fragment.data)
+            stats['fragments'] += 1
+            stats['last'] = fragment
+            if time.time() - start_time >= limit:
+                stats['deadline_cut'] = limit < CAPTURE_TIMEOUT_SECONDS
+                break
+            fragment = next(fragments, None)
+            if fragment is None:
+                break
+            timestamp = fragment.producer_timestamp
+            if timestamp is not None and start_timestamp is not None and timestamp - start_timestamp >= SEGMENT_SECONDS:
+                break  # 這個 fragment 屬於下一段, 不寫入也不記入 checkpoint
+    except BrokenPipeError:
+        pass  # ffmpeg 已結束, 錯誤由 returncode 回報
+    finally:
+        budget.mark('capture_ms', start_time)
+        stats['capture_end'] = time.time()
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def stream_to_mp4(payload_stream, checkpoint=None, budget=None):
+    """
+    Remux (or transcode when needed) one segment of whole fragments to fragmented MP4,
+    upload it while it is produced, then checkpoint its last fragment.
+    Returns:
+        dict: Segment key, byte counts and last fragment number, or None when no fragment was received.
+    """
+    budget = budget or IngestBudget()
+    reader = AdaptiveReader(payload_stream)
+    fragments = iter_fragments(reader, (checkpoint or {}).get('fragment_number'))
+    wait_started = time.time()
+    first = next(fragments, None)
+    budget.mark('first_fragment_ms', wait_started)
+    if first is None:
+        return None
+    # 每個 fragment 都帶有 Tracks, 由第一個 fragment 決定 stream copy 或轉碼
+    try:
+        streams = track_codecs(first.data)
+    except ValueError as e:
+        print(f"Cannot parse MKV tracks: {e}")
+        streams = None
+    args = codec_args(streams)
+    print(f"Input tracks: {streams}, ffmpeg codec options: {' '.join(args)}")
+    transcoding = args[1] != 'copy'
+    reserve_seconds = FINALIZE_RESERVE_SECONDS + (TRANSCODE_RESERVE_SECONDS if transcoding else 0)
+
+    # 以第一個 fragment 的 producer timestamp 命名, 重跑同一段會得到同一個 key
+    segment_time = time.gmtime(first.producer_timestamp) if first.producer_timestamp else time.gmtime()
+    key = f"{STREAM_NAME}/{time.strftime('%Y%m%d-%H%M%S', segment_time)}.mp4"
+
+    # 無法解析 Tracks 時不知道是否有影像, 不加縮圖輸出以免 [0:v] 讓整段失敗
+    has_video = streams is not None and any(s.get('type') == 'video' for s in streams)
+    out_dir = tempfile.mkdtemp(prefix='renditions-') if RENDITIONS and has_video else None
+    input_options, filter_args, rendition_outputs = [], [], []
+    if out_dir:
+        filter_args, rendition_outputs = rendition_args(out_dir)
+        if not transcoding:
+            # stream copy 時 MP4 不需解碼, 縮圖只解碼 keyframe 即可
+            input_options = ['-skip_frame', 'nokey']
+
+    command = ['ffmpeg', '-loglevel', 'error', *input_options, '-i', 'pipe:0', *filter_args,
+               '-map', '0:v:0?', '-map', '0:a:0?', *args,
+               # fragmented MP4: moov 在開頭, 不需要 seek 輸出, 可直接寫到 pipe
+               '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+               '-f', 'mp4', 'pipe:1', *rendition_outputs]
+    # 先建立 multipart upload; 失敗時 ffmpeg 與 threads 都還沒啟動
+    try:
+        writer = S3MultipartWriter(BUCKET_NAME, key)
+    except Exception:
+        if out_dir:
+            shutil.rmtree(out_dir, ignore_errors=True)
+        raise
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except Exception:
+        writer.abort()
+        if out_dir:
+            shutil.rmtree(out_dir, ignore_errors=True)
+        raise
+    stats = {'input_bytes': 0, 'fragments': 0, 'last': first, 'deadline_cut': False}
+    errors = []
+    threads = [
+        threading.Thread(target=_feed_fragments,
+                         args=(first, fragments, process.stdin, stats, budget, reserve_seconds), daemon=True),
+        threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            chunk = process.stdout.read(READ_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+        process.wait()
+        for thread in threads:
+            thread.join()
+        # 擷取結束後 ffmpeg 排空剩餘輸出的時間
+        budget.mark('convert_ms', stats['capture_end'])
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {errors[0].decode('utf-8', 'replace').strip() if errors else ''}")
+    except Exception:
+        process.kill()
+        for thread in threads:
+            thread.join(timeout=5)
+        writer.abort()
+        if out_dir:
+            shutil.rmtree(out_dir, ignore_errors=True)
+        raise
+    upload_started = time.time()
+    if not writer.close():
+        return None
+    budget.mark('upload_ms', upload_started)
+
+    renditions = 0
+    if out_dir:
+        renditions_started = time.time()
+        try:
+            renditions = upload_renditions(out_dir, key)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+        budget.mark('renditions_ms', renditions_started)
+
+    # 上傳完成後才更新 checkpoint; 失敗時下一次呼叫會重做同一段
+    last = stats['last']
+    if last.number is not None:
+        save_checkpoint({
+            'fragment_number': last.number,
+            'producer_timestamp': last.producer_timestamp,
+            'continuation_token': last.continuation_token,
+            'segment_key': key,
+        })
+    budget.mark('total_ms', budget.started)
+    emit_metrics({
+        **budget.phases,
+        'remaining_ms': round(budget.remaining() * 1000, 1) if budget.deadline else 0,
+        'input_bytes': stats['input_bytes'],
+        'output_bytes': writer.bytes_written,
+        'fragments': stats['fragments'],
+        'reads': reader.reads,
+        'deadline_cuts': int(stats['deadline_cut']),
+        'renditions': renditions,
+    }, StreamName=STREAM_NAME, Path='transcode' if transcoding else 'remux')
+    return {'key': key, 'input_bytes': stats['input_bytes'], 'output_bytes': writer.bytes_written,
+            'parts': len(writer.parts), 'fragments': stats['fragments'], 'last_fragment_number': last.number,
+            'renditions': renditions}
+
+
 # Lambda處理影片串流並存儲至S3
 def lambda_handler(event, context):
     print(f"Received event: {event}")
+    budget = IngestBudget(context)
 
     if not STREAM_NAME or not BUCKET_NAME:
         return {
@@ -40,24 +507,47 @@ def lambda_handler(event, context):
         # Initialize media client
         kvs_media_client = boto3.client('kinesis-video-media', endpoint_url=endpoint)
 
-        # Get media
+        # Get media (串流模式從上一次封存的 fragment 之後接續)
+        checkpoint = load_checkpoint() if INGEST_MODE == 'stream' else None
+        selector = start_selector(checkpoint)
+        print(f"GetMedia start selector: {selector}")
         media_response = kvs_media_client.get_media(
             StreamName=STREAM_NAME,
-            StartSelector={'StartSelectorType': 'NOW'}
+            StartSelector=selector
         )
 
         payload_stream = media_response['Payload']
 
-        # Read payload for 40 seconds and write it to buffer
+        if INGEST_MODE == 'stream':
+            result = stream_to_mp4(payload_stream, checkpoint, budget)
+            if result is None:
+                print("No payload received.")
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps('No payload received.')
+                }
+            mp4_key = result['key']
+            print(f"Streamed {result['fragments']} fragments ({result['input_bytes']} bytes) -> "
+                  f"s3://{BUCKET_NAME}/{mp4_key} ({result['output_bytes']} bytes, {result['parts']} parts), "
+                  f"last fragment {result['last_fragment_number']}")
+            return {
+                'statusCode': 200,
+                'body': json.dumps(f'Successfully stored converted video to s3://{BUCKET_NAME}/{mp4_key}')
+            }
+
+        # Read payload for 40 seconds (縮短到能在 deadline 前完成轉檔與上傳) and write it to buffer
         buffer = io.BytesIO()
         start_time = time.time()
-        max_duration_seconds = 40
+        max_duration_seconds = budget.capture_seconds(FINALIZE_RESERVE_SECONDS + TRANSCODE_RESERVE_SECONDS,
+                                                      CAPTURE_SECONDS)
+        reader = AdaptiveReader(payload_stream)
 
         while time.time() - start_time < max_duration_seconds:
-            chunk = payload_stream.read(4096)
+            chunk = reader.read()
             if not chunk:
                 break
             buffer.write(chunk)
+        budget.mark('capture_ms', start_time)
 
         if buffer.tell() > 0:
             buffer.seek(0)
@@ -72,11 +562,22 @@ def lambda_handler(event, context):
 
             # Convert TS to MP4 using FFmpeg
             mp4_file = f"/tmp/{timestamp}.mp4"
+            convert_started = time.time()
             convert_to_mp4(local_ts_file, mp4_file)
+            budget.mark('convert_ms', convert_started)
 
             # Upload converted video to S3
+            upload_started = time.time()
             with open(mp4_file, 'rb') as f:
                 s3_client.upload_fileobj(f, BUCKET_NAME, f"{STREAM_NAME}/{timestamp}.mp4")
+            budget.mark('upload_ms', upload_started)
+            budget.mark('total_ms', budget.started)
+            emit_metrics({
+                **budget.phases,
+                'remaining_ms': round(budget.remaining() * 1000, 1) if budget.deadline else 0,
+                'input_bytes': buffer.tell(),
+                'reads': reader.reads,
+            }, StreamName=STREAM_NAME, Path='buffer')
 
             print(f"Successfully stored converted video to s3://{BUCKET_NAME}/{timestamp}.mp4")
             return {
@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# presigned URL 快取: 同一個 key 在有效期剩下 PRESIGN_REFRESH_FRACTION 以上時沿用同一個 URL,
+# 瀏覽器與 CDN 才能快取 (URL 不變), 也省去每次列表對上百個 key 做 HMAC 簽章
+# 快取為模組層級, 在 Lambda warm invocation 之間保留
+PRESIGN_EXPIRES = int(os.getenv('PRESIGN_EXPIRES', '3600'))
+PRESIGN_REFRESH_FRACTION = float(os.getenv('PRESIGN_REFRESH_FRACTION', '0.25'))
+PRESIGN_CACHE_SIZE = int(os.getenv('PRESIGN_CACHE_SIZE', '10000'))
+MAX_BATCH_KEYS = 500
+
+
+class PresignCache:
+    "LRU cache of presigned get_object URLs, evicted by expiry and by size"
+
+    def __init__(self, s3, expires=PRESIGN_EXPIRES, refresh_fraction=PRESIGN_REFRESH_FRACTION,
+                 max_entries=PRESIGN_CACHE_SIZE):
+        self.s3 = s3
+        self.expires = expires
+        self.refresh_fraction = refresh_fraction
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (bucket, key) -> (url, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, bucket, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            if entry is not None and entry[1] - now > self.expires * self.refresh_fraction:
+                self._entries.move_to_end((bucket, key))
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        url = self.s3.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': key},
+                                             ExpiresIn=self.expires)
+        with self._lock:
+            self._entries[(bucket, key)] = (url, now + self.expires)
+            self._entries.move_to_end((bucket, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return url
+
+    def get_many(self, bucket, keys):
+        """
+        Presign several keys in one call.
+        Returns:
+            dict: key -> URL, in the order of keys.
+        Raises:
+            ValueError: More than MAX_BATCH_KEYS keys.
+        """
+        if len(keys) > MAX_BATCH_KEYS:
+            raise ValueError(f"At most {MAX_BATCH_KEYS} keys per request")
+        return {key: self.get(bucket, key) for key in keys}
+
+    def purge_expired(self):
+        "Drop entries that can no longer be reused."
+        threshold = time.time() + self.expires * self.refresh_fraction
+        with self._lock:
+            for cache_key in [k for k, (_, expires_at) in self._entries.items() if expires_at <= threshold]:
+                del self._entries[cache_key]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,86 @@
+import os
+import posixpath
+import re
+
+# 影片 ingest 時順便產生的畫格 / 縮圖在 S3 上的 key 規則, 由各 Lambda 共用:
+#   keyframes/{影片 key 去副檔名}/t{秒數:05d}.jpg     1280x720 JPEG, 可直接作為 Nova Reel / Canvas 輸入
+#   derived/{圖片 key}/w{寬度}.{webp|avif}            多解析度縮圖, 供前端 srcset 使用
+#     (保留副檔名: a/b.png 與 a/b.jpg 的縮圖不會互相覆蓋)
+IMAGE_BUCKET = os.getenv('IMAGE_BUCKET', 'testviedo')
+KEYFRAME_SIZE = (1280, 720)
+THUMBNAIL_WIDTHS = (256, 512, 1280)
+# makeDerivatives.py 為上傳的圖片產生的格式, 依序為前端 <picture> 中 <source> 的偏好順序
+DERIVED_FORMATS = tuple(f for f in os.getenv('DERIVED_FORMATS', 'avif,webp').split(',') if f)
+CONTENT_TYPES = {'jpg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
+# key 內容固定 (同一來源產生同一張圖), 可長時間快取
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+KEYFRAME_PREFIX = 'keyframes/'
+THUMBNAIL_KEY = re.compile(r'derived/(.+)/w(\d+)\.(webp|avif)')
+
+
+def stem(key):
+    "frame_0.png -> frame_0, designvideo/20250101-000000.mp4 -> designvideo/20250101-000000"
+    return posixpath.splitext(key)[0]
+
+
+def keyframe_key(video_key, seconds):
+    return f"{KEYFRAME_PREFIX}{stem(video_key)}/t{int(seconds):05d}.jpg"
+
+
+def thumbnail_key(image_key, width, image_format='webp'):
+    return f"{thumbnail_prefix(image_key)}w{width}.{image_format}"
+
+
+def thumbnail_prefix(image_key):
+    "Prefix holding the thumbnails of image_key (and nothing of another image with the same stem)."
+    return f"derived/{image_key}/"
+
+
+def parse_thumbnail_key(key):
+    "derived/frame_0.png/w256.webp -> ('frame_0.png', 256, 'webp'); None for other keys."
+    match = THUMBNAIL_KEY.fullmatch(key)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2)), match.group(3)
+
+
+def derivative_widths(width):
+    "Width buckets below the original, plus the original itself when it is not larger than the biggest bucket (never upscale)."
+    widths = [w for w in THUMBNAIL_WIDTHS if w < width]
+    if width <= THUMBNAIL_WIDTHS[-1]:
+        widths.append(width)
+    return widths
+
+
+def srcset(renditions, url_for):
+    """
+    srcset strings for the front end.
+    Args:
+        renditions (list[dict]): {"width", "format", "key"} rows, e.g. from gallery_index.
+        url_for (callable): key -> URL.
+    Returns:
+        dict: format -> "url 256w, url 512w", formats with no rendition omitted.
+    """
+    result = {}
+    for rendition in sorted(renditions, key=lambda r: r["width"]):
+        entry = f"{url_for(rendition['key'])} {rendition['width']}w"
+        result[rendition["format"]] = f"{result[rendition['format']]}, {entry}" if rendition["format"] in result else entry
+    # 依 DERIVED_FORMATS 的偏好順序排列
+    order = {image_format: index for index, image_format in enumerate(DERIVED_FORMATS)}
+    return dict(sorted(result.items(), key=lambda item: order.get(item[0], len(order))))
+
+
+def is_derived(key):
+    "True for keys produced by this layout's thumbnails (never thumbnailed again)."
+    return key.startswith('derived/')
+
+
+def is_keyframe(key):
+    "True for keyframes written by the video ingest, which uploads their thumbnails itself."
+    return key.startswith(KEYFRAME_PREFIX)
+
+
+def upload_args(key):
+    "ExtraArgs for upload_fileobj / upload_file."
+    return {'ContentType': CONTENT_TYPES.get(posixpath.splitext(key)[1][1:], 'application/octet-stream'),
+            'CacheControl': CACHE_CONTROL}
@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Bedrock 呼叫的共用限流 + 重試
+# 每個 (model_id, region) 一個 token bucket, 速率依節流回應自動調整 (AIMD):
+#   成功 -> 速率加上 max_rate * BEDROCK_RATE_INCREASE, 被節流 -> 速率減半
+# 重試使用 decorrelated jitter, 避免大量請求同時重試造成 retry storm
+# 各 client 的 botocore 重試需關閉 (max_attempts=1), 由這裡統一處理
+
+DEFAULT_RATE = float(os.getenv('BEDROCK_DEFAULT_RPS', '2'))
+# 個別模型的初始/上限速率 (requests/sec), 例如 {"amazon.nova-canvas-v1:0": 0.5}
+RATE_LIMITS = json.loads(os.getenv('BEDROCK_RATE_LIMITS', '{}'))
+MIN_RATE = float(os.getenv('BEDROCK_MIN_RPS', '0.05'))
+RATE_INCREASE = float(os.getenv('BEDROCK_RATE_INCREASE', '0.05'))
+MAX_ATTEMPTS = int(os.getenv('BEDROCK_MAX_ATTEMPTS', '5'))
+BASE_DELAY = float(os.getenv('BEDROCK_RETRY_BASE_DELAY', '0.5'))
+MAX_DELAY = float(os.getenv('BEDROCK_RETRY_MAX_DELAY', '20'))
+
+THROTTLE_CODES = {'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException'}
+RETRYABLE_CODES = THROTTLE_CODES | {'ServiceUnavailableException', 'ModelNotReadyException',
+                                    'InternalServerException', 'ModelTimeoutException'}
+
+
+class AdaptiveTokenBucket:
+    "Token bucket whose refill rate follows AIMD on throttling feedback"
+
+    def __init__(self, name, rate, max_rate):
+        self.name = name
+        self.rate = rate
+        self.max_rate = max_rate
+        self.capacity = max(1.0, max_rate)
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.last_decrease = 0.0
+        self.successes = 0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        "Block until a token is available."
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.successes += 1
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_INCREASE)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            # 同一波節流只減速一次, 避免同時失敗的請求把速率一路砍到底
+            if now - self.last_decrease < 1.0 / self.rate:
+                return
+            self.last_decrease = now
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+        logger.warning("Bedrock throttled on %s, rate lowered to %.3f req/s", self.name, self.rate)
+
+    def stats(self):
+        with self._lock:
+            return {"rate": self.rate, "max_rate": self.max_rate,
+                    "successes": self.successes, "throttles": self.throttles}
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(model_id, region_name):
+    key = (model_id, region_name)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            rate = float(RATE_LIMITS.get(model_id, DEFAULT_RATE))
+            bucket = AdaptiveTokenBucket(f"{model_id}@{region_name}", rate, rate)
+            _buckets[key] = bucket
+        return bucket
+
+
+def call_bedrock(model_id, region_name, fn, *args, **kwargs):
+    """
+    Call fn(*args, **kwargs) through the shared limiter for model_id/region_name.
+    Args:
+        model_id (str): Model ID used to pick the token bucket.
+        region_name (str): Region of the client fn belongs to.
+        fn: A boto3 client method, e.g. bedrock.invoke_model.
+    Returns:
+        The return value of fn.
+    Raises:
+        ClientError: Non-retryable error, or retries exhausted.
+    """
+    bucket = get_bucket(model_id, region_name)
+    delay = BASE_DELAY
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        bucket.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except ClientError as err:
+            code = err.response.get("Error", {}).get("Code")
+            if code in THROTTLE_CODES:
+                bucket.on_throttle()
+            if code not in RETRYABLE_CODES or attempt == MAX_ATTEMPTS:
+                raise
+            # decorrelated jitter: sleep = min(cap, random(base, previous * 3))
+            delay = min(MAX_DELAY, random.uniform(BASE_DELAY, delay * 3))
+            logger.info("Retrying %s after %s (attempt %d/%d, sleep %.2fs)",
+                        model_id, code, attempt, MAX_ATTEMPTS, delay)
+            time.sleep(delay)
+        else:
+            bucket.on_success()
+            return result
+
+
+def stats():
+    with _buckets_lock:
+        buckets = dict(_buckets)
+    return {f"{model_id}@{region}": bucket.stats() for (model_id, region), bucket in buckets.items()}
@@ -0,0 +1,85 @@
+"""
+Per-request overhead of building a boto3 client vs. reusing the shared one from aws_clients.py.
+
+Runs against a local fake S3 endpoint (ListBuckets only), so no AWS account is needed:
+
+    python benchmarks/bench_client_registry.py --requests 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aws_clients import get_client
+
+LIST_BUCKETS_XML = (b'<?xml version="1.0" encoding="UTF-8"?>'
+                    b'<ListAllMyBucketsResult><Owner><ID>bench</ID></Owner><Buckets/></ListAllMyBucketsResult>')
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, 與真正的 S3 一樣
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(LIST_BUCKETS_XML)))
+        self.end_headers()
+        self.wfile.write(LIST_BUCKETS_XML)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def timed(fn, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    print(f"{name:<28} mean {statistics.mean(samples):7.2f} ms   "
+          f"p50 {samples[len(samples) // 2]:7.2f} ms   p99 {samples[int(len(samples) * 0.99) - 1]:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeS3Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def per_request_client():
+        client = boto3.client("s3", region_name="us-east-1", endpoint_url=endpoint_url)
+        client.list_buckets()
+
+    def shared_client():
+        get_client("s3", region_name="us-east-1", endpoint_url=endpoint_url).list_buckets()
+
+    # 先各跑一次, 排除 botocore 第一次載入 service model 的時間
+    per_request_client()
+    shared_client()
+
+    report("new client per request", timed(per_request_client, args.requests))
+    report("shared client (registry)", timed(shared_client, args.requests))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Original vs. derivative transfer size and latency for the gallery (aws_lambda/makeDerivatives.py).
+
+Encodes the width-bucketed WebP / AVIF renditions of local images in-process and reports
+bytes, encode time and the estimated download time at a given bandwidth / RTT:
+
+    python benchmarks/bench_derivatives.py pic/*.jpg pic/*.png --mbps 10 --rtt-ms 60
+
+With --bucket, measures real GETs of the originals and their derived/ objects
+(keys as listed by getPictures, derivatives already generated):
+
+    python benchmarks/bench_derivatives.py --bucket testviedo --keys frame_0.png frame_1.png
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "aws_lambda"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+from makeDerivatives import make_derivatives  # noqa: E402
+from renditions import DERIVED_FORMATS, thumbnail_key  # noqa: E402
+
+
+def transfer_ms(size, mbps, rtt_ms):
+    # 連線已建立時的一次 GET: 1 RTT + 傳輸時間
+    return rtt_ms + size * 8 / (mbps * 1e6) * 1000
+
+
+def bench_local(paths, mbps, rtt_ms, runs):
+    totals = {"original": 0}
+    print(f"{'image':<32} {'rendition':<12} {'bytes':>10} {'ratio':>7} {'encode ms':>10} {'est. ms':>8}")
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            outputs = make_derivatives(data)
+            times.append((time.perf_counter() - start) * 1000)
+        name = os.path.basename(path)
+        print(f"{name:<32} {'original':<12} {len(data):>10} {1:>7.2f} {'':>10} {transfer_ms(len(data), mbps, rtt_ms):>8.1f}")
+        for width, image_format, body in outputs:
+            label = f"w{width}.{image_format}"
+            totals[label] = totals.get(label, 0) + len(body)
+            print(f"{'':<32} {label:<12} {len(body):>10} {len(body) / len(data):>7.2f} {'':>10} "
+                  f"{transfer_ms(len(body), mbps, rtt_ms):>8.1f}")
+        print(f"{'':<32} {'(encode)':<12} {'':>10} {'':>7} {statistics.median(times):>10.1f}")
+        totals["original"] += len(data)
+    print("\ntotal bytes per rendition (images narrower than a bucket only count their own width):")
+    for label, size in totals.items():
+        print(f"  {label:<12} {size:>10}  {size / totals['original']:6.2%} of original")
+
+
+def fetch_ms(url, runs):
+    times = []
+    size = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        with urllib.request.urlopen(url) as response:
+            size = len(response.read())
+        times.append((time.perf_counter() - start) * 1000)
+    return size, statistics.median(times)
+
+
+def bench_s3(bucket, keys, width, runs):
+    import boto3
+    s3 = boto3.client("s3")
+
+    def url(key):
+        return s3.generate_presigned_url("get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=600)
+
+    print(f"{'key':<40} {'object':<12} {'bytes':>10} {'median ms':>10}")
+    for key in keys:
+        size, ms = fetch_ms(url(key), runs)
+        print(f"{key:<40} {'original':<12} {size:>10} {ms:>10.1f}")
+        for image_format in DERIVED_FORMATS:
+            try:
+                size, ms = fetch_ms(url(thumbnail_key(key, width, image_format)), runs)
+            except urllib.error.HTTPError as e:
+                print(f"{'':<40} {f'w{width}.{image_format}':<12} HTTP {e.code}")
+                continue
+            print(f"{'':<40} {f'w{width}.{image_format}':<12} {size:>10} {ms:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("images", nargs="*", help="Local images (default: pic/*)")
+    parser.add_argument("--mbps", type=float, default=10, help="Bandwidth for the estimated download time")
+    parser.add_argument("--rtt-ms", type=float, default=60)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--bucket", help="Measure real GETs from this bucket instead")
+    parser.add_argument("--keys", nargs="*", default=[])
+    parser.add_argument("--width", type=int, default=512, help="Rendition width fetched with --bucket")
+    args = parser.parse_args()
+
+    if args.bucket:
+        bench_s3(args.bucket, args.keys, args.width, args.runs)
+    else:
+        bench_local(args.images or sorted(glob.glob(os.path.join(ROOT, "pic", "*"))), args.mbps, args.rtt_ms, args.runs)
+
+
+if __name__ == "__main__":
+    main()
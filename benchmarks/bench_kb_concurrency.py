@@ -0,0 +1,131 @@
+"""
+Requests per second of /query_knowledge_base (Knowledge_base/data_automation.py) at increasing concurrency.
+
+Runs the FastAPI app under uvicorn against a local fake Bedrock Agent endpoint that answers
+RetrieveAndGenerate after a fixed latency, so no AWS account is needed; every request uses a
+different query so the semantic cache never answers:
+
+    python benchmarks/bench_kb_concurrency.py --latency-ms 300 --levels 1 2 4 8 16 32
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "Knowledge_base"))
+
+RESPONSE = json.dumps({
+    "sessionId": "bench",
+    "output": {"text": "1. 依第 33 條規定辦理。"},
+    "citations": [{"retrievedReferences": [{
+        "content": {"text": "第三十三條 室內裝修..."},
+        "location": {"type": "S3", "s3Location": {"uri": "s3://kb/建築物室內裝修管理辦法.txt"}},
+    }]}],
+}).encode("utf-8")
+
+
+class FakeBedrockAgentHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.3
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def client_loop(port, count, latencies, errors):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    for _ in range(count):
+        # 每次查詢都不同, 語意快取不會命中
+        body = json.dumps({"query": f"bench {uuid.uuid4().hex}"})
+        start = time.perf_counter()
+        connection.request("POST", "/query_knowledge_base", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status != 200:
+            errors.append(response.status)
+    connection.close()
+
+
+def run_level(port, concurrency, per_client):
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client_loop, args=(port, per_client, latencies, errors))
+               for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"concurrency {concurrency:3d}   {len(latencies) / elapsed:7.1f} req/s   "
+          f"p50 {latencies[len(latencies) // 2]:7.1f} ms   p99 {latencies[int(len(latencies) * 0.99) - 1]:7.1f} ms   "
+          f"errors {len(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=300, help="Fake RetrieveAndGenerate latency")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests-per-client", type=int, default=5)
+    args = parser.parse_args()
+
+    FakeBedrockAgentHandler.latency = args.latency_ms / 1000
+    fake = ThreadingHTTPServer(("127.0.0.1", 0), FakeBedrockAgentHandler)
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+    os.environ["BEDROCK_AGENT_ENDPOINT_URL"] = f"http://127.0.0.1:{fake.server_port}"
+    os.environ.setdefault("KNOWLEDGE_BASE_ID", "BENCHKB123")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    # 量測的是端點本身, 不讓 bedrock_limiter 的速率上限介入
+    os.environ.setdefault("BEDROCK_DEFAULT_RPS", "100000")
+
+    import uvicorn
+    import data_automation
+    logging.getLogger().setLevel(logging.WARNING)
+    # 模擬服務沒有 control plane API, 不檢查知識庫版本
+    data_automation.semantic_cache.stop()
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(data_automation.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    print(f"fake RetrieveAndGenerate latency {args.latency_ms:.0f} ms, "
+          f"KB_MAX_CONCURRENCY {data_automation.kb_executor.max_concurrency}")
+    for concurrency in args.levels:
+        run_level(port, concurrency, args.requests_per_client)
+    print(f"executor stats: {data_automation.kb_executor.stats()}")
+    server.should_exit = True
+    fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
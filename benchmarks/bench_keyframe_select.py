@@ -0,0 +1,95 @@
+"""
+Throughput of the Nova Reel keyframe selector (keyframe_select.py) on a CPU-only box.
+
+Scores synthetic 1280x720 frames (a few "shots" with noise and camera drift) in-process,
+and, when ffmpeg is installed, also decodes a generated test video end to end:
+
+    python benchmarks/bench_keyframe_select.py --seconds 60 --shots 4
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from keyframe_select import FFMPEG_BIN, REEL_FRAME_SIZE, KeyframeSelector, select_keyframes
+
+
+def synthetic_frames(count, shots, seed=0):
+    "count frames split evenly into shots, each a random base image with drift and noise."
+    rng = np.random.default_rng(seed)
+    width, height = REEL_FRAME_SIZE
+    per_shot = max(1, count // shots)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    for index in range(count):
+        if index % per_shot == 0:
+            base = rng.integers(0, 256, size=(height // 40, width // 40, 3), dtype=np.uint8)
+            base = np.repeat(np.repeat(base, 40, axis=0), 40, axis=1).astype(np.int16)
+        drift = np.roll(base, index % per_shot, axis=1)
+        noise = rng.integers(-8, 9, size=(height, width, 1), dtype=np.int16)
+        np.clip(drift + noise, 0, 255, out=drift)
+        frame[...] = drift
+        yield frame
+
+
+def bench_scoring(frames, shots, k):
+    selector = KeyframeSelector()
+    source = list(synthetic_frames(min(frames, 16), shots))  # 預熱
+    for frame in source:
+        selector.feed(frame, 0.0)
+
+    selector = KeyframeSelector()
+    tracemalloc.start()
+    elapsed = 0.0
+    for index, frame in enumerate(synthetic_frames(frames, shots)):
+        start = time.perf_counter()
+        selector.feed(frame, index / 2)
+        elapsed += time.perf_counter() - start
+    chosen = selector.select(k)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"scoring only        {frames / elapsed:8.1f} frames/s   "
+          f"{len(chosen)} keyframes at {[t for _, t in chosen]}   peak {peak / 1e6:.1f} MB")
+
+
+def bench_decode(seconds, k):
+    if shutil.which(FFMPEG_BIN) is None:
+        print("ffmpeg not found, skipping end-to-end decode")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, "test.mp4")
+        # 四段不同的測試畫面串接, 各 seconds / 4 秒
+        segment = seconds / 4
+        inputs = []
+        for pattern in ("testsrc", "smptebars", "mandelbrot", "rgbtestsrc"):
+            inputs += ["-f", "lavfi", "-t", str(segment), "-i", f"{pattern}=size=1920x1080:rate=24"]
+        subprocess.run([FFMPEG_BIN, "-y", "-loglevel", "error", *inputs,
+                        "-filter_complex", "concat=n=4:v=1:a=0", "-c:v", "libx264", "-preset", "ultrafast", video],
+                       check=True)
+        start = time.perf_counter()
+        chosen = select_keyframes(video, k)
+        elapsed = time.perf_counter() - start
+        print(f"decode + scoring    {seconds * 24 / elapsed:8.1f} source frames/s   "
+              f"{len(chosen)} keyframes at {[t for _, t in chosen]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=240, help="Synthetic frames to score")
+    parser.add_argument("--seconds", type=float, default=60, help="Length of the generated test video")
+    parser.add_argument("--shots", type=int, default=4)
+    parser.add_argument("-k", type=int, default=2)
+    args = parser.parse_args()
+
+    bench_scoring(args.frames, args.shots, args.k)
+    bench_decode(args.seconds, args.k)
+
+
+if __name__ == "__main__":
+    main()
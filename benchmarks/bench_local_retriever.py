@@ -0,0 +1,79 @@
+"""
+Index build time and query latency of the local knowledge index (Knowledge_base/local_retriever.py).
+
+Runs offline: BM25 plus the hashed n-gram dense index; --repeat copies the corpus N times to see
+how latency grows with the number of passages:
+
+    python benchmarks/bench_local_retriever.py --repeat 1 100 --queries 2000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "Knowledge_base"))
+
+from local_retriever import KNOWLEDGE_DIR, LocalRetriever
+
+QUERIES = [
+    "逃生出口可以封閉嗎",
+    "防火建材要用幾級",
+    "施工時要設圍籬嗎",
+    "第二十七條規定什麼",
+    "第18條",
+    "裝修材料需要合格證明嗎",
+    "消防設施可以拆除嗎",
+    "完工後要查驗嗎",
+]
+
+
+def corpus(repeat, directory):
+    "Copy the corpus files repeat times into directory."
+    for name in sorted(os.listdir(KNOWLEDGE_DIR)):
+        for copy in range(repeat):
+            stem, extension = os.path.splitext(name)
+            shutil.copy(os.path.join(KNOWLEDGE_DIR, name), os.path.join(directory, f"{stem}-{copy}{extension}"))
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def bench(retriever, mode, count):
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        retriever.search(QUERIES[i % len(QUERIES)], 3, mode)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    latencies.sort()
+    print(f"  {mode:6s}  p50 {percentile(latencies, 0.5):8.1f} us   p99 {percentile(latencies, 0.99):8.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, nargs="+", default=[1, 10, 100], help="Corpus copies")
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    for repeat in args.repeat:
+        with tempfile.TemporaryDirectory() as directory:
+            corpus(repeat, directory)
+            retriever = LocalRetriever(directory, dense="hash", index_dir=os.path.join(directory, "index"))
+            start = time.perf_counter()
+            count = retriever.load()
+            built = time.perf_counter() - start
+            # 第二次載入: 語料未變, 向量索引直接以 memory map 開啟
+            start = time.perf_counter()
+            retriever.load()
+            reopened = time.perf_counter() - start
+            print(f"{count} passages   build {built * 1000:.1f} ms   reload (mmap) {reopened * 1000:.1f} ms")
+            for mode in ("bm25", "dense", "hybrid"):
+                bench(retriever, mode, args.queries)
+
+
+if __name__ == "__main__":
+    main()
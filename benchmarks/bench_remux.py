@@ -0,0 +1,69 @@
+"""
+Stream copy vs. transcode for the KVS -> MP4 conversion in aws_lambda/myLambdaFunction.py.
+
+Generates an H.264 Matroska clip like the ICAM-540 feed (needs ffmpeg), converts it with the
+codec options codec_args() picks (remux) and with the forced transcode path, and reports
+wall time, ffmpeg CPU time and billed Lambda duration / GB-seconds:
+
+    python benchmarks/bench_remux.py --seconds 40 --memory-mb 1024
+"""
+import argparse
+import math
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "aws_lambda"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+from myLambdaFunction import codec_args, probe_file  # noqa: E402
+
+
+def make_clip(path, seconds):
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error",
+                    "-f", "lavfi", "-i", f"testsrc2=size=1920x1080:rate=30:duration={seconds}",
+                    "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                    "-c:v", "libx264", "-preset", "ultrafast", "-g", "60", "-c:a", "aac", path], check=True)
+
+
+def run(name, input_file, output_file, args, memory_mb, runs):
+    walls = []
+    cpu_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", input_file, *args, output_file], check=True)
+        walls.append((time.perf_counter() - start) * 1000)
+    cpu_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_ms = ((cpu_end.ru_utime - cpu_start.ru_utime) + (cpu_end.ru_stime - cpu_start.ru_stime)) * 1000 / runs
+    wall = sum(walls) / runs
+    # Lambda 以 1 ms 為單位計費
+    billed = math.ceil(wall)
+    print(f"{name:<10} wall {wall:9.1f} ms   ffmpeg cpu {cpu_ms:9.1f} ms   billed {billed:7d} ms   "
+          f"{billed / 1000 * memory_mb / 1024:8.3f} GB-s   output {os.path.getsize(output_file) / 1e6:6.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=int, default=40, help="Clip length, like CAPTURE_SECONDS")
+    parser.add_argument("--memory-mb", type=int, default=1024, help="Lambda memory size used for GB-s")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+        sys.exit("ffmpeg / ffprobe not found")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        clip = os.path.join(tmp, "input.mkv")
+        make_clip(clip, args.seconds)
+        streams = probe_file(clip)
+        print(f"input streams: {streams}")
+        run("remux", clip, os.path.join(tmp, "remux.mp4"), codec_args(streams), args.memory_mb, args.runs)
+        run("transcode", clip, os.path.join(tmp, "transcode.mp4"), codec_args(None), args.memory_mb, args.runs)
+
+
+if __name__ == "__main__":
+    main()
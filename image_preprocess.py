@@ -0,0 +1,136 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 送進 Bedrock 前的圖片前處理: 依目標尺寸縮圖、選擇格式、控制品質
+# JPEG 先用 draft 模式在解碼時就以 DCT 縮小, 再用 Image.reduce 整數倍縮小, 最後才做 LANCZOS 重取樣
+JPEG_QUALITY = int(os.getenv('PREPROCESS_JPEG_QUALITY', '90'))
+PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', str(os.cpu_count() or 2)))
+
+_pool = None
+_pool_lock = threading.Lock()
+_totals = {"images": 0, "original_bytes": 0, "output_bytes": 0}
+_totals_lock = threading.Lock()
+
+
+def _target_size(width, height, size, mode):
+    if mode == "exact":
+        return size
+    # fit: 等比例縮到 size 的框內, 不放大
+    scale = min(size[0] / width, size[1] / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _choose_format(image):
+    "PNG for transparency or flat graphics (few colours), JPEG for photos."
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        return "PNG"
+    sample = image.copy()
+    sample.thumbnail((64, 64))
+    if sample.getcolors(maxcolors=256) is not None:
+        return "PNG"
+    return "JPEG"
+
+
+def prepare_image(data, size, mode="fit", image_format=None, quality=JPEG_QUALITY):
+    """
+    Right-size an encoded image before it is base64-encoded for Bedrock.
+    Args:
+        data (bytes): The encoded source image.
+        size (tuple): (width, height) target, a bounding box for mode="fit".
+        mode (str): "fit" keeps the aspect ratio, "exact" resizes to size.
+        image_format (str): "JPEG" / "PNG", chosen from the content when None.
+        quality (int): JPEG quality.
+    Returns:
+        (bytes, str, dict): The encoded image, its format ("jpeg" / "png") and size stats.
+    """
+    image = Image.open(io.BytesIO(data))
+    source_format = image.format
+    original_size = image.size
+    target = _target_size(image.width, image.height, size, mode)
+
+    # 在 draft 之前比較: draft 會直接改變 image.size, 之後再比就會誤判為不用縮圖而沿用原檔
+    resized = original_size != target
+    if source_format == "JPEG":
+        image.draft("RGB", target)
+    if image.size != target:
+        factor = min(image.width // (2 * target[0]), image.height // (2 * target[1]))
+        if factor >= 2:
+            image = image.reduce(factor)
+        image = image.resize(target, Image.Resampling.LANCZOS)
+
+    image_format = image_format or _choose_format(image)
+    if not resized and image_format == source_format:
+        # 尺寸與格式都不用變, 直接沿用原始位元組, 避免重新壓縮
+        output = bytes(data)
+    else:
+        buffer = io.BytesIO()
+        if image_format == "JPEG":
+            image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+        else:
+            image.save(buffer, format="PNG", optimize=True)
+        output = buffer.getvalue()
+        if not resized and len(output) >= len(data) and source_format in ("JPEG", "PNG"):
+            # 只換格式反而變大時, 保留原檔
+            output, image_format = bytes(data), source_format
+
+    stats = {
+        "original_bytes": len(data),
+        "output_bytes": len(output),
+        "saved_bytes": len(data) - len(output),
+        "original_size": list(original_size),
+        "output_size": list(target),
+        "format": image_format.lower(),
+    }
+    return output, image_format.lower(), stats
+
+
+def _record(stats):
+    with _totals_lock:
+        _totals["images"] += 1
+        _totals["original_bytes"] += stats["original_bytes"]
+        _totals["output_bytes"] += stats["output_bytes"]
+    logger.info("Preprocessed image %s -> %s (%s, saved %d bytes)",
+                stats["original_size"], stats["output_size"], stats["format"], stats["saved_bytes"])
+
+
+def preprocess(data, size, mode="fit", image_format=None, quality=JPEG_QUALITY):
+    "prepare_image() in the calling thread, counted in preprocess_stats()."
+    output, output_format, stats = prepare_image(data, size, mode, image_format, quality)
+    _record(stats)
+    return output, output_format, stats
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS)
+        return _pool
+
+
+def preprocess_batch(images, size, mode="fit", image_format=None, quality=JPEG_QUALITY):
+    """
+    Run prepare_image() for several images in the process pool (CPU-bound work).
+    Args:
+        images (list[bytes]): Encoded source images.
+    Returns:
+        list[(bytes, str, dict)]: Results in input order.
+    """
+    pool = _get_pool()
+    futures = [pool.submit(prepare_image, data, size, mode, image_format, quality) for data in images]
+    results = [future.result() for future in futures]
+    for _, _, stats in results:
+        _record(stats)
+    return results
+
+
+def preprocess_stats():
+    with _totals_lock:
+        return dict(_totals, saved_bytes=_totals["original_bytes"] - _totals["output_bytes"])
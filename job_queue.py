@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    "Raised when the job queue has reached max_pending"
+
+    def __init__(self, message):
+        self.message = message
+
+
+class JobQueue:
+    """
+    Submit/poll job queue backed by a dedicated, bounded worker pool.
+
+    max_workers caps concurrent Bedrock calls (size it to the model quota),
+    max_pending caps queued + running jobs so a burst is rejected instead of
+    piling up. Finished jobs are kept for result_ttl seconds for polling.
+    """
+
+    def __init__(self, name, max_workers=4, max_pending=100, result_ttl=3600):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) and return the job id immediately.
+        Raises:
+            QueueFullError: max_pending jobs are already queued or running.
+        """
+        self._purge_expired()
+        with self._lock:
+            if self._queued + self._running >= self.max_pending:
+                self._rejected += 1
+                raise QueueFullError(f"{self.name} queue is full ({self.max_pending} pending jobs)")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            self._queued += 1
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            wait = job["started_at"] - job["submitted_at"]
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            self._queued -= 1
+            self._running += 1
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            logger.error("Job %s failed: %s", job_id, e)
+            with self._lock:
+                job.update(status="failed", error=str(e), finished_at=time.time())
+                self._running -= 1
+                self._failed += 1
+        else:
+            with self._lock:
+                job.update(status="succeeded", result=result, finished_at=time.time())
+                self._running -= 1
+                self._completed += 1
+
+    def _purge_expired(self):
+        deadline = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job["finished_at"] is not None and job["finished_at"] < deadline]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            queued_since = [job["submitted_at"] for job in self._jobs.values() if job["status"] == "queued"]
+            started = self._completed + self._failed + self._running
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "avg_wait_seconds": self._total_wait / started if started else 0.0,
+                "max_wait_seconds": self._max_wait,
+                "oldest_queued_seconds": now - min(queued_since) if queued_since else 0.0,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,197 @@
+import heapq
+import io
+import logging
+import os
+import subprocess
+import threading
+
+import numpy as np
+from PIL import Image
+
+from image_preprocess import JPEG_QUALITY
+
+logger = logging.getLogger(__name__)
+
+# Nova Reel MULTI_SHOT_MANUAL 的關鍵畫格挑選
+# ffmpeg 只解碼一次, 以 fps filter 取樣並直接縮放成 1280x720 rawvideo (rgb24) 經 pipe 讀出,
+# 每張畫格與前一張比較: 顏色直方圖差異 + 縮圖上的區塊 SSIM (SSIM-lite), 分數高即視為換鏡頭
+# 只保留分數最高的 KEYFRAME_MAX_CANDIDATES 個候選 (已編碼 JPEG), 記憶體與影片長度無關
+# 換鏡頭少的影片 (連續的環景走動) 以未達門檻、分數最高的畫格補足候選, 換鏡頭畫格永遠優先保留
+# 最後以 farthest-point 在候選中挑出彼此最不相似的 K 張, 依時間排序
+FFMPEG_BIN = os.getenv('FFMPEG_BIN', 'ffmpeg')
+SAMPLE_FPS = float(os.getenv('KEYFRAME_SAMPLE_FPS', '2'))
+MAX_CANDIDATES = int(os.getenv('KEYFRAME_MAX_CANDIDATES', '32'))
+# 分數 (0..1) 超過門檻才算換鏡頭; 第一張畫格一定是候選
+SCENE_THRESHOLD = float(os.getenv('KEYFRAME_SCENE_THRESHOLD', '0.3'))
+REEL_FRAME_SIZE = (1280, 720)
+
+HIST_BINS = 16
+# 縮圖以 16x16 區塊平均得到 (1280x720 -> 80x45), SSIM 在 5x5 區塊上計算
+THUMB_CELL = 16
+SSIM_BLOCK = 5
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+_GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+class FrameFeatures:
+    "Colour histogram and grayscale thumbnail used to compare frames"
+
+    __slots__ = ("hist", "thumb")
+
+    def __init__(self, frame):
+        # 每 4 個像素取 1 個 (1280x720 -> 320x180), 對換鏡頭判斷已足夠
+        sample = np.ascontiguousarray(frame[::4, ::4])
+        codes = sample.reshape(-1, 3) // (256 // HIST_BINS) + np.arange(3, dtype=np.uint8) * HIST_BINS
+        hist = np.bincount(codes.ravel(), minlength=3 * HIST_BINS).astype(np.float32)
+        self.hist = hist / hist.sum()
+
+        cell = THUMB_CELL // 4
+        height, width = sample.shape[0] // cell, sample.shape[1] // cell
+        cells = sample[:height * cell, :width * cell].reshape(height, cell, width, cell, 3)
+        self.thumb = cells.sum(axis=(1, 3), dtype=np.uint32) @ _GRAY_WEIGHTS / (cell * cell)
+
+
+def ssim_lite(a, b):
+    "Mean SSIM over SSIM_BLOCK x SSIM_BLOCK blocks of two thumbnails."
+    height, width = (a.shape[0] // SSIM_BLOCK) * SSIM_BLOCK, (a.shape[1] // SSIM_BLOCK) * SSIM_BLOCK
+    shape = (height // SSIM_BLOCK, SSIM_BLOCK, width // SSIM_BLOCK, SSIM_BLOCK)
+    x = a[:height, :width].reshape(shape)
+    y = b[:height, :width].reshape(shape)
+    mx, my = x.mean(axis=(1, 3)), y.mean(axis=(1, 3))
+    vx, vy = x.var(axis=(1, 3)), y.var(axis=(1, 3))
+    cov = ((x - mx[:, None, :, None]) * (y - my[:, None, :, None])).mean(axis=(1, 3))
+    ssim = ((2 * mx * my + _C1) * (2 * cov + _C2)) / ((mx ** 2 + my ** 2 + _C1) * (vx + vy + _C2))
+    return float(ssim.mean())
+
+
+def difference(a, b):
+    "Scene-change score in [0, 1] between two FrameFeatures."
+    hist = 0.5 * float(np.abs(a.hist - b.hist).sum())
+    # SSIM 接近 0 (兩張畫面無關) 即視為結構完全不同
+    structure = min(1.0, max(0.0, 1.0 - ssim_lite(a.thumb, b.thumb)))
+    return 0.5 * hist + 0.5 * structure
+
+
+def encode_frame(frame, quality=JPEG_QUALITY):
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class KeyframeSelector:
+    """
+    Streaming shot-boundary detector: feed() frames in order, select(k) at the end.
+    Holds one previous frame's features plus at most max_candidates encoded frames.
+    """
+
+    def __init__(self, max_candidates=MAX_CANDIDATES, threshold=SCENE_THRESHOLD):
+        self.max_candidates = max_candidates
+        self.threshold = threshold
+        self._previous = None
+        # (is_boundary, score, index, timestamp, features, jpeg): 非換鏡頭且分數最低的在最上面, 最先被淘汰
+        self._heap = []
+        self.frames = 0
+
+    def feed(self, frame, timestamp):
+        "frame: uint8 array of shape (height, width, 3)."
+        features = FrameFeatures(frame)
+        index = self.frames
+        self.frames += 1
+        if self._previous is None:
+            score = float("inf")
+        else:
+            score = difference(features, self._previous)
+        self._previous = features
+
+        priority = (score >= self.threshold, score)
+        if len(self._heap) >= self.max_candidates and priority <= self._heap[0][:2]:
+            return
+        # 只有進入候選的畫格才編碼
+        entry = (*priority, index, timestamp, features, encode_frame(frame))
+        if len(self._heap) < self.max_candidates:
+            heapq.heappush(self._heap, entry)
+        else:
+            heapq.heapreplace(self._heap, entry)
+
+    def select(self, k):
+        """
+        Pick the k most mutually distinct candidates.
+        Returns:
+            list[(bytes, float)]: JPEG bytes and timestamp (seconds), in time order, each frame at most once;
+                fewer than k only when fewer frames were sampled.
+        """
+        candidates = sorted(self._heap, key=lambda entry: entry[2])
+        if len(candidates) <= k:
+            return [(entry[5], entry[3]) for entry in candidates]
+
+        # farthest-point: 從優先度最高 (通常是第一張) 開始, 每次加入與已選者最小距離最大的候選
+        chosen = [max(range(len(candidates)), key=lambda i: candidates[i][:2])]
+        nearest = np.array([difference(entry[4], candidates[chosen[0]][4]) for entry in candidates])
+        nearest[chosen[0]] = -np.inf
+        while len(chosen) < k:
+            # 已選過的排除在外: 所有距離都是 0 (畫面完全相同) 時也不會重複選同一張
+            best = int(np.argmax(nearest))
+            chosen.append(best)
+            nearest = np.minimum(nearest, [difference(entry[4], candidates[best][4]) for entry in candidates])
+            nearest[chosen] = -np.inf
+        return [(candidates[i][5], candidates[i][3]) for i in sorted(chosen)]
+
+
+def iter_frames(source, size=REEL_FRAME_SIZE, sample_fps=SAMPLE_FPS):
+    """
+    Decode a video once with ffmpeg and yield sampled frames already resized to size.
+    Args:
+        source (str): Anything ffmpeg can open, e.g. a presigned S3 URL (read with range requests).
+    Yields:
+        (numpy.ndarray, float): A reused (height, width, 3) uint8 buffer and its timestamp.
+    """
+    width, height = size
+    command = [FFMPEG_BIN, "-nostdin", "-loglevel", "error", "-i", source, "-an", "-sn",
+               "-vf", f"fps={sample_fps},scale={width}:{height}:flags=bilinear",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    errors = []
+    reader = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+    reader.start()
+
+    # 單一畫格緩衝區重複使用, 呼叫端需在下一次迭代前用完
+    buffer = bytearray(width * height * 3)
+    view = memoryview(buffer)
+    frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+    index = 0
+    try:
+        while True:
+            filled = 0
+            while filled < len(buffer):
+                count = process.stdout.readinto(view[filled:])
+                if not count:
+                    break
+                filled += count
+            if filled < len(buffer):
+                break
+            yield frame, index / sample_fps
+            index += 1
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        reader.join()
+    if process.returncode not in (0, -9) and index == 0:
+        raise RuntimeError(f"ffmpeg failed: {errors[0].decode('utf-8', 'replace').strip() if errors else ''}")
+
+
+def select_keyframes(source, k, size=REEL_FRAME_SIZE, sample_fps=SAMPLE_FPS):
+    """
+    Pick k distinct shots from a video for MULTI_SHOT_MANUAL.
+    Returns:
+        list[(bytes, float)]: 1280x720 JPEG frames and their timestamps, in time order.
+    """
+    selector = KeyframeSelector()
+    for frame, timestamp in iter_frames(source, size, sample_fps):
+        selector.feed(frame, timestamp)
+    keyframes = selector.select(k)
+    logger.info("Selected %d keyframes from %d sampled frames (at %s s)",
+                len(keyframes), selector.frames, [round(t, 1) for _, t in keyframes])
+    return keyframes
@@ -1,16 +1,27 @@
-import boto3
 import os
 import base64
+import hashlib
 import io
 import json
 import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
 from PIL import Image
-from botocore.config import Config
 from botocore.exceptions import ClientError
 from fastapi import FastAPI, status, HTTPException
 from pydantic import BaseModel
 from dotenv import load_dotenv  # 添加 dotenv 支持
 from fastapi.middleware.cors import CORSMiddleware
+from aws_clients import get_client, warm_up
+from bedrock_limiter import call_bedrock
+from fastapi.responses import StreamingResponse
+from result_cache import StyleResultCache, canonical_params, make_cache_key, source_digest
+from single_flight import SingleFlight
+from phash_index import PerceptualIndex, dhash
+from job_queue import JobQueue, QueueFullError
+from image_preprocess import JPEG_QUALITY, preprocess, preprocess_stats
 
 
 #===========================S3 Setting===========================
@@ -22,13 +33,43 @@ AWS_SECRET_ACCESS_KEY=os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_SESSION_TOKEN    =os.getenv('AWS_SESSION_TOKEN')  
 #===========================S3 Setting===========================
 
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    aws_session_token=AWS_SESSION_TOKEN
+# 共用 client (見 aws_clients.py), 各請求不再重新建立
+s3 = get_client('s3')
+# 風格圖 (bucket_name) 的公開網址前綴
+OUTPUT_URL_PREFIX = "https://testviedo-gen.s3.us-west-2.amazonaws.com/"
+# 重試由 bedrock_limiter 統一處理, botocore 不再自行重試
+BEDROCK_CLIENT = {'service_name': 'bedrock-runtime', 'region_name': 'us-east-1', 'read_timeout': 300,
+                  'retries': {'max_attempts': 1, 'mode': 'standard'}}
+
+# 風格轉換結果快取 (LRU 上限可用 STYLE_CACHE_MAX_ENTRIES 調整)
+style_cache = StyleResultCache(
+    s3,
+    os.getenv('bucket_name'),
+    max_entries=int(os.getenv('STYLE_CACHE_MAX_ENTRIES', '256'))
 )
 
+# 非同步風格轉換工作佇列, 併發上限請依 Bedrock 配額設定
+style_jobs = JobQueue(
+    "style_convert",
+    max_workers=int(os.getenv('STYLE_CONVERT_WORKERS', '4')),
+    max_pending=int(os.getenv('STYLE_CONVERT_MAX_PENDING', '100'))
+)
+
+# 多風格請求的並行 Canvas 呼叫上限
+MAX_STYLES_PER_REQUEST = int(os.getenv('STYLE_FANOUT_MAX_STYLES', '8'))
+style_fanout_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('STYLE_FANOUT_WORKERS', '4')),
+    thread_name_prefix="style_fanout"
+)
+
+# 各組風格參數各自一個感知雜湊索引 (payload 為 file_url), 設定 PHASH_INDEX_DIR 時會持久化
+style_indexes = {}
+style_indexes_lock = threading.Lock()
+PHASH_INDEX_DIR = os.getenv('PHASH_INDEX_DIR')
+
+# 相同請求在執行中時, 後到的請求直接共用結果, 不重複下載 / 呼叫模型
+style_flight = SingleFlight("style_convert")
+
 app = FastAPI()
 
 app.add_middleware(
@@ -40,6 +81,11 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def warm_up_clients():
+    warm_up([{'service_name': 's3'}, BEDROCK_CLIENT])
+
+
 # input: encoded image
 # output: S3 path (designed image)
 
@@ -56,21 +102,48 @@ class ImageError(Exception):
 class Item_design(BaseModel):  
     file_path_s3: str
 
-# 上傳檔案到 S3
-def upload_file_to_s3(bucket_name, local_file_path, s3_file_key):
-    try:
-        s3.upload_file(local_file_path, bucket_name, s3_file_key)
-        print(f"成功上傳 {local_file_path} 到 s3://{bucket_name}/{s3_file_key}")
-    except Exception as e:
-        print("上傳失敗：", e)
+# 單一風格設定 (多風格請求使用)
+class StylePreset(BaseModel):
+    name: Optional[str] = None
+    prompt: str
+    negativeText: str = "bad quality, low resolution, cartoon"
+    similarityStrength: float = 0.95  # Range: 0.2 to 1.0
+
+class Item_multi_style(BaseModel):
+    file_path_s3: str
+    styles: List[StylePreset]
 
-# 從 S3 下載檔案到本地
-def download_file_from_s3(bucket_name, s3_file_key, local_file_path):
+# 單一物件讀入記憶體的上限 (bytes), 超過即拒絕
+# 每個請求的記憶體峰值約為: 原圖 N + base64 4N/3 + 請求 JSON 4N/3 + 回傳圖片 (512x512, 約 1 MB), 即約 3.7N + 1 MB
+MAX_OBJECT_BYTES = int(os.getenv('MAX_OBJECT_BYTES', str(20 * 1024 * 1024)))
+
+# 上傳記憶體中的資料到 S3 (不落地)
+def upload_bytes_to_s3(bucket_name, data, s3_file_key, extra_args=None):
     try:
-        s3.download_file(bucket_name, s3_file_key, local_file_path)
-        print(f"成功從 s3://{bucket_name}/{s3_file_key} 下載到 {local_file_path}")
+        s3.upload_fileobj(io.BytesIO(data), bucket_name, s3_file_key, ExtraArgs=extra_args)
+        print(f"成功上傳 {len(data)} bytes 到 s3://{bucket_name}/{s3_file_key}")
+        return True
     except Exception as e:
-        print("下載失敗：", e)
+        print("上傳失敗：", e)
+        return False
+
+# 從 S3 串流讀取檔案到記憶體 (不落地)
+def read_file_from_s3(bucket_name, s3_file_key, max_bytes=MAX_OBJECT_BYTES):
+    response = s3.get_object(Bucket=bucket_name, Key=s3_file_key)
+    size = response['ContentLength']
+    if size > max_bytes:
+        response['Body'].close()
+        raise ImageError(f"s3://{bucket_name}/{s3_file_key} is {size} bytes, over the {max_bytes} bytes limit")
+
+    # 依 ContentLength 預先配置緩衝區, 逐塊寫入, 不再額外複製
+    data = bytearray(size)
+    view = memoryview(data)
+    offset = 0
+    for chunk in response['Body'].iter_chunks(chunk_size=256 * 1024):
+        view[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    print(f"成功從 s3://{bucket_name}/{s3_file_key} 讀取 {size} bytes")
+    return data
 
 
 def generate_image(model_id, body):
@@ -86,18 +159,17 @@ def generate_image(model_id, body):
     logger.info(
         "Generating image with Amazon Nova Canvas model %s", model_id)
 
-    bedrock = boto3.client(
-        service_name='bedrock-runtime',
-        config=Config(read_timeout=300), 
-        region_name="us-east-1"
-    )
+    bedrock = get_client(**BEDROCK_CLIENT)
 
     accept = "application/json"
     content_type = "application/json"
 
-    response = bedrock.invoke_model(
+    response = call_bedrock(
+        model_id, BEDROCK_CLIENT['region_name'], bedrock.invoke_model,
         body=body, modelId=model_id, accept=accept, contentType=content_type
     )
+    # 只有真正呼叫模型的結果, 分享給等待者時才算省下一次呼叫
+    style_flight.mark_model_call()
     response_body = json.loads(response.get("body").read())
 
     finish_reason = response_body.get("error")
@@ -116,6 +188,274 @@ def generate_image(model_id, body):
 #     with open(image_path, 'rb') as image_file:
 #         return base64.b64encode(image_file.read()).decode('utf-8')
 
+MODEL_ID = 'amazon.nova-canvas-v1:0'
+
+DEFAULT_VARIATION_PARAMS = {
+    "text": "Modernize the house, photo-realistic, 8k, hdr",
+    "negativeText": "bad quality, low resolution, cartoon",
+    "similarityStrength": 0.95,  # Range: 0.2 to 1.0
+}
+
+GENERATION_CONFIG = {
+    "numberOfImages": 1,
+    "height": 512,
+    "width": 512,
+    "cfgScale": 8.0,
+    "seed": 300
+}
+
+
+# 送進 Canvas 的輸入圖最長邊 (px)
+CANVAS_INPUT_MAX_SIDE = int(os.getenv('CANVAS_INPUT_MAX_SIDE', '1024'))
+PREPROCESS_TAG = f"fit{CANVAS_INPUT_MAX_SIDE}q{JPEG_QUALITY}"
+
+
+class SourceImage:
+    "Source frame shared by every style rendered from it; downloaded and base64-encoded at most once"
+
+    def __init__(self, bucket_name, picture_filename):
+        self.bucket_name = bucket_name
+        self.picture_filename = picture_filename
+        self.source_bytes = None
+        self._input_image = None
+        self._perceptual_hash = None
+        # 多個風格在不同執行緒共用同一張原圖: 第一個需要原圖的風格負責下載 / 編碼, 其餘等待沿用
+        self._lock = threading.RLock()
+        # 原圖無法讀取或解碼時記下錯誤, 其他風格不再重試
+        self.error = None
+        # 原圖未變動 (ETag 相同) 時直接沿用先前算好的雜湊, 不必重新下載
+        try:
+            self.etag = s3.head_object(Bucket=bucket_name, Key=picture_filename)['ETag']
+        except ClientError:
+            self.etag = None
+        self.source_hash = style_cache.lookup_digest(picture_filename, self.etag) if self.etag else None
+
+    def load(self):
+        with self._lock:
+            if self.source_bytes is not None:
+                return
+            if self.error is not None:
+                raise self.error
+            # 直接讀入記憶體, 不落地 (避免同名檔案在併發請求間互相覆蓋)
+            try:
+                self.source_bytes = read_file_from_s3(self.bucket_name, self.picture_filename)
+            except (ClientError, ImageError) as err:
+                self.error = err
+                raise
+
+            if self.source_hash is None:
+                self.source_hash = source_digest(self.source_bytes)
+                if self.etag:
+                    style_cache.remember_digest(self.picture_filename, self.etag, self.source_hash)
+
+    def _decode_error(self, err):
+        self.error = ImageError(f"s3://{self.bucket_name}/{self.picture_filename} is not a readable image: {err}")
+        return self.error
+
+    def perceptual_hash(self):
+        with self._lock:
+            self.load()
+            if self._perceptual_hash is None:
+                try:
+                    self._perceptual_hash = dhash(self.source_bytes)
+                except (OSError, ValueError, Image.DecompressionBombError) as err:
+                    raise self._decode_error(err) from err
+            return self._perceptual_hash
+
+    def input_image(self):
+        with self._lock:
+            self.load()
+            if self._input_image is None:
+                # 輸出只有 512x512, 先把原圖縮到 CANVAS_INPUT_MAX_SIDE 以內再編碼, 縮小請求大小
+                try:
+                    prepared, _, _ = preprocess(self.source_bytes, (CANVAS_INPUT_MAX_SIDE, CANVAS_INPUT_MAX_SIDE))
+                except (OSError, ValueError, Image.DecompressionBombError) as err:
+                    raise self._decode_error(err) from err
+                self._input_image = base64.b64encode(prepared).decode('utf8')
+            return self._input_image
+
+
+def style_index(variation_params):
+    "Perceptual-hash index of the outputs rendered with one set of parameters."
+    params = canonical_params(variation_params, GENERATION_CONFIG) + PREPROCESS_TAG
+    name = hashlib.sha256(params.encode("utf-8")).hexdigest()[:16]
+    with style_indexes_lock:
+        index = style_indexes.get(name)
+        if index is None:
+            index = style_indexes[name] = PerceptualIndex()
+            if PHASH_INDEX_DIR:
+                index.load(os.path.join(PHASH_INDEX_DIR, f"style_convert_{name}"))
+        return index
+
+
+def lookup_style(source, variation_params, picture_filename_new, file_url):
+    "Cache lookup for one style; returns (cache_key, cached file_url or None)."
+    if source.source_hash is None:
+        source.load()
+    # 前處理設定也會影響輸出, 一併納入 cache key
+    cache_key = make_cache_key(f"{source.source_hash}:{PREPROCESS_TAG}", variation_params, GENERATION_CONFIG)
+    cached_url = style_cache.get(cache_key, picture_filename_new, file_url)
+    if cached_url is not None:
+        logger.info("Style cache hit for %s -> %s", source.picture_filename, picture_filename_new)
+    return cache_key, cached_url
+
+
+def render_style(source, variation_params, picture_filename_new):
+    """
+    Render one style of a source frame, served from the result cache when possible.
+    Args:
+        source (SourceImage): The source frame.
+        variation_params (dict): imageVariationParams without "images".
+        picture_filename_new (str): S3 key of the designed picture.
+    Returns:
+        file_url (str): Public URL of the designed picture.
+    """
+    bucket_name_new = os.getenv('bucket_name')
+    file_url = OUTPUT_URL_PREFIX + picture_filename_new
+
+    cache_key, cached_url = lookup_style(source, variation_params, picture_filename_new, file_url)
+    if cached_url is not None:
+        return cached_url
+
+    # 與已轉換過的畫格幾乎相同時, 直接沿用同一組參數產生的風格圖
+    index = style_index(variation_params)
+    neighbour_url, distance = index.lookup(source.perceptual_hash())
+    if neighbour_url is not None:
+        logger.info("Reusing %s for %s (hamming distance %d)", neighbour_url, source.picture_filename, distance)
+        neighbour_key = neighbour_url[len(OUTPUT_URL_PREFIX):]
+        try:
+            # 複製到這次請求的 key, 並換上這張來源圖的 cache key, 下次直接命中 StyleResultCache
+            if neighbour_key != picture_filename_new:
+                s3.copy_object(Bucket=bucket_name_new, Key=picture_filename_new,
+                               CopySource={'Bucket': bucket_name_new, 'Key': neighbour_key},
+                               MetadataDirective='REPLACE', **StyleResultCache.upload_extra_args(cache_key))
+            style_cache.put(cache_key, picture_filename_new, file_url)
+            return file_url
+        except ClientError as err:
+            # 相近的風格圖已不存在時改為重新產生
+            logger.warning("Cannot reuse %s: %s", neighbour_url, err)
+
+    body = json.dumps({
+        "taskType": "IMAGE_VARIATION",
+        "imageVariationParams": dict(variation_params, images=[source.input_image()]),
+        "imageGenerationConfig": GENERATION_CONFIG
+    })
+
+    response_body = generate_image(model_id=MODEL_ID, body=body)
+
+    for i in range(len(response_body.get("images"))):
+        base64_image = response_body.get("images")[i]
+        base64_bytes = base64_image.encode('ascii')
+        image_bytes = base64.b64decode(base64_bytes)
+
+        design_image = Image.open(io.BytesIO(image_bytes))
+        design_buffer = io.BytesIO()
+        design_image.convert("RGB").save(design_buffer, format="JPEG")
+
+        # upload file to S3, 並在 Metadata 記下 cache key 作為持久層快取
+        if upload_bytes_to_s3(bucket_name_new, design_buffer.getbuffer(), picture_filename_new,
+                              extra_args=StyleResultCache.upload_extra_args(cache_key)):
+            style_cache.put(cache_key, picture_filename_new, file_url)
+            index.add(source.perceptual_hash(), file_url)
+
+    print(
+        f"Finished generating image with Amazon Nova Canvas  model {MODEL_ID}.")
+    return file_url
+
+
+def style_convert(picture_filename):
+    """
+    Style-convert one image; concurrent requests for the same key share one pipeline run.
+    """
+    return style_flight.do(picture_filename, _style_convert, picture_filename)
+
+
+def _style_convert(picture_filename):
+    """
+    Run the download -> invoke_model -> decode -> upload pipeline for one image.
+    Args:
+        picture_filename (str): S3 key of the source image in bucket_name.
+    Returns:
+        file_url (str): Public URL of the designed picture.
+    Raises:
+        ClientError / ImageError: The pipeline failed.
+    """
+    # 指定你的 S3 bucket 名稱
+    bucket_name = os.getenv('bucket_name')
+
+    pure_filename = os.path.basename(picture_filename).split('.')[0]
+    picture_filename_new = pure_filename+'_designed.jpg'
+
+    source = SourceImage(bucket_name, picture_filename)
+    return render_style(source, DEFAULT_VARIATION_PARAMS, picture_filename_new)
+
+
+def style_name(style, index):
+    "Name of a preset as used in its output key; only safe characters are kept."
+    return re.sub(r'[^A-Za-z0-9_-]', '_', style.name) if style.name else f"style{index}"
+
+
+def style_output_key(picture_filename, name, variation_params):
+    """
+    S3 key of one preset's designed picture.
+    同一個原圖的不同參數 (即使名稱相同) 不會寫到同一個物件, 併發請求不會拿到彼此的結果
+    """
+    digest = hashlib.sha256(
+        f"{picture_filename}:{canonical_params(variation_params, GENERATION_CONFIG)}".encode("utf-8")).hexdigest()[:12]
+    pure_filename = os.path.basename(picture_filename).split('.')[0]
+    return f"{pure_filename}_{name}_{digest}_designed.jpg"
+
+
+def style_convert_many(picture_filename, styles):
+    """
+    Render several styles of one frame concurrently.
+    Args:
+        picture_filename (str): S3 key of the source image in bucket_name.
+        styles (list[StylePreset]): The style presets to render.
+    Yields:
+        dict: One result per style, in completion order.
+    """
+    bucket_name = os.getenv('bucket_name')
+
+    # 原圖只下載 / 編碼一次, 由所有風格共用; 等到第一個快取未命中的風格才載入, 全部命中時不下載也不編碼
+    source = SourceImage(bucket_name, picture_filename)
+
+    futures = {}
+    for index, style in enumerate(styles):
+        name = style_name(style, index)
+        variation_params = {
+            "text": style.prompt,
+            "negativeText": style.negativeText,
+            "similarityStrength": style.similarityStrength,
+        }
+        picture_filename_new = style_output_key(picture_filename, name, variation_params)
+        future = style_fanout_pool.submit(
+            style_flight.do, picture_filename_new,
+            render_style, source, variation_params, picture_filename_new)
+        futures[future] = (index, name)
+
+    yielded = False
+    for future in as_completed(futures):
+        index, name = futures[future]
+        try:
+            result = {"index": index, "name": name, "file_url": future.result()}
+        except (ClientError, ImageError) as err:
+            if not yielded and source.error is not None:
+                # 原圖本身無法讀取 / 解碼, 每個風格都會失敗: 交由呼叫端回傳對應的狀態碼
+                for pending in futures:
+                    pending.cancel()
+                raise
+            if isinstance(err, ClientError):
+                message = err.response["Error"]["Message"]
+                logger.error("A client error occurred: %s", message)
+            else:
+                message = err.message
+                logger.error(message)
+            result = {"index": index, "name": name, "error": message}
+        yielded = True
+        yield result
+
+
 @app.post("/style_convert", 
          status_code = status.HTTP_200_OK, 
          tags=["nova_canvas"],
@@ -130,62 +470,9 @@ def nova_canvas(item: Item_design):
     try:
         logging.basicConfig(level=logging.INFO,
                             format="%(levelname)s: %(message)s")
-        
-        # 指定你的 S3 bucket 名稱
-        bucket_name = os.getenv('bucket_name')
-        bucket_name_new = os.getenv('bucket_name')
-
-        picture_filename = item.file_path_s3
-        pure_filename = os.path.basename(picture_filename).split('.')[0]
-        
-        download_file_from_s3(bucket_name, picture_filename, picture_filename)
-
-        model_id = 'amazon.nova-canvas-v1:0'
-
-        # 準備輸入圖片
-        # filename_list = ['frame_0.png', 'frame_520.png', 'frame_1040.png']  # 替換為您的圖片路徑
-        # input_image = [load_and_encode_image(path) for path in filename_list]
-        
-        # # Read image from file and encode it as base64 string.
-        with open(picture_filename, "rb") as image_file:
-            input_image = base64.b64encode(image_file.read()).decode('utf8')
-
-        body = json.dumps({
-            "taskType": "IMAGE_VARIATION",
-            "imageVariationParams": {
-                "text": "Modernize the house, photo-realistic, 8k, hdr",
-                "negativeText": "bad quality, low resolution, cartoon",
-                "images": [input_image],
-                "similarityStrength": 0.95,  # Range: 0.2 to 1.0
-            },
-            "imageGenerationConfig": {
-                "numberOfImages": 1,
-                "height": 512,
-                "width": 512,
-                "cfgScale": 8.0,
-                "seed": 300
-            }
-        })
-
-        response_body = generate_image(model_id=model_id, body=body)
-
-        for i in range(len(response_body.get("images"))):
-            base64_image = response_body.get("images")[i]
-            base64_bytes = base64_image.encode('ascii')
-            image_bytes = base64.b64decode(base64_bytes)
-
-            design_image = Image.open(io.BytesIO(image_bytes))
-            design_image.show()
-            picture_filename_new = pure_filename+'_designed.jpg'
-            design_image.save(picture_filename_new)
-
-            # upload file to S3
-            upload_file_to_s3(bucket_name_new, picture_filename_new, picture_filename_new)
-
-            file_url = "https://testviedo-gen.s3.us-west-2.amazonaws.com/"+picture_filename_new
-            return_json = json.dumps({"file_url":file_url})
-
-        return return_json
+
+        file_url = style_convert(item.file_path_s3)
+        return json.dumps({"file_url":file_url})
 
     except ClientError as err:
         message = err.response["Error"]["Message"]
@@ -196,6 +483,125 @@ def nova_canvas(item: Item_design):
         logger.error(err.message)
         print(err.message)
 
-    else:
-        print(
-            f"Finished generating image with Amazon Nova Canvas  model {model_id}.")
+
+@app.post("/style_convert/multi",
+         status_code = status.HTTP_200_OK,
+         tags=["nova_canvas"],
+         summary="multi style convertion",
+         description="Render several styles of one image concurrently, streamed back as NDJSON as each style finishes.",
+         response_description="one JSON line per designed picture")
+def nova_canvas_multi(item: Item_multi_style):
+    if not item.styles:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="styles must not be empty")
+    if len(item.styles) > MAX_STYLES_PER_REQUEST:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {MAX_STYLES_PER_REQUEST} styles per request")
+    names = [style_name(style, index) for index, style in enumerate(item.styles)]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Style names must be unique (after sanitising): {', '.join(duplicates)}")
+    try:
+        results = style_convert_many(item.file_path_s3, item.styles)
+        first = next(results)
+    except ClientError as err:
+        message = err.response["Error"]["Message"]
+        logger.error("A client error occurred: %s", message)
+        if err.response["Error"]["Code"] in ("NoSuchKey", "404", "NotFound"):
+            # 原圖不存在是請求本身的問題
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message)
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=message)
+    except ImageError as err:
+        logger.error(err.message)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=err.message)
+
+    def ndjson():
+        yield json.dumps(first, ensure_ascii=False) + "\n"
+        for result in results:
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@app.post("/style_convert/jobs",
+         status_code = status.HTTP_202_ACCEPTED,
+         tags=["nova_canvas"],
+         summary="submit style convertion job",
+         description="Queue a style convertion and return the job id immediately.",
+         response_description="job id")
+def submit_style_convert_job(item: Item_design):
+    try:
+        job_id = style_jobs.submit(style_convert, item.file_path_s3)
+    except QueueFullError as err:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=err.message)
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/style_convert/jobs/{job_id}",
+         tags=["nova_canvas"],
+         summary="style convertion job status",
+         description="Status of a queued style convertion, with file_url once it succeeded.")
+def get_style_convert_job(job_id: str):
+    job = style_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job not found: {job_id}")
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "file_url": job["result"],
+        "error": job["error"],
+        "submitted_at": job["submitted_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+@app.get("/style_convert/job_stats",
+         tags=["nova_canvas"],
+         summary="style convertion queue statistics",
+         description="Queue depth, running jobs and wait time of the style convertion workers.")
+def style_convert_job_stats():
+    return style_jobs.stats()
+
+
+@app.on_event("shutdown")
+def shutdown_style_jobs():
+    style_jobs.shutdown(wait=False)
+    style_fanout_pool.shutdown(wait=False)
+    if PHASH_INDEX_DIR:
+        with style_indexes_lock:
+            for name, index in style_indexes.items():
+                index.save(os.path.join(PHASH_INDEX_DIR, f"style_convert_{name}"))
+
+
+@app.get("/style_convert/cache_stats",
+         tags=["nova_canvas"],
+         summary="style cache statistics",
+         description="Hit/miss counters of the style convert result cache.")
+def style_cache_stats():
+    return style_cache.stats()
+
+
+@app.get("/style_convert/single_flight_stats",
+         tags=["nova_canvas"],
+         summary="request coalescing statistics",
+         description="How many Nova Canvas calls were saved by sharing in-flight results.")
+def style_single_flight_stats():
+    return style_flight.stats()
+
+
+@app.get("/style_convert/phash_stats",
+         tags=["nova_canvas"],
+         summary="near-duplicate index statistics",
+         description="Size and hit/miss counters of the perceptual-hash indexes, per parameter set.")
+def style_phash_stats():
+    with style_indexes_lock:
+        return {name: index.stats() for name, index in style_indexes.items()}
+
+
+@app.get("/style_convert/preprocess_stats",
+         tags=["nova_canvas"],
+         summary="input preprocessing statistics",
+         description="Bytes saved by right-sizing input images before base64 encoding.")
+def style_preprocess_stats():
+    return preprocess_stats()
@@ -1,17 +1,25 @@
-import boto3
 import os
 import base64
 import io
 import json
 import logging
 import magic
+import threading
+import time
+from collections import deque
 from PIL import Image
-from botocore.config import Config
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, ParamValidationError
 from fastapi import FastAPI, status, HTTPException
 from pydantic import BaseModel
 from dotenv import load_dotenv  # 添加 dotenv 支持
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from aws_clients import get_client, warm_up
+from bedrock_limiter import call_bedrock
+from single_flight import SingleFlight
+import nova_pro_batch
+from phash_index import PerceptualIndex, dhash
 
 
 #===========================S3 Setting===========================
@@ -23,12 +31,22 @@ AWS_SECRET_ACCESS_KEY=os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_SESSION_TOKEN    =os.getenv('AWS_SESSION_TOKEN')  
 #===========================S3 Setting===========================
 
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    aws_session_token=AWS_SESSION_TOKEN
-)
+# 共用 client (見 aws_clients.py), 各請求不再重新建立
+s3 = get_client('s3')
+# 重試由 bedrock_limiter 統一處理, botocore 不再自行重試
+BEDROCK_CLIENT = {'service_name': 'bedrock-runtime', 'region_name': 'us-east-1',
+                  'retries': {'max_attempts': 1, 'mode': 'standard'}}
+
+# 相同 file_path_s3 的並行請求合併為一次模型呼叫
+pro_flight = SingleFlight("image_gen_text")
+
+# 已描述畫格的感知雜湊索引 (payload 為 .txt 的 key), 設定 PHASH_INDEX_DIR 時於啟動 / 關閉時載入 / 儲存
+description_index = PerceptualIndex()
+PHASH_INDEX_DIR = os.getenv('PHASH_INDEX_DIR')
+
+# 串流模式的 time-to-first-token (秒), 保留最近 1000 筆
+stream_ttft = deque(maxlen=1000)
+stream_metrics_lock = threading.Lock()
 
 app = FastAPI()
 
@@ -41,6 +59,19 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def warm_up_clients():
+    warm_up([{'service_name': 's3'}, BEDROCK_CLIENT])
+    if PHASH_INDEX_DIR:
+        description_index.load(os.path.join(PHASH_INDEX_DIR, "image_gen_text"))
+
+
+@app.on_event("shutdown")
+def save_description_index():
+    if PHASH_INDEX_DIR:
+        description_index.save(os.path.join(PHASH_INDEX_DIR, "image_gen_text"))
+
+
 # input: encoded image
 # output: S3 path (designed image)
 
@@ -57,21 +88,42 @@ class ImageError(Exception):
 class Item_design(BaseModel):  
     file_path_s3: str
 
-# 上傳檔案到 S3
-def upload_file_to_s3(bucket_name, local_file_path, s3_file_key):
-    try:
-        s3.upload_file(local_file_path, bucket_name, s3_file_key)
-        print(f"成功上傳 {local_file_path} 到 s3://{bucket_name}/{s3_file_key}")
-    except Exception as e:
-        print("上傳失敗：", e)
+# 批次描述請求: bucket_name 下的 S3 prefix
+class Item_batch(BaseModel):
+    prefix: str = ""
+    skip_described: bool = True
+
+# 單一物件讀入記憶體的上限 (bytes), 超過即拒絕
+# 每個請求的記憶體峰值約為: 原圖 N + base64 4N/3 + 請求 JSON 4N/3 + 回傳文字 (1000 tokens), 即約 3.7N
+MAX_OBJECT_BYTES = int(os.getenv('MAX_OBJECT_BYTES', str(20 * 1024 * 1024)))
 
-# 從 S3 下載檔案到本地
-def download_file_from_s3(bucket_name, s3_file_key, local_file_path):
+# 上傳記憶體中的資料到 S3 (不落地)
+def upload_bytes_to_s3(bucket_name, data, s3_file_key, extra_args=None):
     try:
-        s3.download_file(bucket_name, s3_file_key, local_file_path)
-        print(f"成功從 s3://{bucket_name}/{s3_file_key} 下載到 {local_file_path}")
+        s3.upload_fileobj(io.BytesIO(data), bucket_name, s3_file_key, ExtraArgs=extra_args)
+        print(f"成功上傳 {len(data)} bytes 到 s3://{bucket_name}/{s3_file_key}")
+        return True
     except Exception as e:
-        print("下載失敗：", e)
+        print("上傳失敗：", e)
+        return False
+
+# 從 S3 串流讀取檔案到記憶體 (不落地)
+def read_file_from_s3(bucket_name, s3_file_key, max_bytes=MAX_OBJECT_BYTES):
+    response = s3.get_object(Bucket=bucket_name, Key=s3_file_key)
+    size = response['ContentLength']
+    if size > max_bytes:
+        response['Body'].close()
+        raise ImageError(f"s3://{bucket_name}/{s3_file_key} is {size} bytes, over the {max_bytes} bytes limit")
+
+    # 依 ContentLength 預先配置緩衝區, 逐塊寫入, 不再額外複製
+    data = bytearray(size)
+    view = memoryview(data)
+    offset = 0
+    for chunk in response['Body'].iter_chunks(chunk_size=256 * 1024):
+        view[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    print(f"成功從 s3://{bucket_name}/{s3_file_key} 讀取 {size} bytes")
+    return data
 
 
 # 載入並編碼圖片
@@ -79,6 +131,105 @@ def download_file_from_s3(bucket_name, s3_file_key, local_file_path):
 #     with open(image_path, 'rb') as image_file:
 #         return base64.b64encode(image_file.read()).decode('utf-8')
 
+MODEL_ID = 'us.amazon.nova-pro-v1:0'
+# MODEL_ID = 'anthropic.claude-3-7-sonnet-20250219-v1:0'
+
+PROMPT = "Describe this house design in detail, and suggest the layout of the entire space."
+
+INFERENCE_CONFIG = {
+    "temperature": 0.2,
+    "maxTokens": 1000
+}
+
+
+def build_messages(source_bytes):
+    """
+    Build the Nova Pro messages for one in-memory image.
+    """
+    # # Encode the in-memory image as base64 string.
+    input_image = base64.b64encode(source_bytes).decode('utf8')
+
+    # image_type = magic.from_buffer(input_image, mime=True)
+    image_format = (Image.open(io.BytesIO(source_bytes)).format or "jpeg").lower()
+
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "image": {
+                        "format": image_format,
+                        "source": {"bytes": input_image}
+                    }
+                },
+                {
+                    "text": PROMPT
+                }
+            ]
+        }]
+
+
+def describe_image(picture_filename):
+    """
+    Describe one image with Nova Pro and upload the text next to it in bucket_name_new.
+    Args:
+        picture_filename (str): S3 key of the image in bucket_name.
+    Returns:
+        str: The generated description.
+    Raises:
+        ClientError / ImageError: The pipeline failed.
+    """
+    # 指定你的 S3 bucket 名稱
+    bucket_name = os.getenv('bucket_name')
+    bucket_name_new = os.getenv('bucket_name_new')
+
+    # pure_filename = os.path.basename(picture_filename).split('.')[0]
+    pure_filename = picture_filename.split('.')[0]
+
+    text_filename = pure_filename+".txt"
+
+    # 直接讀入記憶體, 不落地
+    source_bytes = read_file_from_s3(bucket_name, picture_filename)
+
+    # 與已描述過的畫格幾乎相同時, 直接沿用它的描述
+    frame_hash = dhash(source_bytes)
+    neighbour_key, distance = description_index.lookup(frame_hash)
+    if neighbour_key is not None:
+        logger.info("Reusing description %s for %s (hamming distance %d)", neighbour_key, picture_filename, distance)
+        if neighbour_key != text_filename:
+            s3.copy_object(Bucket=bucket_name_new, Key=text_filename,
+                           CopySource={'Bucket': bucket_name_new, 'Key': neighbour_key})
+        return bytes(read_file_from_s3(bucket_name_new, text_filename)).decode("utf-8")
+
+    bedrock = get_client(**BEDROCK_CLIENT)
+
+    body = json.dumps({"messages": build_messages(source_bytes),
+                       "inferenceConfig": INFERENCE_CONFIG})
+
+    accept = "application/json"
+    content_type = "application/json"
+
+    # 呼叫 Nova Pro 模型
+    response = call_bedrock(
+        MODEL_ID, BEDROCK_CLIENT['region_name'], bedrock.invoke_model,
+        body=body, modelId=MODEL_ID, accept=accept, contentType=content_type
+    )
+    # 只有真正呼叫模型的結果, 分享給等待者時才算省下一次呼叫
+    pro_flight.mark_model_call()
+
+    # 回传结果解析
+    result = json.loads(response.get("body").read())
+    # result.get("text", "No description generated")
+    result2 = result["output"]["message"]["content"][0]["text"]
+
+    # upload text to S3 (不落地)
+    if upload_bytes_to_s3(bucket_name_new, result2.encode("utf-8"), text_filename):
+        description_index.add(frame_hash, text_filename)
+    print(
+        f"Finished generating text with Amazon Nova Pro model {MODEL_ID}.")
+    return result2
+
+
 @app.post("/image_gen_text", 
          status_code = status.HTTP_200_OK, 
          tags=["nova_pro"],
@@ -93,93 +244,9 @@ def nova_pro(item: Item_design):
     try:
         logging.basicConfig(level=logging.INFO,
                             format="%(levelname)s: %(message)s")
-        
-        # 指定你的 S3 bucket 名稱
-        bucket_name = os.getenv('bucket_name')
-        bucket_name_new = os.getenv('bucket_name_new')
-
-        picture_filename = item.file_path_s3
-        # pure_filename = os.path.basename(picture_filename).split('.')[0]
-        pure_filename = picture_filename.split('.')[0]
-        
-        download_file_from_s3(bucket_name, picture_filename, picture_filename)
-
-        model_id = 'us.amazon.nova-pro-v1:0'
-        # model_id = 'anthropic.claude-3-7-sonnet-20250219-v1:0'
-
-        # client = AnthropicBedrock(
-        #     aws_access_key=AWS_ACCESS_KEY_ID,
-        #     aws_secret_key=AWS_SECRET_ACCESS_KEY,
-        #     aws_region="us-east-1"
-        # )
-        
-        bedrock = boto3.client(
-            service_name='bedrock-runtime',
-            config=Config(retries={'max_attempts': 3, 'mode': 'standard'}), 
-            region_name="us-east-1"
-        )
-
-        # 準備輸入圖片
-        # filename_list = ['frame_0.png', 'frame_520.png', 'frame_1040.png']  # 替換為您的圖片路徑
-        # input_image = [load_and_encode_image(path) for path in filename_list]
-        
-        # # Read image from file and encode it as base64 string.
-        with open(picture_filename, "rb") as image_file:
-            input_image = base64.b64encode(image_file.read()).decode('utf8')
-
-        # image_type = magic.from_buffer(input_image, mime=True)
-
-        body = json.dumps({"messages": [
-                            {
-                                "role": "user",
-                                "content": [
-                                    {
-                                        "text": "Describe this house design in detail, and suggest the layout of the entire space."
-                                    }
-                                ]
-                            }],
-                            "inferenceConfig": {
-                                "temperature": 0.2,
-                                "maxTokens": 1000
-                            }
-                        })
-
-
-
-        # recipe_content = message.content[0].text
-        # print(recipe_content)
-        # with open("output.txt", "w", encoding="utf-8") as f:
-        #     f.write("這是第一行文字。\n")
-
-        # 呼叫 Nova Pro 模型
-        # response_body = bedrock.invoke_model(
-        #     modelId=model_id,
-        #     contentType="application/json",
-        #     accept="application/json",
-        #     body=payload
-        # )
-
-        accept = "application/json"
-        content_type = "application/json"
-
-        response = bedrock.invoke_model(
-            body=body, modelId=model_id, accept=accept, contentType=content_type
-        )
 
-        # response_body = json.loads(response.get("body").read())
-        # print(response_body)
-
-        # 回传结果解析
-        result = json.loads(response.get("body").read())
-        # result.get("text", "No description generated")
-        result2 = result["output"]["message"]["content"][0]["text"]
-        print(type(result2))
-        text_filename = pure_filename+".txt"
-        with open(text_filename, "w", encoding="utf-8") as f:
-            f.write(result2)
-        
-        # upload file to S3
-        upload_file_to_s3(bucket_name_new, text_filename, text_filename)
+        # 同一張圖同時間只呼叫一次模型, 其他請求共用結果
+        pro_flight.do(item.file_path_s3, describe_image, item.file_path_s3)
 
     except ClientError as err:
         message = err.response["Error"]["Message"]
@@ -190,6 +257,157 @@ def nova_pro(item: Item_design):
         logger.error(err.message)
         print(err.message)
 
-    else:
-        print(
-            f"Finished generating image with Amazon Nova Canvas  model {model_id}.")
+
+@app.get("/image_gen_text/single_flight_stats",
+         tags=["nova_pro"],
+         summary="request coalescing statistics",
+         description="How many Nova Pro calls were saved by sharing in-flight results.")
+def pro_single_flight_stats():
+    return pro_flight.stats()
+
+
+@app.get("/image_gen_text/phash_stats",
+         tags=["nova_pro"],
+         summary="near-duplicate index statistics",
+         description="Size and hit/miss counters of the perceptual-hash description index.")
+def pro_phash_stats():
+    return description_index.stats()
+
+
+def sse_event(data, event=None):
+    "Format one Server-Sent Event."
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def record_ttft(seconds):
+    with stream_metrics_lock:
+        stream_ttft.append(seconds)
+
+
+@app.post("/image_gen_text/stream",
+         status_code = status.HTTP_200_OK,
+         tags=["nova_pro"],
+         summary="generate text (streaming)",
+         description="Stream the description of the image as Server-Sent Events while it is generated.",
+         response_description="text/event-stream of text deltas")
+def nova_pro_stream(item: Item_design):
+    """
+    Streaming variant of /image_gen_text built on invoke_model_with_response_stream.
+    The full text is still uploaded to bucket_name_new once the stream completes.
+    """
+    started = time.perf_counter()
+    bucket_name = os.getenv('bucket_name')
+    bucket_name_new = os.getenv('bucket_name_new')
+    picture_filename = item.file_path_s3
+    pure_filename = picture_filename.split('.')[0]
+
+    try:
+        source_bytes = read_file_from_s3(bucket_name, picture_filename)
+        bedrock = get_client(**BEDROCK_CLIENT)
+        body = json.dumps({"messages": build_messages(source_bytes),
+                           "inferenceConfig": INFERENCE_CONFIG})
+        response = call_bedrock(
+            MODEL_ID, BEDROCK_CLIENT['region_name'], bedrock.invoke_model_with_response_stream,
+            body=body, modelId=MODEL_ID, accept="application/json", contentType="application/json"
+        )
+    except ClientError as err:
+        message = err.response["Error"]["Message"]
+        logger.error("A client error occurred: %s", message)
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=message)
+    except ImageError as err:
+        logger.error(err.message)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=err.message)
+
+    # 串流結束後才由 background task 上傳完整文字
+    parts = []
+    completed = []
+
+    def events():
+        ttft = None
+        try:
+            for event in response.get("body"):
+                chunk = json.loads(event["chunk"]["bytes"]) if "chunk" in event else {}
+                text = chunk.get("contentBlockDelta", {}).get("delta", {}).get("text")
+                if not text:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                    record_ttft(ttft)
+                    logger.info("Nova Pro time to first token: %.0f ms", ttft * 1000)
+                parts.append(text)
+                yield sse_event({"text": text})
+        except ClientError as err:
+            message = err.response["Error"]["Message"]
+            logger.error("A client error occurred while streaming: %s", message)
+            yield sse_event({"error": message}, event="error")
+            return
+        completed.append(True)
+        yield sse_event({
+            "text_file": pure_filename+".txt",
+            "ttft_ms": round(ttft * 1000) if ttft is not None else None,
+            "total_ms": round((time.perf_counter() - started) * 1000),
+        }, event="done")
+
+    def persist():
+        if completed:
+            upload_bytes_to_s3(bucket_name_new, "".join(parts).encode("utf-8"), pure_filename+".txt")
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(persist))
+
+
+@app.get("/image_gen_text/stream_stats",
+         tags=["nova_pro"],
+         summary="streaming latency statistics",
+         description="Time to first token of recent /image_gen_text/stream requests.")
+def pro_stream_stats():
+    with stream_metrics_lock:
+        samples = sorted(stream_ttft)
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "ttft_avg_ms": round(sum(samples) / len(samples) * 1000),
+        "ttft_p50_ms": round(samples[len(samples) // 2] * 1000),
+        "ttft_p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000),
+    }
+
+
+@app.post("/image_gen_text/batch",
+         status_code = status.HTTP_202_ACCEPTED,
+         tags=["nova_pro"],
+         summary="generate text for a whole prefix (batch inference)",
+         description="Submit Bedrock batch inference jobs describing every image under an S3 prefix.",
+         response_description="batch job ARNs")
+def nova_pro_batch_submit(item: Item_batch):
+    try:
+        job_arns = nova_pro_batch.submit_prefix(item.prefix, PROMPT, INFERENCE_CONFIG,
+                                                skip_described=item.skip_described)
+    except (ValueError, ParamValidationError) as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    except ClientError as err:
+        message = err.response["Error"]["Message"]
+        logger.error("A client error occurred: %s", message)
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=message)
+
+    # 由背景執行緒等待完成並拆回各圖的 .txt, 不佔用 HTTP worker
+    for job_arn in job_arns:
+        threading.Thread(target=nova_pro_batch.track_and_fan_out, args=(job_arn,), daemon=True).start()
+    return {"job_arns": job_arns}
+
+
+@app.get("/image_gen_text/batch",
+         tags=["nova_pro"],
+         summary="batch job status",
+         description="Status of a batch inference job submitted by /image_gen_text/batch.")
+def nova_pro_batch_status(job_arn: str):
+    bedrock = get_client('bedrock', region_name=nova_pro_batch.BATCH_REGION)
+    try:
+        job = bedrock.get_model_invocation_job(jobIdentifier=job_arn)
+    except ParamValidationError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    except ClientError as err:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=err.response["Error"]["Message"])
+    return {"job_arn": job_arn, "status": job["status"], "message": job.get("message")}
@@ -0,0 +1,334 @@
+import argparse
+import json
+import logging
+import os
+import posixpath
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv  # 添加 dotenv 支持
+
+from aws_clients import get_client
+
+# Nova Pro 批次描述: 以 Bedrock batch inference 取代大量 on-demand invoke_model
+# 1. 從 S3 prefix 列出圖片, 產生 JSONL records (圖片以 s3Location 引用, 不下載)
+# 2. create_model_invocation_job 送出, get_model_invocation_job 追蹤狀態
+# 3. 完成後把 .jsonl.out 結果拆回每張圖的 .txt (命名與 nova_pro 相同)
+
+load_dotenv('param.env')
+
+logger = logging.getLogger(__name__)
+
+BATCH_MODEL_ID = os.getenv('BATCH_MODEL_ID', 'amazon.nova-pro-v1:0')
+BATCH_REGION = os.getenv('BATCH_REGION', 'us-east-1')
+BATCH_ROLE_ARN = os.getenv('BATCH_ROLE_ARN')
+# Bedrock batch inference 每個 job 有最少 / 最多 record 數限制
+BATCH_MIN_RECORDS = int(os.getenv('BATCH_MIN_RECORDS', '100'))
+BATCH_MAX_RECORDS = int(os.getenv('BATCH_MAX_RECORDS', '50000'))
+
+IMAGE_FORMATS = {".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg", ".gif": "gif", ".webp": "webp"}
+# 查詢 job 狀態連續失敗 (節流、暫時性錯誤) 的重試次數與退避上限
+BATCH_POLL_RETRIES = int(os.getenv('BATCH_POLL_RETRIES', '8'))
+BATCH_POLL_MAX_BACKOFF = float(os.getenv('BATCH_POLL_MAX_BACKOFF', '300'))
+TERMINAL_STATUSES = {"Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired"}
+
+
+def text_key(image_key):
+    "Same naming scheme as nova_pro(): frame_0.png -> frame_0.txt"
+    return image_key.split('.')[0] + ".txt"
+
+
+def list_images(s3, bucket_name, prefix, skip_described_in=None):
+    """
+    List image keys under a prefix with the paginator.
+    Args:
+        skip_described_in (str): Skip images whose .txt already exists in this bucket.
+    """
+    described = set()
+    if skip_described_in:
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=skip_described_in, Prefix=prefix):
+            described.update(obj['Key'] for obj in page.get('Contents', []) if obj['Key'].endswith(".txt"))
+
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if posixpath.splitext(key)[1].lower() in IMAGE_FORMATS and text_key(key) not in described:
+                yield key
+
+
+def record_id(index):
+    "Bedrock batch recordIds are 11 alphanumeric characters; S3 keys (with / . or CJK) are not valid ones."
+    return f"R{index:010d}"
+
+
+def build_record(bucket_name, image_key, prompt, inference_config, record_id):
+    "One JSONL record; modelInput is the same body invoke_model takes."
+    return {
+        "recordId": record_id,
+        "modelInput": {
+            "messages": [{
+                "role": "user",
+                "content": [
+                    {
+                        "image": {
+                            "format": IMAGE_FORMATS[posixpath.splitext(image_key)[1].lower()],
+                            "source": {"s3Location": {"uri": f"s3://{bucket_name}/{image_key}"}}
+                        }
+                    },
+                    {"text": prompt}
+                ]
+            }],
+            "inferenceConfig": inference_config
+        }
+    }
+
+
+def record_keys_key(input_key):
+    "batch-input/job.jsonl -> batch-input/job.keys.json (recordId -> image key)"
+    return posixpath.splitext(input_key)[0] + ".keys.json"
+
+
+def write_batch_input(s3, bucket_name, image_keys, staging_bucket, job_name, prompt, inference_config):
+    """
+    Upload the JSONL record file for one job, and the recordId -> image key mapping next to it.
+    Returns:
+        str: s3:// URI of the input file.
+    """
+    record_keys = {record_id(index): key for index, key in enumerate(image_keys)}
+    body = "\n".join(json.dumps(build_record(bucket_name, key, prompt, inference_config, rid), ensure_ascii=False)
+                     for rid, key in record_keys.items())
+    input_key = f"batch-input/{job_name}.jsonl"
+    s3.put_object(Bucket=staging_bucket, Key=record_keys_key(input_key),
+                  Body=json.dumps(record_keys, ensure_ascii=False).encode("utf-8"))
+    s3.put_object(Bucket=staging_bucket, Key=input_key, Body=body.encode("utf-8"))
+    return f"s3://{staging_bucket}/{input_key}"
+
+
+def load_record_keys(s3, input_uri):
+    "The recordId -> image key mapping written by write_batch_input ({} when missing)."
+    bucket, input_key = _split_uri(input_uri)
+    try:
+        body = s3.get_object(Bucket=bucket, Key=record_keys_key(input_key))['Body'].read()
+    except ClientError as err:
+        logger.error("No recordId mapping for %s: %s", input_uri, err.response["Error"]["Message"])
+        return {}
+    return json.loads(body)
+
+
+def submit_batch_job(bedrock, job_name, input_uri, output_uri, role_arn=BATCH_ROLE_ARN):
+    response = bedrock.create_model_invocation_job(
+        jobName=job_name,
+        roleArn=role_arn,
+        modelId=BATCH_MODEL_ID,
+        inputDataConfig={"s3InputDataConfig": {"s3Uri": input_uri, "s3InputFormat": "JSONL"}},
+        outputDataConfig={"s3OutputDataConfig": {"s3Uri": output_uri}}
+    )
+    logger.info("Submitted batch job %s (%s)", job_name, response["jobArn"])
+    return response["jobArn"]
+
+
+def wait_for_job(bedrock, job_arn, poll_seconds=60, retries=None):
+    """
+    Poll get_model_invocation_job until the job reaches a terminal status.
+    Raises:
+        ClientError: The status query failed more than retries times in a row.
+    """
+    retries = BATCH_POLL_RETRIES if retries is None else retries
+    failures = 0
+    while True:
+        try:
+            job = bedrock.get_model_invocation_job(jobIdentifier=job_arn)
+        except ClientError as err:
+            failures += 1
+            if failures > retries:
+                raise
+            # 指數退避, 不讓一次節流就放棄整個 job 的拆檔
+            backoff = min(BATCH_POLL_MAX_BACKOFF, poll_seconds * 2 ** (failures - 1))
+            logger.warning("get_model_invocation_job failed for %s (%d/%d): %s, retrying in %.0f s",
+                           job_arn, failures, retries, err.response["Error"]["Code"], backoff)
+            time.sleep(backoff)
+            continue
+        failures = 0
+        if job["status"] in TERMINAL_STATUSES:
+            logger.info("Batch job %s finished: %s", job_arn, job["status"])
+            return job
+        time.sleep(poll_seconds)
+
+
+def _split_uri(uri):
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def fan_out_results(s3, job, target_bucket):
+    """
+    Split the .jsonl.out files of a finished job into one .txt object per image.
+    Returns:
+        dict: Counts of written and failed records.
+    """
+    output_bucket, output_prefix = _split_uri(job["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"])
+    job_id = job["jobArn"].rsplit("/", 1)[-1]
+    prefix = posixpath.join(output_prefix, job_id) + "/"
+    record_keys = load_record_keys(s3, job["inputDataConfig"]["s3InputDataConfig"]["s3Uri"])
+
+    written = failed = 0
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=output_bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith(".jsonl.out"):
+                continue
+            body = s3.get_object(Bucket=output_bucket, Key=obj['Key'])['Body']
+            for line in body.iter_lines():
+                if not line:
+                    continue
+                record = json.loads(line)
+                image_key = record_keys.get(record.get("recordId"))
+                if image_key is None:
+                    failed += 1
+                    logger.error("Batch record %s has no image key", record.get("recordId"))
+                    continue
+                output = record.get("modelOutput")
+                if not output:
+                    failed += 1
+                    logger.error("Batch record %s failed: %s", record.get("recordId"), record.get("error"))
+                    continue
+                text = output["output"]["message"]["content"][0]["text"]
+                s3.put_object(Bucket=target_bucket, Key=text_key(image_key), Body=text.encode("utf-8"))
+                written += 1
+    logger.info("Fanned out batch job %s: %d written, %d failed", job_id, written, failed)
+    return {"written": written, "failed": failed}
+
+
+def submit_prefix(prefix, prompt, inference_config, bedrock=None, s3=None,
+                  bucket_name=None, bucket_name_new=None, skip_described=True, role_arn=None):
+    """
+    Build the record files for every image under prefix and submit one job per BATCH_MAX_RECORDS.
+    Args:
+        prompt (str) / inference_config (dict): Same as the on-demand nova_pro() call.
+    Returns:
+        list[str]: The job ARNs.
+    Raises:
+        ValueError: BATCH_ROLE_ARN is not set, or fewer than BATCH_MIN_RECORDS images to describe.
+    """
+    role_arn = role_arn or BATCH_ROLE_ARN
+    if not role_arn:
+        raise ValueError("BATCH_ROLE_ARN is not set; batch inference needs a service role")
+    bedrock = bedrock or get_client('bedrock', region_name=BATCH_REGION)
+    s3 = s3 or get_client('s3')
+    bucket_name = bucket_name or os.getenv('bucket_name')
+    bucket_name_new = bucket_name_new or os.getenv('bucket_name_new')
+
+    keys = list(list_images(s3, bucket_name, prefix, bucket_name_new if skip_described else None))
+    if len(keys) < BATCH_MIN_RECORDS:
+        raise ValueError(f"Only {len(keys)} images under '{prefix}', batch jobs need at least "
+                         f"{BATCH_MIN_RECORDS}; use /image_gen_text instead")
+
+    # 平均分配到各 job, 避免最後一個 job 低於 BATCH_MIN_RECORDS
+    job_count = -(-len(keys) // BATCH_MAX_RECORDS)
+    per_job = -(-len(keys) // job_count)
+    job_arns = []
+    for start in range(0, len(keys), per_job):
+        job_name = f"nova-pro-describe-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:6]}"
+        input_uri = write_batch_input(s3, bucket_name, keys[start:start + per_job],
+                                      bucket_name_new, job_name, prompt, inference_config)
+        job_arns.append(submit_batch_job(bedrock, job_name, input_uri, f"s3://{bucket_name_new}/batch-output/",
+                                         role_arn))
+    return job_arns
+
+
+def track_and_fan_out(job_arn, bedrock=None, s3=None, bucket_name_new=None, poll_seconds=60):
+    """
+    Wait for one job and write its results; meant to run on a background thread.
+    Returns:
+        dict: Counts of written and failed records, plus "error" when tracking gave up.
+    """
+    bedrock = bedrock or get_client('bedrock', region_name=BATCH_REGION)
+    s3 = s3 or get_client('s3')
+    try:
+        job = wait_for_job(bedrock, job_arn, poll_seconds)
+        if job["status"] in ("Completed", "PartiallyCompleted"):
+            return fan_out_results(s3, job, bucket_name_new or os.getenv('bucket_name_new'))
+    except Exception as e:
+        # 背景執行緒沒有人接住例外, 放棄時一定要留下紀錄 (之後可再以 job ARN 手動拆檔)
+        logger.error("Gave up tracking batch job %s: %s", job_arn, e, exc_info=e)
+        return {"written": 0, "failed": 0, "error": str(e)}
+    return {"written": 0, "failed": 0}
+
+
+class LocalBatchClient:
+    """
+    In-process stand-in for the Bedrock batch API (create/get_model_invocation_job).
+
+    Reads the JSONL input from s3, runs every record through invoke(model_id, model_input)
+    and writes <job_id>/<input name>.out exactly where Bedrock would, so the rest of
+    this module can be exercised in tests without a real batch job.
+    """
+
+    def __init__(self, s3, invoke):
+        self.s3 = s3
+        self.invoke = invoke
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create_model_invocation_job(self, jobName, roleArn, modelId, inputDataConfig, outputDataConfig, **kwargs):
+        job_id = uuid.uuid4().hex[:12]
+        job_arn = f"arn:aws:bedrock:local:000000000000:model-invocation-job/{job_id}"
+        job = {
+            "jobArn": job_arn,
+            "jobName": jobName,
+            "modelId": modelId,
+            "roleArn": roleArn,
+            "status": "InProgress",
+            "inputDataConfig": inputDataConfig,
+            "outputDataConfig": outputDataConfig,
+        }
+        with self._lock:
+            self._jobs[job_arn] = job
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return {"jobArn": job_arn}
+
+    def _run(self, job):
+        input_bucket, input_key = _split_uri(job["inputDataConfig"]["s3InputDataConfig"]["s3Uri"])
+        output_bucket, output_prefix = _split_uri(job["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"])
+        body = self.s3.get_object(Bucket=input_bucket, Key=input_key)['Body'].read().decode("utf-8")
+
+        lines = []
+        errors = 0
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            try:
+                record["modelOutput"] = self.invoke(job["modelId"], record["modelInput"])
+            except Exception as e:
+                record["error"] = {"errorMessage": str(e)}
+                errors += 1
+            lines.append(json.dumps(record, ensure_ascii=False))
+
+        job_id = job["jobArn"].rsplit("/", 1)[-1]
+        output_key = posixpath.join(output_prefix, job_id, posixpath.basename(input_key) + ".out")
+        self.s3.put_object(Bucket=output_bucket, Key=output_key, Body="\n".join(lines).encode("utf-8"))
+        with self._lock:
+            job["status"] = "PartiallyCompleted" if errors else "Completed"
+
+    def get_model_invocation_job(self, jobIdentifier):
+        with self._lock:
+            return dict(self._jobs[jobIdentifier])
+
+
+if __name__ == "__main__":
+    from nova_pro import INFERENCE_CONFIG, PROMPT
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Describe every image under an S3 prefix with Bedrock batch inference.")
+    parser.add_argument("--prefix", default="", help="Key prefix in bucket_name")
+    parser.add_argument("--all", action="store_true", help="Also re-describe images that already have a .txt")
+    parser.add_argument("--no-wait", action="store_true", help="Submit and exit without fanning out results")
+    parser.add_argument("--poll-seconds", type=int, default=60)
+    args = parser.parse_args()
+
+    for job_arn in submit_prefix(args.prefix, PROMPT, INFERENCE_CONFIG, skip_described=not args.all):
+        print(job_arn)
+        if not args.no_wait:
+            print(json.dumps(track_and_fan_out(job_arn, poll_seconds=args.poll_seconds)))
@@ -1,16 +1,23 @@
-import boto3
 import os
+import asyncio
 import base64
 import io
 import json
 import logging
+import threading
 from PIL import Image
-from botocore.config import Config
 from botocore.exceptions import ClientError
-from fastapi import FastAPI, status, HTTPException
+from fastapi import FastAPI, Request, status, HTTPException
 from pydantic import BaseModel
+from typing import Optional
 from dotenv import load_dotenv  # 添加 dotenv 支持
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from aws_clients import get_client, warm_up
+from bedrock_limiter import call_bedrock
+from image_preprocess import preprocess_batch
+from keyframe_select import select_keyframes
+from reel_tracker import ReelJobTracker, TERMINAL_STATUSES
 
 
 #===========================S3 Setting===========================
@@ -22,12 +29,28 @@ AWS_SECRET_ACCESS_KEY=os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_SESSION_TOKEN    =os.getenv('AWS_SESSION_TOKEN')  
 #===========================S3 Setting===========================
 
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    aws_session_token=AWS_SESSION_TOKEN
-)
+# 共用 client (見 aws_clients.py), 各請求不再重新建立
+s3 = get_client('s3')
+REEL_MODEL_ID = "amazon.nova-reel-v1:1"
+# 重試由 bedrock_limiter 統一處理, botocore 不再自行重試
+BEDROCK_CLIENT = {'service_name': 'bedrock-runtime', 'region_name': 'us-east-1', 'read_timeout': 300,
+                  'retries': {'max_attempts': 1, 'mode': 'standard'}}
+
+REEL_OUTPUT_S3_URI = "s3://testviedo-gen"
+# MULTI_SHOT_MANUAL 最多 20 個 shot, 第一個是純文字 shot
+REEL_MAX_IMAGE_SHOTS = 19
+
+# 影片工作追蹤 (單一輪詢執行緒, 狀態存於 REEL_JOBS_DB); 啟動時才建立, import 本模組不會產生資料庫檔案
+reel_tracker = None
+reel_tracker_lock = threading.Lock()
+
+
+def get_reel_tracker():
+    global reel_tracker
+    with reel_tracker_lock:
+        if reel_tracker is None:
+            reel_tracker = ReelJobTracker(get_client(**BEDROCK_CLIENT), s3, REEL_MODEL_ID)
+        return reel_tracker
 
 app = FastAPI()
 
@@ -40,6 +63,18 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def warm_up_clients():
+    warm_up([{'service_name': 's3'}, BEDROCK_CLIENT])
+    get_reel_tracker().start()
+
+
+@app.on_event("shutdown")
+def stop_reel_tracker():
+    if reel_tracker is not None:
+        reel_tracker.stop()
+
+
 # input: encoded image
 # output: S3 path (designed image)
 
@@ -55,31 +90,49 @@ class ImageError(Exception):
 # Item Class 繼承 BaseModel
 class Item_design(BaseModel):  
     file_path_s3: str
+    # 指定影片時改由場景切換自動挑選 shots 張關鍵畫格, 取代固定的 frame_0 / frame_1040
+    video_path_s3: Optional[str] = None
+    shots: int = 2
 
-# 上傳檔案到 S3
-def upload_file_to_s3(bucket_name, local_file_path, s3_file_key):
-    try:
-        s3.upload_file(local_file_path, bucket_name, s3_file_key)
-        print(f"成功上傳 {local_file_path} 到 s3://{bucket_name}/{s3_file_key}")
-    except Exception as e:
-        print("上傳失敗：", e)
+# 單一物件讀入記憶體的上限 (bytes), 超過即拒絕
+# 每個請求的記憶體峰值約為: 每張畫格 N + 1280x720 RGB (2.7 MB) + PNG 與 base64 (約 3 MB), 兩張畫格約 2N + 12 MB
+MAX_OBJECT_BYTES = int(os.getenv('MAX_OBJECT_BYTES', str(20 * 1024 * 1024)))
 
-# 從 S3 下載檔案到本地
-def download_file_from_s3(bucket_name, s3_file_key, local_file_path):
+# 上傳記憶體中的資料到 S3 (不落地)
+def upload_bytes_to_s3(bucket_name, data, s3_file_key, extra_args=None):
     try:
-        s3.download_file(bucket_name, s3_file_key, local_file_path)
-        print(f"成功從 s3://{bucket_name}/{s3_file_key} 下載到 {local_file_path}")
+        s3.upload_fileobj(io.BytesIO(data), bucket_name, s3_file_key, ExtraArgs=extra_args)
+        print(f"成功上傳 {len(data)} bytes 到 s3://{bucket_name}/{s3_file_key}")
+        return True
     except Exception as e:
-        print("下載失敗：", e)
-
-def image_to_base64(image_path: str):
+        print("上傳失敗：", e)
+        return False
+
+# 從 S3 串流讀取檔案到記憶體 (不落地)
+def read_file_from_s3(bucket_name, s3_file_key, max_bytes=MAX_OBJECT_BYTES):
+    response = s3.get_object(Bucket=bucket_name, Key=s3_file_key)
+    size = response['ContentLength']
+    if size > max_bytes:
+        response['Body'].close()
+        raise ImageError(f"s3://{bucket_name}/{s3_file_key} is {size} bytes, over the {max_bytes} bytes limit")
+
+    # 依 ContentLength 預先配置緩衝區, 逐塊寫入, 不再額外複製
+    data = bytearray(size)
+    view = memoryview(data)
+    offset = 0
+    for chunk in response['Body'].iter_chunks(chunk_size=256 * 1024):
+        view[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    print(f"成功從 s3://{bucket_name}/{s3_file_key} 讀取 {size} bytes")
+    return data
+
+def image_to_base64(image_bytes):
     """
-    Convert an image file to a base64 encoded string.
+    Convert encoded image bytes to a base64 encoded string.
     """
 
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read())
-        return encoded_string.decode("utf-8")
+    encoded_string = base64.b64encode(image_bytes)
+    return encoded_string.decode("utf-8")
 
 
 # 載入並編碼圖片
@@ -109,22 +162,34 @@ def nova_reel(item: Item_design):
         picture_filename = item.file_path_s3
         # pure_filename = os.path.basename(picture_filename).split('.')[0]
         pure_filename = picture_filename.split('.')[0]
-        
-        download_file_from_s3(bucket_name, picture_filename, picture_filename)
 
-
-
-        # 開啟圖片
-        img_0 = Image.open("frame_0.png")
-        img_1040 = Image.open("frame_1040.png")
         new_size = (1280, 720)  # 寬度, 高度
-        # 調整圖片大小
-        resized_img_0 = img_0.resize(new_size, Image.Resampling.LANCZOS)
-        resized_img_1040 = img_1040.resize(new_size, Image.Resampling.LANCZOS)
-
-        # 儲存調整後的圖片
-        resized_img_0.save("output_frame_0.png")
-        resized_img_1040.save("output_frame_1040.png")
+        if item.video_path_s3:
+            if not 1 <= item.shots <= REEL_MAX_IMAGE_SHOTS:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"shots must be between 1 and {REEL_MAX_IMAGE_SHOTS}")
+            # ffmpeg 以 presigned URL 直接讀取 S3 上的影片 (range request), 不落地
+            video_url = s3.generate_presigned_url(
+                'get_object', Params={'Bucket': bucket_name, 'Key': item.video_path_s3}, ExpiresIn=3600)
+            # 挑出的畫格已是 1280x720 JPEG
+            try:
+                keyframes = [(frame, "jpeg") for frame, _ in select_keyframes(video_url, item.shots, new_size)]
+            except RuntimeError as err:
+                # ffmpeg 無法讀取 / 解碼影片 (不存在、格式錯誤)
+                logger.error("Keyframe selection failed for %s: %s", item.video_path_s3, err)
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"Could not decode video {item.video_path_s3}: {err}")
+            if len(keyframes) < item.shots:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"Video {item.video_path_s3} only yielded {len(keyframes)} distinct "
+                                           f"frames, {item.shots} shots requested")
+        else:
+            # 讀取圖片 (直接從 S3 讀入記憶體, 不落地)
+            frames = [read_file_from_s3(bucket_name, "frame_0.png"),
+                      read_file_from_s3(bucket_name, "frame_1040.png")]
+            # 調整圖片大小並依內容選擇 JPEG / PNG (在 process pool 中執行)
+            keyframes = [(resized, image_format) for resized, image_format, _ in preprocess_batch(
+                frames, new_size, mode="exact")]
 
 
         # 準備輸入圖片
@@ -157,30 +222,20 @@ def nova_reel(item: Item_design):
             "multiShotManualParams": {
                 "shots": [
                     {"text": "Modernize the house, photo-realistic, 8k, hdr"},
+                ] + [
                     {
                         "text": "Convert the layout here into a modern style, and need to describe the details.",
                         "image": {
-                            "format": "png",  # Must be "png" or "jpeg"
-                            "source": {"bytes": image_to_base64("/home/ubuntu/output_frame_0.png")},
+                            "format": image_format,  # Must be "png" or "jpeg"
+                            "source": {"bytes": image_to_base64(image)},
                             # "source": {
                             #     "s3Location": {
                             #         "uri": "s3://testviedo/frame_0.png"
                             #     }
                             # },
                         },
-                    },
-                    {
-                        "text": "Convert the layout here into a modern style, and need to describe the details.",
-                        "image": {
-                            "format": "png",  # Must be "png" or "jpeg"
-                            "source": {"bytes": image_to_base64("/home/ubuntu/output_frame_1040.png")},
-                            # "source": {
-                            #     "s3Location": {
-                            #         "uri": "s3:///testviedo/frame_1040.png"
-                            #     }
-                            # },
-                        },
-                    },
+                    }
+                    for image, image_format in keyframes
                 ]
             },
             "videoGenerationConfig": {
@@ -192,11 +247,7 @@ def nova_reel(item: Item_design):
 
 
         try:
-            bedrock_runtime = boto3.client(
-                service_name='bedrock-runtime',
-                config=Config(read_timeout=300), 
-                region_name="us-east-1"
-            )
+            bedrock_runtime = get_client(**BEDROCK_CLIENT)
 
             # accept = "application/json"
             # content_type = "application/json"
@@ -214,15 +265,23 @@ def nova_reel(item: Item_design):
             # logger.info(
             #     "Successfully generated image with Amazon Nova Canvas model %s", model_id)
             # Start the asynchronous video generation job.
-            invocation = bedrock_runtime.start_async_invoke(
-                modelId="amazon.nova-reel-v1:1",
+            invocation = call_bedrock(
+                REEL_MODEL_ID, BEDROCK_CLIENT['region_name'], bedrock_runtime.start_async_invoke,
+                modelId=REEL_MODEL_ID,
                 modelInput=model_input,
-                outputDataConfig={"s3OutputDataConfig": {"s3Uri": "s3://testviedo-gen"}},
+                outputDataConfig={"s3OutputDataConfig": {"s3Uri": REEL_OUTPUT_S3_URI}},
             )
 
             # Print the response JSON.
             print(json.dumps(invocation, indent=2, default=str))
 
+            # 交給 tracker 追蹤完成狀態, 前端以 /reel_jobs/{job_id} 查詢或訂閱 SSE
+            job_id = get_reel_tracker().track(invocation["invocationArn"], {
+                "file_path_s3": picture_filename,
+                "output_s3_uri": REEL_OUTPUT_S3_URI,
+            })
+            return {"job_id": job_id, "invocation_arn": invocation["invocationArn"], "status": "InProgress"}
+
         except Exception as err:
             print("Exception:")
             if hasattr(err, "response"):
@@ -244,3 +303,69 @@ def nova_reel(item: Item_design):
         print(f"Finished generating image with Amazon Nova Reel model.")
 
 
+def reel_job_view(job):
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "file_path_s3": job["metadata"].get("file_path_s3"),
+        "output_uri": job["output_uri"],
+        "video_url": job["video_url"],
+        "failure_message": job["failure_message"],
+        "submitted_at": job["submitted_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+@app.get("/reel_jobs/{job_id}",
+         tags=["nova_reel"],
+         summary="video job status",
+         description="Status of a Nova Reel job, with a presigned video_url once it completed.")
+def get_reel_job(job_id: str):
+    job = get_reel_tracker().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job not found: {job_id}")
+    return reel_job_view(job)
+
+
+@app.get("/reel_jobs/{job_id}/events",
+         tags=["nova_reel"],
+         summary="video job status events",
+         description="Server-Sent Events stream that pushes the job status once it completes or fails.")
+async def reel_job_events(job_id: str, request: Request):
+    job = get_reel_tracker().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job not found: {job_id}")
+
+    loop = asyncio.get_running_loop()
+    updates = asyncio.Queue()
+
+    def on_update(updated_job):
+        loop.call_soon_threadsafe(updates.put_nowait, updated_job)
+
+    async def events():
+        get_reel_tracker().subscribe(job_id, on_update)
+        try:
+            current = get_reel_tracker().get(job_id)
+            yield f"event: status\ndata: {json.dumps(reel_job_view(current))}\n\n"
+            while current["status"] not in TERMINAL_STATUSES:
+                try:
+                    current = await asyncio.wait_for(updates.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: status\ndata: {json.dumps(reel_job_view(current))}\n\n"
+        finally:
+            get_reel_tracker().unsubscribe(job_id, on_update)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/reel_jobs",
+         tags=["nova_reel"],
+         summary="video job counts",
+         description="Number of tracked Nova Reel jobs per status.")
+def reel_job_stats():
+    return get_reel_tracker().stats()
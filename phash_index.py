@@ -0,0 +1,139 @@
+import io
+import json
+import logging
+import os
+import threading
+from itertools import combinations
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 感知雜湊近似重複索引: 連續畫格 (frame_0 / frame_520 / frame_1040 ...) 常幾乎相同,
+# 漢明距離在門檻內就直接沿用已產生的描述 / 風格圖, 不再呼叫 Bedrock
+# 查詢用 multi-index hashing: 64-bit 雜湊切成 4 段 16-bit, 距離 <= r 的雜湊
+# 至少有一段與查詢相差 <= r // 4 位元, 先查段表取候選, 再用 NumPy 向量化驗證完整距離
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+PHASH_THRESHOLD = int(os.getenv('PHASH_THRESHOLD', '4'))
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_DCT_SIZE = 32
+_DCT = np.sqrt(2 / _DCT_SIZE) * np.cos(
+    np.pi * np.outer(np.arange(_DCT_SIZE), 2 * np.arange(_DCT_SIZE) + 1) / (2 * _DCT_SIZE))
+_DCT[0] /= np.sqrt(2)
+
+
+def _grayscale(data, size):
+    image = Image.open(io.BytesIO(data))
+    image.draft("L", (size[0] * 4, size[1] * 4))
+    return np.asarray(image.convert("L").resize(size, Image.Resampling.BILINEAR), dtype=np.float32)
+
+
+def _pack(bits):
+    return int(np.packbits(bits.astype(np.uint8).ravel()).view(">u8")[0])
+
+
+def dhash(data):
+    "64-bit difference hash of an encoded image."
+    pixels = _grayscale(data, (9, 8))
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(data):
+    "64-bit DCT perceptual hash of an encoded image."
+    pixels = _grayscale(data, (_DCT_SIZE, _DCT_SIZE))
+    low = (_DCT @ pixels @ _DCT.T)[:8, :8]
+    return _pack(low > np.median(low))
+
+
+def hamming(a, hashes):
+    "Hamming distance between hash a and every uint64 in hashes."
+    xor = np.bitwise_xor(hashes, np.uint64(a))
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _chunks(value):
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * i)) & mask for i in range(CHUNKS)]
+
+
+def _neighbours(chunk, radius):
+    "Every CHUNK_BITS-bit value within radius bits of chunk."
+    yield chunk
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            yield flipped
+
+
+class PerceptualIndex:
+    "Multi-index hashing over 64-bit perceptual hashes, each mapped to a payload"
+
+    def __init__(self):
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._payloads = []
+        self._tables = [dict() for _ in range(CHUNKS)]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def add(self, value, payload):
+        with self._lock:
+            item = len(self._payloads)
+            if item == len(self._hashes):
+                self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+            self._hashes[item] = value
+            self._payloads.append(payload)
+            for table, chunk in zip(self._tables, _chunks(value)):
+                table.setdefault(chunk, []).append(item)
+
+    def lookup(self, value, threshold=PHASH_THRESHOLD):
+        """
+        Find the closest indexed hash within threshold bits.
+        Returns:
+            (payload, distance) or (None, None).
+        """
+        radius = threshold // CHUNKS
+        with self._lock:
+            candidates = set()
+            for table, chunk in zip(self._tables, _chunks(value)):
+                for neighbour in _neighbours(chunk, radius):
+                    candidates.update(table.get(neighbour, ()))
+            if candidates:
+                items = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+                distances = hamming(value, self._hashes[items])
+                best = int(np.argmin(distances))
+                if distances[best] <= threshold:
+                    self.hits += 1
+                    return self._payloads[items[best]], int(distances[best])
+            self.misses += 1
+            return None, None
+
+    def save(self, path):
+        with self._lock:
+            count = len(self._payloads)
+            np.save(path + ".npy", self._hashes[:count])
+            with open(path + ".json", "w", encoding="utf-8") as f:
+                json.dump(self._payloads, f, ensure_ascii=False)
+
+    def load(self, path):
+        if not os.path.exists(path + ".npy"):
+            return
+        hashes = np.load(path + ".npy")
+        with open(path + ".json", encoding="utf-8") as f:
+            payloads = json.load(f)
+        for value, payload in zip(hashes.tolist(), payloads):
+            self.add(int(value), payload)
+        logger.info("Loaded %d perceptual hashes from %s", len(payloads), path)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._payloads), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from bedrock_limiter import call_bedrock
+
+logger = logging.getLogger(__name__)
+
+# Nova Reel 非同步影片工作追蹤
+# 每個 invocationArn 連同請求資料存進 SQLite, 由單一背景執行緒輪詢:
+# 每輪只呼叫一次 (分頁的) list_async_invokes 取回所有到期工作的狀態, 不必一個工作一個執行緒
+# 每個工作的輪詢間隔以指數退避增加; 完成後解析 output.mp4 的 s3Uri 並產生 presigned URL
+# 預設放在本模組旁 (絕對路徑), 不隨啟動時的工作目錄改變
+REEL_JOBS_DB = os.path.abspath(os.getenv('REEL_JOBS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                      'reel_jobs.db')))
+POLL_MIN_SECONDS = float(os.getenv('REEL_POLL_MIN_SECONDS', '15'))
+POLL_MAX_SECONDS = float(os.getenv('REEL_POLL_MAX_SECONDS', '120'))
+PRESIGN_SECONDS = int(os.getenv('REEL_PRESIGN_SECONDS', '3600'))
+
+TERMINAL_STATUSES = {"Completed", "Failed"}
+
+
+def job_id_of(invocation_arn):
+    return invocation_arn.rsplit("/", 1)[-1]
+
+
+class ReelJobTracker:
+    "Persists Nova Reel invocations and polls them in batches with exponential backoff"
+
+    def __init__(self, bedrock, s3, model_id, db_path=REEL_JOBS_DB):
+        """
+        Args:
+            bedrock: bedrock-runtime client.
+            model_id (str): Model whose bedrock_limiter bucket the status queries share.
+        """
+        self.bedrock = bedrock
+        self.s3 = s3
+        self.model_id = model_id
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS reel_jobs (
+                job_id TEXT PRIMARY KEY,
+                invocation_arn TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                status TEXT NOT NULL,
+                submitted_at REAL NOT NULL,
+                next_poll_at REAL NOT NULL,
+                poll_interval REAL NOT NULL,
+                output_uri TEXT,
+                video_url TEXT,
+                url_expires_at REAL,
+                failure_message TEXT,
+                updated_at REAL NOT NULL
+            )""")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._listeners = {}  # job_id -> [callback(job)]
+
+    def track(self, invocation_arn, metadata):
+        "Persist a new invocation and schedule its first poll."
+        now = time.time()
+        job_id = job_id_of(invocation_arn)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO reel_jobs (job_id, invocation_arn, metadata, status, submitted_at, "
+                "next_poll_at, poll_interval, updated_at) VALUES (?, ?, ?, 'InProgress', ?, ?, ?, ?)",
+                (job_id, invocation_arn, json.dumps(metadata, ensure_ascii=False), now,
+                 now + POLL_MIN_SECONDS, POLL_MIN_SECONDS, now))
+            self._db.commit()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM reel_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["metadata"] = json.loads(job["metadata"])
+        # 完成後 presigned URL 快過期時重新簽
+        if job["status"] == "Completed" and (job["url_expires_at"] or 0) - time.time() < PRESIGN_SECONDS / 4:
+            job = self._complete(job, job["output_uri"])
+        return job
+
+    def subscribe(self, job_id, callback):
+        "callback(job) is called from the poller thread on every status change."
+        with self._lock:
+            self._listeners.setdefault(job_id, []).append(callback)
+
+    def unsubscribe(self, job_id, callback):
+        with self._lock:
+            callbacks = self._listeners.get(job_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._listeners.pop(job_id, None)
+
+    def _notify(self, job_id):
+        with self._lock:
+            callbacks = list(self._listeners.get(job_id, []))
+        if callbacks:
+            job = self.get(job_id)
+            for callback in callbacks:
+                try:
+                    callback(job)
+                except Exception as e:
+                    logger.error("Reel job listener failed: %s", e)
+
+    def _due_jobs(self, now):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM reel_jobs WHERE status NOT IN ('Completed', 'Failed') AND next_poll_at <= ?",
+                (now,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def _next_wakeup(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(next_poll_at) FROM reel_jobs WHERE status NOT IN ('Completed', 'Failed')").fetchone()
+        return row[0]
+
+    def _list_statuses(self, since):
+        "One paginated list_async_invokes call covering every job submitted since `since`."
+        statuses = {}
+        kwargs = {"submitTimeAfter": datetime.fromtimestamp(since - 60, tz=timezone.utc), "maxResults": 1000}
+        while True:
+            # 狀態查詢與送出工作共用同一個限流桶, 節流時一起減速
+            response = call_bedrock(self.model_id, self.bedrock.meta.region_name, self.bedrock.list_async_invokes,
+                                    **kwargs)
+            for summary in response.get("asyncInvokeSummaries", []):
+                statuses[job_id_of(summary["invocationArn"])] = summary
+            if not response.get("nextToken"):
+                return statuses
+            kwargs["nextToken"] = response["nextToken"]
+
+    def _complete(self, job, output_uri):
+        bucket, _, prefix = output_uri[len("s3://"):].partition("/")
+        key = (prefix.rstrip("/") + "/output.mp4").lstrip("/")
+        video_url = self.s3.generate_presigned_url(
+            'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=PRESIGN_SECONDS)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE reel_jobs SET status = 'Completed', output_uri = ?, video_url = ?, url_expires_at = ?, "
+                "updated_at = ? WHERE job_id = ?",
+                (output_uri, video_url, now + PRESIGN_SECONDS, now, job["job_id"]))
+            self._db.commit()
+        job.update(status="Completed", output_uri=output_uri, video_url=video_url,
+                   url_expires_at=now + PRESIGN_SECONDS, updated_at=now)
+        return job
+
+    def _defer(self, due, now):
+        "Push the due jobs back with a doubled interval after a failed status query."
+        with self._lock:
+            for job in due:
+                interval = max(POLL_MIN_SECONDS, min(POLL_MAX_SECONDS, job["poll_interval"] * 2))
+                self._db.execute(
+                    "UPDATE reel_jobs SET next_poll_at = ?, poll_interval = ? WHERE job_id = ?",
+                    (now + interval, interval, job["job_id"]))
+            self._db.commit()
+
+    def poll_once(self):
+        "Refresh every due job with a single batched status query."
+        now = time.time()
+        due = self._due_jobs(now)
+        if not due:
+            return 0
+        try:
+            statuses = self._list_statuses(min(job["submitted_at"] for job in due))
+        except Exception:
+            # 節流或權限錯誤時 next_poll_at 不會前進, 不延後的話 _run 會立刻再查一次而空轉
+            self._defer(due, now)
+            raise
+
+        changed = []
+        for job in due:
+            summary = statuses.get(job["job_id"])
+            if summary is None:
+                # 不在清單中 (例如提交時間早於篩選範圍), 單獨查詢
+                try:
+                    summary = call_bedrock(self.model_id, self.bedrock.meta.region_name,
+                                           self.bedrock.get_async_invoke, invocationArn=job["invocation_arn"])
+                except ClientError as err:
+                    logger.error("get_async_invoke failed for %s: %s", job["job_id"], err)
+                    summary = {"status": job["status"]}
+
+            status = summary.get("status", job["status"])
+            if status == "Completed":
+                self._complete(job, summary["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"])
+                changed.append(job["job_id"])
+            elif status == "Failed":
+                with self._lock:
+                    self._db.execute(
+                        "UPDATE reel_jobs SET status = 'Failed', failure_message = ?, updated_at = ? WHERE job_id = ?",
+                        (summary.get("failureMessage"), now, job["job_id"]))
+                    self._db.commit()
+                changed.append(job["job_id"])
+            else:
+                interval = min(POLL_MAX_SECONDS, job["poll_interval"] * 2)
+                with self._lock:
+                    self._db.execute(
+                        "UPDATE reel_jobs SET status = ?, next_poll_at = ?, poll_interval = ?, updated_at = ? "
+                        "WHERE job_id = ?",
+                        (status, now + interval, interval, now, job["job_id"]))
+                    self._db.commit()
+
+        for job_id in changed:
+            logger.info("Nova Reel job %s finished", job_id)
+            self._notify(job_id)
+        return len(due)
+
+    def _run(self):
+        failures = 0
+        while not self._stopped.is_set():
+            try:
+                self.poll_once()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.error("Nova Reel poll cycle failed (%d in a row): %s", failures, e)
+            next_poll = self._next_wakeup()
+            timeout = POLL_MAX_SECONDS if next_poll is None else max(0.0, next_poll - time.time())
+            if failures:
+                # 連續失敗時至少等 POLL_MIN_SECONDS, 並以指數成長, 避免持續對 Bedrock 重試
+                timeout = max(timeout, min(POLL_MAX_SECONDS, POLL_MIN_SECONDS * 2 ** (failures - 1)))
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def start(self):
+        "Start the single poller thread (jobs left unfinished by a restart are picked up again)."
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="reel_tracker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM reel_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
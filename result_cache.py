@@ -0,0 +1,141 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+
+# Nova Canvas 風格轉換結果快取
+# 第一層: 行程內 LRU (cache_key -> file_url)
+# 第二層: S3 上既有的 _designed.jpg, 以物件 Metadata 的 cache-key 對應
+CACHE_METADATA_KEY = "cache-key"
+
+
+def canonical_params(variation_params, generation_config):
+    """
+    Canonicalize the Nova Canvas request parameters (without the input images).
+    Args:
+        variation_params (dict): imageVariationParams, "images" is ignored.
+        generation_config (dict): imageGenerationConfig.
+    Returns:
+        str: JSON string with sorted keys and no whitespace.
+    """
+    params = {k: v for k, v in variation_params.items() if k != "images"}
+    return json.dumps(
+        {"imageVariationParams": params, "imageGenerationConfig": generation_config},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+
+
+def source_digest(source_bytes):
+    return hashlib.sha256(source_bytes).hexdigest()
+
+
+def make_cache_key(source_hash, variation_params, generation_config):
+    """
+    Build the content-addressed key from the source hash and the canonical params.
+    Args:
+        source_hash (str): source_digest() of the input image bytes.
+    """
+    digest = hashlib.sha256()
+    digest.update(source_hash.encode("ascii"))
+    digest.update(canonical_params(variation_params, generation_config).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class StyleResultCache:
+    "Two-tier cache for Nova Canvas outputs: bounded in-process LRU + S3 _designed.jpg objects"
+
+    def __init__(self, s3_client, bucket_name, max_entries=256):
+        self.s3 = s3_client
+        self.bucket_name = bucket_name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # cache_key -> (s3_key, file_url)
+        self._digests = OrderedDict()  # (source key, ETag) -> source_digest, 命中時可省下載
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.s3_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remember(self, cache_key, s3_key, file_url):
+        with self._lock:
+            # 同一個 _designed.jpg 只會對應最新的參數, 舊的對應要移除
+            stale = [k for k, v in self._entries.items() if v[0] == s3_key and k != cache_key]
+            for k in stale:
+                del self._entries[k]
+            self._entries[cache_key] = (s3_key, file_url)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def lookup_digest(self, source_key, etag):
+        with self._lock:
+            digest = self._digests.get((source_key, etag))
+            if digest is not None:
+                self._digests.move_to_end((source_key, etag))
+            return digest
+
+    def remember_digest(self, source_key, etag, digest):
+        with self._lock:
+            self._digests[(source_key, etag)] = digest
+            self._digests.move_to_end((source_key, etag))
+            while len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+
+    def get(self, cache_key, s3_key, file_url):
+        """
+        Look up a rendered output.
+        Args:
+            cache_key (str): Key from make_cache_key().
+            s3_key (str): The _designed.jpg key this request would write.
+            file_url (str): Public URL of s3_key.
+        Returns:
+            str or None: The cached file_url, None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                self.memory_hits += 1
+                return entry[1]
+
+        # 第二層: 檢查 S3 上的 _designed.jpg 是否就是這組參數產生的
+        try:
+            head = self.s3.head_object(Bucket=self.bucket_name, Key=s3_key)
+        except ClientError:
+            head = None
+        if head is not None and head.get("Metadata", {}).get(CACHE_METADATA_KEY) == cache_key:
+            self._remember(cache_key, s3_key, file_url)
+            with self._lock:
+                self.s3_hits += 1
+            return file_url
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, cache_key, s3_key, file_url):
+        self._remember(cache_key, s3_key, file_url)
+
+    @staticmethod
+    def upload_extra_args(cache_key):
+        "ExtraArgs for upload_file so the S3 tier can recognise the object later."
+        return {"Metadata": {CACHE_METADATA_KEY: cache_key}}
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.s3_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "s3_hits": self.s3_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.memory_hits + self.s3_hits) / lookups if lookups else 0.0,
+            }
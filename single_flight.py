@@ -0,0 +1,81 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.model_called = False
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls with the same key: the first caller runs fn,
+    callers arriving while it is in flight wait and share its result or error.
+    fn calls mark_model_call() when it actually invoked the model (not a cache hit),
+    so only waiters that shared such a successful result count as saved model calls.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+        self.model_calls_saved = 0
+        # 目前執行緒正在以 leader 身分執行的呼叫 (巢狀時以堆疊記錄)
+        self._local = threading.local()
+
+    def mark_model_call(self):
+        "Record that the leader running in this thread invoked the model (no-op outside do())."
+        calls = getattr(self._local, "calls", None)
+        if calls:
+            calls[-1].model_called = True
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            if call.model_called:
+                with self._lock:
+                    self.model_calls_saved += 1
+            return call.result
+
+        if not hasattr(self._local, "calls"):
+            self._local.calls = []
+        self._local.calls.append(call)
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._local.calls.pop()
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "model_calls_saved": self.model_calls_saved,
+            }
@@ -0,0 +1,33 @@
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_preprocess import prepare_image
+
+
+def jpeg(width, height):
+    pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def test_jpeg_larger_than_target_is_resized():
+    data = jpeg(2048, 2048)
+    output, output_format, stats = prepare_image(data, (1024, 1024))
+    assert Image.open(io.BytesIO(output)).size == (1024, 1024)
+    assert output_format == "jpeg"
+    assert stats["output_size"] == [1024, 1024]
+    assert stats["output_bytes"] == len(output) < len(data)
+    assert stats["saved_bytes"] > 0
+
+
+def test_jpeg_at_target_size_keeps_original_bytes():
+    data = jpeg(512, 512)
+    output, output_format, stats = prepare_image(data, (1024, 1024), image_format="JPEG")
+    assert output == data
+    assert stats["saved_bytes"] == 0
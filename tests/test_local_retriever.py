@@ -0,0 +1,76 @@
+import os
+import shutil
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Knowledge_base"))
+from local_retriever import KNOWLEDGE_DIR, BM25Index, LocalRetriever, _rrf, split_articles, tokenize
+
+TEXT = """《室內裝修測試辦法》
+
+第 一 條：法源
+本辦法依建築法第七十七條之二規定訂定之。
+
+第二條：審查許可
+供公眾使用建築物之室內裝修應申請審查許可。
+非供公眾使用建築物，經內政部認有必要時，亦同。
+
+第三十三條：施工
+裝修材料應合於建築技術規則之規定。施工時應設置圍籬。
+"""
+
+
+def test_split_articles_one_passage_per_article():
+    passages = split_articles(TEXT, "室內裝修測試辦法", "knowlege/test.txt")
+    assert [p.article for p in passages] == [1, 2, 33]
+    assert passages[1].text.startswith("供公眾使用建築物")
+    assert passages[2].heading() == "室內裝修測試辦法 第33條 施工"
+    assert passages[2].reference(0.5)["metadata"] == {"doc": "室內裝修測試辦法", "article": 33, "score": 0.5}
+
+
+def test_long_article_is_split_on_sentence_ends():
+    passages = split_articles(TEXT, "室內裝修測試辦法", "knowlege/test.txt", max_chars=30)
+    pieces = [p for p in passages if p.article == 2]
+    assert len(pieces) == 2 and all(piece.text.endswith("。") for piece in pieces)
+
+
+def test_chinese_and_arabic_article_numbers_match():
+    assert "art:33" in tokenize("第三十三條")
+    assert "art:33" in tokenize("第33條")
+    assert "art:33" in tokenize("第３３條")  # 全形數字
+    assert tokenize("圍籬") == ["圍籬"]
+    assert tokenize("設置圍籬") == ["設置", "置圍", "圍籬"]
+
+
+def test_bm25_ranks_cjk_bigram_matches_first():
+    documents = [tokenize(text) for text in ("施工時應設置圍籬", "完工後應申請竣工查驗", "裝修材料應合於規定")]
+    scores = BM25Index(documents).scores(tokenize("竣工查驗"))
+    assert int(np.argmax(scores)) == 1 and scores[0] == scores[2] == 0
+
+
+def test_rrf_rewards_documents_ranked_by_both():
+    fused = _rrf([np.array([2, 0]), np.array([0, 1])], 3)
+    assert int(np.argmax(fused)) == 0 and fused[1] > 0 and fused[2] > 0
+
+
+def test_dense_index_is_memory_mapped_and_reused(tmp_path):
+    corpus = tmp_path / "corpus"
+    shutil.copytree(KNOWLEDGE_DIR, corpus)
+    index_dir = tmp_path / "index"
+    retriever = LocalRetriever(str(corpus), dense="hash", index_dir=str(index_dir))
+    count = retriever.load()
+    assert count > 0 and isinstance(retriever.dense.vectors, np.memmap)
+    assert retriever.dense.vectors.shape[0] == count
+    built = list(index_dir.iterdir())
+    assert len(built) == 1
+
+    # 語料未變: 重新載入直接開啟同一個檔案
+    retriever.load()
+    assert list(index_dir.iterdir()) == built and isinstance(retriever.dense.vectors, np.memmap)
+
+    for query in ("第二十七條", "第27條"):
+        passage, score = retriever.search(query, k=1, mode="hybrid")[0]
+        assert passage.article == 27 and score > 0
+    assert retriever.search("第27條", k=1, mode="bm25")[0][0].article == 27
+    assert len(retriever.search("逃生出口", k=3, mode="dense")) == 3
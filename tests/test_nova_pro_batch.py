@@ -0,0 +1,103 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nova_pro_batch
+from nova_pro_batch import LocalBatchClient, submit_prefix, track_and_fan_out, wait_for_job
+
+
+class FakeBody(io.BytesIO):
+    def iter_lines(self):
+        return self.read().splitlines()
+
+
+class FakeS3:
+    "The handful of S3 calls nova_pro_batch makes, backed by a dict."
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.read()
+        return {}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": Key}}, "GetObject")
+        return {"Body": FakeBody(self.objects[(Bucket, Key)])}
+
+    def get_paginator(self, name):
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix=""):
+                keys = sorted(key for bucket, key in objects if bucket == Bucket and key.startswith(Prefix))
+                return [{"Contents": [{"Key": key} for key in keys]}]
+
+        return Paginator()
+
+
+def describe(model_id, model_input):
+    "Stand-in for invoke_model: echoes the image URI it was given."
+    uri = model_input["messages"][0]["content"][0]["image"]["source"]["s3Location"]["uri"]
+    return {"output": {"message": {"content": [{"text": f"description of {uri}"}]}}}
+
+
+def test_submit_track_and_fan_out(monkeypatch):
+    monkeypatch.setattr(nova_pro_batch, "BATCH_MIN_RECORDS", 1)
+    s3 = FakeS3()
+    keys = ["frames/第 1 張.png", "frames/a.b/frame_0.jpg", "frames/frame_2.jpeg"]
+    for key in keys:
+        s3.put_object(Bucket="source", Key=key, Body=b"image")
+    s3.put_object(Bucket="source", Key="frames/notes.md", Body=b"not an image")
+    batch = LocalBatchClient(s3, describe)
+
+    job_arns = submit_prefix("frames/", "describe", {"maxTokens": 10}, bedrock=batch, s3=s3,
+                             bucket_name="source", bucket_name_new="target", role_arn="arn:aws:iam::0:role/batch")
+    assert len(job_arns) == 1
+
+    # recordId 是合規的 11 字元英數 ID, 不是 S3 key
+    input_key = next(key for bucket, key in s3.objects if bucket == "target" and key.endswith(".jsonl"))
+    records = [json.loads(line) for line in s3.objects[("target", input_key)].decode("utf-8").splitlines()]
+    assert all(len(record["recordId"]) == 11 and record["recordId"].isalnum() for record in records)
+
+    result = track_and_fan_out(job_arns[0], bedrock=batch, s3=s3, bucket_name_new="target", poll_seconds=0.01)
+    assert result == {"written": 3, "failed": 0}
+    for key in keys:
+        text = s3.objects[("target", nova_pro_batch.text_key(key))].decode("utf-8")
+        assert text == f"description of s3://source/{key}"
+
+
+def test_submit_prefix_requires_role(monkeypatch):
+    monkeypatch.setattr(nova_pro_batch, "BATCH_ROLE_ARN", None)
+    with pytest.raises(ValueError):
+        submit_prefix("frames/", "describe", {}, bedrock=object(), s3=FakeS3(), bucket_name="source",
+                      bucket_name_new="target")
+
+
+class FlakyBatch:
+    def __init__(self, failures):
+        self.failures = failures
+
+    def get_model_invocation_job(self, jobIdentifier):
+        if self.failures:
+            self.failures -= 1
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "GetJob")
+        return {"jobArn": jobIdentifier, "status": "Completed"}
+
+
+def test_wait_for_job_retries_throttling():
+    assert wait_for_job(FlakyBatch(2), "arn", poll_seconds=0, retries=3)["status"] == "Completed"
+    with pytest.raises(ClientError):
+        wait_for_job(FlakyBatch(5), "arn", poll_seconds=0, retries=3)
+
+
+def test_track_and_fan_out_reports_giving_up(monkeypatch):
+    monkeypatch.setattr(nova_pro_batch, "BATCH_POLL_RETRIES", 0)
+    result = track_and_fan_out("arn", bedrock=FlakyBatch(1), s3=FakeS3(), bucket_name_new="target", poll_seconds=0)
+    assert result["written"] == 0 and "error" in result
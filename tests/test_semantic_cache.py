@@ -0,0 +1,57 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Knowledge_base"))
+import semantic_cache
+from semantic_cache import SemanticCache
+
+RESPONSE = {"output": "室內裝修應申請審查許可", "citations": []}
+
+
+def test_similar_query_hits_and_unrelated_misses():
+    cache = SemanticCache(threshold=0.85)
+    cache.put("室內裝修需要申請審查許可嗎？", RESPONSE)
+    response, similarity = cache.get("請問 室內裝修要申請審查許可嗎")
+    assert response == RESPONSE and similarity >= 0.85
+    assert cache.get("施工時要設圍籬嗎") == (None, None)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_negation_and_scope_are_matched_exactly():
+    cache = SemanticCache(threshold=0.5)
+    cache.put("供公眾使用建築物的室內裝修", RESPONSE, scope=5)
+    assert cache.get("非供公眾使用建築物的室內裝修", scope=5) == (None, None)
+    assert cache.get("供公眾使用建築物的室內裝修", scope=3) == (None, None)
+    assert cache.get("供公眾使用建築物的室內裝修", scope=5)[0] == RESPONSE
+
+
+def test_lookups_do_not_grow_the_scope_map():
+    cache = SemanticCache(max_entries=4)
+    for max_results in range(100):
+        cache.get("室內裝修審查", scope=max_results)
+    assert len(cache._scope_ids) == 0
+    for max_results in range(100):
+        cache.put(f"室內裝修審查 {max_results}", RESPONSE, scope=max_results)
+    assert len(cache) == 4 and len(cache._scope_ids) <= 5
+    assert cache.get("室內裝修審查 99", scope=99)[0] == RESPONSE
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    cache = SemanticCache(ttl=60)
+    cache.put("室內裝修審查", RESPONSE)
+    now[0] += 59
+    assert cache.get("室內裝修審查")[0] == RESPONSE
+    now[0] += 2
+    assert cache.get("室內裝修審查") == (None, None)
+
+
+def test_version_change_invalidates():
+    cache = SemanticCache()
+    assert not cache.check_version("job-1")
+    cache.put("室內裝修審查", RESPONSE)
+    assert not cache.check_version("job-1")
+    assert cache.check_version("job-2")
+    assert len(cache) == 0 and cache.get("室內裝修審查") == (None, None)
+    assert cache.stats()["invalidations"] == 1 and cache.version == "job-2"